@@ -1,13 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from typing import Annotated
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from backend.schemas import TextSplitRequest, TextSplitResponse, SummarizeRequest, SummarizeResponse, HistoryResponse
-from backend.core import split_text, generate_summary
-from backend.database import Database
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from backend.schemas import TextSplitRequest, TextSplitResponse, SummarizeSettings, SummarizeRequest, SummarizeResponse, HistoryResponse, HistoryDetailResponse, JobResponse, EstimateResponse
+from backend.schemas import SessionCreateRequest, SessionSegmentRequest, SessionResponse, SessionUpdateResponse
+from backend.core import split_text, generate_summary, generate_summary_stream, map_cache, llm_pool, schedulers, prewarm
+from backend.core import SummaryCancelled
+from backend.database import Database, AsyncDatabase, HISTORY_PAGE_SIZE
+from backend.cache import TTLCache, SingleFlight, content_key
+from backend.jobs import JobManager
+from backend.sessions import SessionManager
+from backend.metrics import SummaryStats, registry
+from backend.estimate import estimate_summary
 import time
 import os
+import json
+import tempfile
+import anyio
+import asyncio
+import threading
 import dotenv
 dotenv.load_dotenv()
-app = FastAPI(title="MMSummary API", description="API for meeting minutes summarization")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing here waits on Mongo or tiktoken, so the app serves / as soon as it is imported
+    await async_database.connect()
+    threading.Thread(target=connect_database, name="database-connect", daemon=True).start()
+    if os.environ.get("PREWARM", "1") == "1":
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+    yield
+    job_manager.shutdown()
+    await asyncio.to_thread(database.close)
+    await async_database.close()
+    await llm_pool.aclose()
+
+app = FastAPI(title="MMSummary API", description="API for meeting minutes summarization", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -17,20 +46,112 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-database = Database()
+def connect_database():
+    database.connect()
+    database.history_writer.start()
+    # Records queued before the connection was up were spilled to disk
+    database.history_writer.drain_spill()
+    job_manager.resume()
+
+# Request handlers read through async_database; the history writer and job
+# threads write through the blocking client in database
+database = Database(connect=False)
+async_database = AsyncDatabase()
+
+# Finished summaries, keyed by the normalized request
+summary_cache = TTLCache(
+    ttl=float(os.environ.get("SUMMARY_CACHE_TTL", "3600")),
+    max_entries=int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "256")),
+)
+# Identical /summarize requests that arrive together share one computation
+summary_flight = SingleFlight()
+
+def shared_summary(key, run, cancel=None):
+    """
+    summary_flight.do for a run that may be cancelled: callers that were
+    waiting on a cancelled run start it again instead of failing with it.
+    """
+    while True:
+        try:
+            return summary_flight.do(key, run)
+        except SummaryCancelled:
+            if cancel is not None and cancel.is_set():
+                raise
+
+def summarize_request_key(request: SummarizeRequest):
+    # map_concurrency only changes how fast the summary is produced, not the summary
+    fields = request.model_dump(exclude={"map_concurrency", "test_mode"})
+    return content_key(sorted(fields.items()))
+
+def summary_kwargs(request: SummarizeRequest):
+    return dict(text=request.text, **settings_kwargs(request))
+
+def settings_kwargs(request: SummarizeSettings):
+    return dict(
+        model=request.model,
+        chunk_size_1=request.chunk_size_1,
+        chunk_overlap_1=request.chunk_overlap_1,
+        chunk_size_2=request.chunk_size_2,
+        chunk_overlap_2=request.chunk_overlap_2,
+        token_max=request.token_max,
+        use_map=request.use_map,
+        test_mode=request.test_mode,
+        map_template=request.map_temple,
+        reduce_template=request.reduce_temple,
+        reduce_temperature=request.reduce_temperature,
+        map_concurrency=request.map_concurrency
+    )
+
+def history_record(request: SummarizeRequest, summary, duration, stats=None):
+    return {
+        "text": request.text,
+        "model": request.model,
+        "chunk_size_1": request.chunk_size_1,
+        "chunk_overlap_1": request.chunk_overlap_1,
+        "chunk_size_2": request.chunk_size_2,
+        "chunk_overlap_2": request.chunk_overlap_2,
+        "token_max": request.token_max,
+        "use_map": request.use_map,
+        "summary": summary,
+        "processing_time": duration,
+        "map_temple": request.map_temple,
+        "reduce_temple": request.reduce_temple,
+        "reduce_temperature": request.reduce_temperature,
+        "stats": stats
+    }
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to MMSummary API"}
 
 @app.get("/DB_health")
-def health_check():
+async def health_check():
     try:
-        database.client.admin.command('ping')
+        await async_database.ping()
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "map": map_cache.stats(),
+        "summary": summary_cache.stats(),
+        "summary_in_flight": summary_flight.in_flight(),
+        "llm_clients": llm_pool.stats(),
+        "rate_limits": {provider: scheduler.stats() for provider, scheduler in schedulers.items()},
+    }
+
+registry.add_collector("mmsummary_map_cache", map_cache.stats)
+registry.add_collector("mmsummary_summary_cache", summary_cache.stats)
+registry.add_collector("mmsummary_llm_clients", llm_pool.stats)
+registry.add_collector("mmsummary_rate_limit", lambda: {p: s.stats() for p, s in schedulers.items()}, label="provider")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/split", response_model=TextSplitResponse)
 def api_split_text(request: TextSplitRequest):
     """
@@ -43,17 +164,14 @@ def api_split_text(request: TextSplitRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/summarize", response_model=SummarizeResponse)
-def api_summarize(request: SummarizeRequest):
+@app.post("/estimate", response_model=EstimateResponse)
+def api_estimate(request: SummarizeRequest):
     """
-    Summarize the text
+    Chunk counts, token counts, collapse tree and per-model cost/latency that
+    /summarize would produce for this request, without calling any LLM
     """
-    start_time = time.time()
     try:
-        if not os.environ.get('OPENAI_API_KEY'):
-            raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
-
-        summary = generate_summary(
+        return estimate_summary(
             text=request.text,
             model=request.model,
             chunk_size_1=request.chunk_size_1,
@@ -62,46 +180,329 @@ def api_summarize(request: SummarizeRequest):
             chunk_overlap_2=request.chunk_overlap_2,
             token_max=request.token_max,
             use_map=request.use_map,
-            test_mode=request.test_mode,
             map_template=request.map_temple,
             reduce_template=request.reduce_temple,
-            reduce_temperature=request.reduce_temperature
+            map_concurrency=request.map_concurrency,
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/summarize", response_model=SummarizeResponse)
+def api_summarize(request: SummarizeRequest):
+    """
+    Summarize the text
+    """
+    start_time = time.time()
+    try:
+        if not os.environ.get('OPENAI_API_KEY'):
+            raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
+
+        def run():
+            stats = SummaryStats(request.model)
+            return generate_summary(**summary_kwargs(request), stats=stats), stats.to_dict()
+
+        if request.test_mode:
+            summary, stats = run()
+        else:
+            key = summarize_request_key(request)
+            summary = summary_cache.get(key)
+            if summary is not None:
+                return SummarizeResponse(summary=summary, processing_time=time.time() - start_time, cached=True)
+
+            def run_and_cache():
+                result = run()
+                summary_cache.set(key, result[0])
+                return result
+
+            (summary, stats), shared = shared_summary(key, run_and_cache)
+            if shared:
+                return SummarizeResponse(summary=summary, processing_time=time.time() - start_time, cached=True)
         
         duration = time.time() - start_time
         
         if not request.test_mode:
-            database.insert_history({
-                "text": request.text,
-                "model": request.model,
-                "chunk_size_1": request.chunk_size_1,
-                "chunk_overlap_1": request.chunk_overlap_1,
-                "chunk_size_2": request.chunk_size_2,
-                "chunk_overlap_2": request.chunk_overlap_2,
-                "token_max": request.token_max,
-                "use_map": request.use_map,
-                "summary": summary,
-                "processing_time": duration,
-                "map_temple": request.map_temple,
-                "reduce_temple": request.reduce_temple,
-                "reduce_temperature": request.reduce_temperature
-            })
-        return SummarizeResponse(summary=summary, processing_time=duration)
+            database.queue_history(history_record(request, summary, duration, stats))
+        return SummarizeResponse(summary=summary, processing_time=duration, stats=stats)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Uploads up to this size are kept (in memory, then in a temp file) to be saved in the history
+UPLOAD_HISTORY_MAX_BYTES = int(os.environ.get("UPLOAD_HISTORY_MAX_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+def iter_request_body(request: Request):
+    """The request body as it arrives, for handlers running in the threadpool."""
+    stream = request.stream()
+    while True:
+        try:
+            part = anyio.from_thread.run(stream.__anext__)
+        except StopAsyncIteration:
+            return
+        if part:
+            yield part
+
+@app.post("/summarize/upload", response_model=SummarizeResponse)
+def api_summarize_upload(request: Request, settings: Annotated[SummarizeSettings, Query()]):
+    """
+    Summarize a UTF-8 transcript sent as the raw request body, with the
+    settings as query parameters. The body is chunked and mapped while it is
+    being received, so memory does not grow with the transcript length.
+    """
+    if not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
+    start_time = time.time()
+    try:
+        stats = SummaryStats(settings.model)
+        save_history = not settings.test_mode
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as spool:
+            def parts():
+                nonlocal save_history
+                for part in iter_request_body(request):
+                    # Larger uploads are summarized but not added to the history
+                    if save_history and spool.tell() + len(part) > UPLOAD_HISTORY_MAX_BYTES:
+                        save_history = False
+                        spool.seek(0)
+                        spool.truncate()
+                    if save_history:
+                        spool.write(part)
+                    yield part
+
+            summary = generate_summary_stream(parts(), **settings_kwargs(settings), stats=stats)
+            duration = time.time() - start_time
+            if save_history:
+                spool.seek(0)
+                record = SummarizeRequest(**settings.model_dump(), text=spool.read().decode("utf-8"))
+                database.queue_history(history_record(record, summary, duration, stats.to_dict()))
+        return SummarizeResponse(summary=summary, processing_time=duration,
+                                 stats=None if settings.test_mode else stats.to_dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def run_job(request_data, on_event, cancel=None):
+    request = SummarizeRequest(**request_data)
+    start_time = time.time()
+    stats = SummaryStats(request.model)
+    summary = generate_summary(**summary_kwargs(request), on_event=on_event, stats=stats, cancel=cancel)
+    if not request.test_mode:
+        summary_cache.set(summarize_request_key(request), summary)
+        database.queue_history(history_record(request, summary, time.time() - start_time, stats.to_dict()))
+    return summary
+
+job_manager = JobManager(database, run_job)
+
+def sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.post("/summarize/stream")
+async def api_summarize_stream(request: SummarizeRequest, http_request: Request):
+    """
+    Summarize the text, streaming progress as server-sent events:
+    start, split, map, collapse, reduce_tree, token, then done or error.
+    Identical requests in flight share one run (and its progress goes to the
+    first one). Once the client disconnects no further LLM calls are started.
+    """
+    if not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
+
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancel = threading.Event()
+
+    def put(event):
+        # Nobody reads the events once the stream has ended
+        if not cancel.is_set():
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def worker():
+        try:
+            def run():
+                stats = SummaryStats(request.model)
+                summary = generate_summary(**summary_kwargs(request), on_event=put, stats=stats, cancel=cancel)
+                return summary, stats.to_dict()
+
+            key = summarize_request_key(request)
+            summary = None if request.test_mode else summary_cache.get(key)
+            cached = summary is not None
+            stats = None
+            if request.test_mode:
+                summary, stats = run()
+            elif not cached:
+                def run_and_cache():
+                    result = run()
+                    summary_cache.set(key, result[0])
+                    return result
+
+                (summary, stats), cached = shared_summary(key, run_and_cache, cancel)
+            duration = time.time() - start_time
+            if not request.test_mode and not cached:
+                database.queue_history(history_record(request, summary, duration, stats))
+            put({"event": "done", "summary": summary, "processing_time": duration, "cached": cached,
+                 "stats": None if cached else stats})
+        except SummaryCancelled:
+            pass
+        except Exception as e:
+            put({"event": "error", "detail": str(e)})
+        finally:
+            put(None)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    async def stream():
+        try:
+            yield sse({"event": "start"})
+            while not await http_request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps idle proxies from closing the connection
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield sse(event)
+        finally:
+            # Also runs when the response is cancelled because the client went away
+            cancel.set()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+def api_create_job(request: SummarizeRequest):
+    """
+    Queue a summary on the worker pool and return its job id immediately
+    """
+    if not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
+    try:
+        job = job_manager.submit(request.model_dump())
+        return job.to_dict()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{id}", response_model=JobResponse)
+def api_get_job(id: str):
+    job = job_manager.get(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{id}")
+def api_cancel_job(id: str):
+    if job_manager.get(id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "ok", "cancelled": job_manager.cancel(id)}
+
+session_manager = SessionManager()
+registry.add_collector("mmsummary_live", session_manager.stats)
+
+def get_session(id):
+    session = session_manager.get(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@app.post("/sessions", response_model=SessionResponse, status_code=201)
+def api_create_session(request: SessionCreateRequest):
+    """
+    Start a live-meeting session. Transcript segments are then appended with
+    POST /sessions/{id}/segments and only the new text is chunked and mapped.
+    """
+    try:
+        # Fail on bad chunk settings now rather than on the first segment
+        for chunk_size, chunk_overlap in ((request.chunk_size_1, request.chunk_overlap_1),
+                                          (request.chunk_size_2, request.chunk_overlap_2)):
+            if chunk_overlap > chunk_size:
+                raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        session = session_manager.create(request.model_dump(exclude={"text"}))
+        if request.text:
+            with session.lock:
+                session.append(request.text)
+        return session.to_dict()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/sessions/{id}/segments", response_model=SessionUpdateResponse)
+def api_append_segment(id: str, request: SessionSegmentRequest):
+    """
+    Append a transcript segment and, unless summarize is false, return the
+    updated summary of the whole meeting so far
+    """
+    session = get_session(id)
+    if request.summarize and not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="OpenAI API Key not set in environment.")
+    try:
+        with session.lock:
+            retokenized = session.append(request.text)
+            result = {"retokenized": retokenized}
+            if request.summarize:
+                stats = SummaryStats(session.request["model"])
+                _, counts = session.summarize(stats=stats)
+                result.update(mapped=counts["mapped"], reused=counts["reused"], stats=stats.to_dict())
+            return {**session.to_dict(), **result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/sessions/{id}", response_model=SessionResponse)
+def api_get_session(id: str):
+    session = get_session(id)
+    with session.lock:
+        return session.to_dict()
+
+@app.delete("/sessions/{id}")
+def api_close_session(id: str, save: bool = False):
+    """
+    End a session; with save=true its transcript and latest summary are added to the history
+    """
+    session = session_manager.remove(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    saved = save and session.summary is not None
+    if saved:
+        request = SummarizeRequest(**session.request, text=session.text)
+        database.queue_history(history_record(request, session.summary, session.processing_time))
+    return {"status": "ok", "saved": saved}
+
 @app.get("/history", response_model=list[HistoryResponse])
-def api_history():
+async def api_history(response: Response, limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=100), cursor: str = None):
+    """
+    Newest history first, one page at a time. When more records exist the
+    X-Next-Cursor header holds the cursor for the next page.
+    """
+    try:
+        items = await async_database.get_history(limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if len(items) == limit and items[-1].get("cursor"):
+        response.headers["X-Next-Cursor"] = items[-1]["cursor"]
+    return items
+
+@app.get("/history/{id}", response_model=HistoryDetailResponse)
+async def api_history_item(id: str):
     try:
-        return database.get_history()
+        item = await async_database.get_history_item(id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if item is None:
+        raise HTTPException(status_code=404, detail="History record not found")
+    return item
 
 @app.delete("/history/{id}")
-def api_delete_history(id: str):
+async def api_delete_history(id: str):
     try:
-        result = database.delete_history(id)
+        result = await async_database.delete_history(id)
         return {"status": "ok", "deleted_count": result.deleted_count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    # Stable SHA-256 over JSON-encoded parts, so ("ab", "c") and ("a", "bc") differ
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU for string values, evicting once the stored bytes exceed max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value.encode("utf-8"))
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._size(key, self._data.pop(key))
+            self._data[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old_value = self._data.popitem(last=False)
+                self.bytes -= self._size(old_key, old_value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent key/value tier backed by a single SQLite file."""
+
+    def __init__(self, path, table="cache"):
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+
+class MapCache:
+    """
+    Two-tier cache for map-stage LLM outputs: an in-memory LRU in front of an
+    optional SQLite file. Keys are content hashes, see MapCache.key.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None):
+        self.memory = LRUCache(max_bytes)
+        self.persistent = SQLiteCache(path, table="map_cache") if path else None
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(chunk_text, map_template, model, temperature, max_tokens):
+        return content_key(chunk_text, map_template, model, float(temperature), int(max_tokens))
+
+    def get(self, key):
+        value = self.memory.get(key)
+        from_disk = False
+        if value is None and self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                from_disk = True
+                self.memory.set(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.persistent_hits += from_disk
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+        with self._lock:
+            self.hits = self.misses = self.persistent_hits = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent_hits": self.persistent_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.memory),
+                "bytes": self.memory.bytes,
+            }
+
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after ttl seconds; oldest entries go first when full."""
+
+    def __init__(self, ttl=3600, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._data),
+            }
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+    do() returns (result, shared) where shared is True for callers that
+    waited on another caller's computation.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
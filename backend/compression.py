@@ -0,0 +1,42 @@
+import hashlib
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is always available
+    zstandard = None
+
+# Strings shorter than this are stored as-is; compression would not pay for itself
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "256"))
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", "10"))
+ZLIB_LEVEL = int(os.environ.get("ZLIB_LEVEL", "6"))
+
+# Both formats are self-describing, so stored blobs need no codec field
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress_text(text):
+    """Return bytes (zstd if installed, else zlib) or the text itself when it is too short to bother."""
+    raw = text.encode("utf-8")
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return text
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_text(value):
+    """Inverse of compress_text; plain strings (and None) pass through."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this record: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(value).decode("utf-8")
+    return zlib.decompress(value).decode("utf-8")
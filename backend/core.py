@@ -1,130 +1,720 @@
+import asyncio
+import codecs
 import os
 import time
-from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.chains.llm import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
+import threading
+import weakref
+from functools import lru_cache
+from itertools import chain, islice, zip_longest
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
+from backend.splitter import StreamingSplitter, cached_index, get_encoding, model_encoding
+from backend.ratelimit import scheduler_from_env
+from backend.cache import MapCache, content_key
+from backend.metrics import SummaryStats
+from backend.dedup import ChunkDeduplicator, MAP_DEDUP_THRESHOLD
+from backend.limits import MAP_CONCURRENCY, MAP_CONCURRENCY_MAX
 
 load_dotenv()
 
-def init_llm(temperature, model, max_tokens=1000):
-    if model.lower().startswith("gpt"):
-        return ChatOpenAI(
-            temperature=temperature, 
-            model=model, 
-            api_key=os.environ.get('OPENAI_API_KEY'), 
-            max_tokens=max_tokens
-        )
-    else:
-        return ChatOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            model=model, 
-            temperature=temperature, 
-            api_key=os.environ.get('OPENROUTER_API_KEY'), 
+# Map outputs keyed by (chunk, template, model, temperature, max_tokens);
+# set MAP_CACHE_PATH to also keep them in a SQLite file across restarts
+map_cache = MapCache(
+    max_bytes=int(os.environ.get("MAP_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    path=os.environ.get("MAP_CACHE_PATH") or None,
+)
+
+# Keep-alive connection pool shared by every client that talks to the same base URL
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "10"))
+
+# OPENAI_BASE_URL / OPENROUTER_BASE_URL point a provider at any OpenAI-compatible
+# server, e.g. benchmarks/fake_openai.py for load tests
+PROVIDERS = {
+    "openai": {"base_url": os.environ.get("OPENAI_BASE_URL") or None, "api_key_env": "OPENAI_API_KEY"},
+    "openrouter": {
+        "base_url": os.environ.get("OPENROUTER_BASE_URL") or "https://openrouter.ai/api/v1",
+        "api_key_env": "OPENROUTER_API_KEY",
+        "default_headers": {
+            "HTTP-Referer": "http://localhost:3000",
+            "X-Title": "MMSummary React"
+        },
+    },
+}
+
+def provider_for(model):
+    return "openai" if model.lower().startswith("gpt") else "openrouter"
+
+# Per-provider request/token budgets; override with e.g. OPENAI_RPM, OPENROUTER_TPM, LLM_MAX_RETRIES
+schedulers = {
+    "openai": scheduler_from_env("openai", rpm=500, tpm=200000, max_concurrency=16),
+    "openrouter": scheduler_from_env("openrouter", rpm=20, tpm=0, max_concurrency=8),
+}
+
+# langchain and the OpenAI SDK take seconds to import, so they are loaded on
+# first use (or by prewarm) rather than when the API module is imported
+
+class TokenWatcher:
+    """Run manager proxy that records whether a streamed token was passed on to the callbacks."""
+
+    def __init__(self, run_manager):
+        self.run_manager = run_manager
+        self.started = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.started = True
+        return self.run_manager.on_llm_new_token(token, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.run_manager, name)
+
+@lru_cache(maxsize=None)
+def scheduled_chat_class():
+    from langchain_openai import ChatOpenAI
+
+    class ScheduledChatOpenAI(ChatOpenAI):
+        """ChatOpenAI whose every request goes through its provider's ProviderScheduler."""
+
+        provider: str = "openai"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            prompt = "".join(str(message.content) for message in messages)
+            tokens = len(get_encoding().encode_ordinary(prompt)) + (self.max_tokens or 0)
+            parent = super(ScheduledChatOpenAI, self)
+            # Clients cannot take back streamed tokens, so only retry before the first one
+            watcher = TokenWatcher(run_manager) if run_manager is not None else None
+            return schedulers[self.provider].call(
+                lambda: parent._generate(messages, stop=stop, run_manager=watcher, **kwargs),
+                tokens=tokens,
+                retryable=lambda error: watcher is None or not watcher.started,
+            )
+
+    return ScheduledChatOpenAI
+
+@lru_cache(maxsize=None)
+def summary_event_handler_class():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class SummaryEventHandler(BaseCallbackHandler):
+        """Forward streamed reduce tokens to an on_event(dict) function."""
+
+        # Let on_event abort the reduce (e.g. job cancellation) instead of being logged and ignored
+        raise_error = True
+
+        def __init__(self, on_event, cancel=None):
+            self.on_event = on_event
+            self.cancel = cancel
+
+        def on_llm_new_token(self, token, **kwargs):
+            # Stops reading the stream, which closes the LLM request
+            check_cancelled(self.cancel)
+            if token:
+                self.on_event({"event": "token", "text": token})
+
+    return SummaryEventHandler
+
+# Encodings loaded by prewarm; TIKTOKEN_PREWARM="" turns it off
+TIKTOKEN_PREWARM = os.environ.get("TIKTOKEN_PREWARM", "gpt2,cl100k_base")
+
+def prewarm(encodings=TIKTOKEN_PREWARM):
+    """Import the LLM stack and load tiktoken encodings so the first request doesn't pay for them."""
+    start = time.time()
+    scheduled_chat_class()
+    summary_event_handler_class()
+    import langchain.chains.llm  # noqa: F401
+    import langchain.prompts  # noqa: F401
+    import langchain_core.documents  # noqa: F401
+    for name in filter(None, (name.strip() for name in encodings.split(","))):
+        try:
+            get_encoding(name)
+        except Exception as e:
+            print(f"Warning: could not prewarm tiktoken encoding {name}. {e}")
+    return time.time() - start
+
+class LLMClientPool:
+    """
+    Process-wide ChatOpenAI registry keyed by (provider, model, temperature,
+    max_tokens, streaming). Clients for the same provider share one OpenAI SDK
+    client and its httpx pool, so keep-alive connections are reused across requests.
+    """
+
+    def __init__(self, max_connections=LLM_POOL_MAX_CONNECTIONS, max_keepalive=LLM_POOL_MAX_KEEPALIVE):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self._clients = {}
+        self._llms = {}
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.clients_created = 0
+        self.clients_reused = 0
+        self.requests = 0
+        self.connections_opened = 0
+
+    def _on_response(self, response):
+        # Each new network stream is a new TCP/TLS connection; repeats are reuse
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self.requests += 1
+            if stream is not None and stream not in self._connections:
+                self._connections.add(stream)
+                self.connections_opened += 1
+
+    def _provider_clients(self, provider):
+        with self._lock:
+            clients = self._clients.get(provider)
+            if clients is not None:
+                return clients
+            import httpx
+            import openai
+            config = PROVIDERS[provider]
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive)
+            params = dict(
+                api_key=os.environ.get(config["api_key_env"]),
+                base_url=config["base_url"],
+                default_headers=config.get("default_headers"),
+                # Retries are handled by the provider scheduler
+                max_retries=0,
+            )
+            timeout = httpx.Timeout(600.0, connect=10.0)
+            clients = (
+                openai.OpenAI(**params, http_client=httpx.Client(
+                    limits=limits, timeout=timeout, event_hooks={"response": [self._on_response]})),
+                openai.AsyncOpenAI(**params, http_client=httpx.AsyncClient(limits=limits, timeout=timeout)),
+            )
+            self._clients[provider] = clients
+            return clients
+
+    def get(self, temperature, model, max_tokens=1000, streaming=False):
+        provider = provider_for(model)
+        key = (provider, model, float(temperature), int(max_tokens), bool(streaming))
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is not None:
+                self.clients_reused += 1
+                return llm
+        sync_client, async_client = self._provider_clients(provider)
+        llm = scheduled_chat_class()(
+            provider=provider,
+            model=model,
+            temperature=temperature,
+            api_key=sync_client.api_key,
             max_tokens=max_tokens,
-            default_headers={
-                "HTTP-Referer": "http://localhost:3000",
-                "X-Title": "MMSummary React"
-            }
+            streaming=streaming,
+            client=sync_client.chat.completions,
+            async_client=async_client.chat.completions,
         )
+        with self._lock:
+            llm = self._llms.setdefault(key, llm)
+            self.clients_created += 1
+        return llm
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._llms),
+                "clients_created": self.clients_created,
+                "clients_reused": self.clients_reused,
+                "http_pools": len(self._clients),
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connection_reuse_rate": 1 - self.connections_opened / self.requests if self.requests else 0.0,
+            }
+
+    def _take_clients(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._llms.clear()
+        return clients
+
+    def clear(self):
+        """Drop every client and close both HTTP pools; inside an event loop use aclose()."""
+        for sync_client, async_client in self._take_clients():
+            sync_client.close()
+            asyncio.run(async_client.close())
+
+    async def aclose(self):
+        for sync_client, async_client in self._take_clients():
+            sync_client.close()
+            await async_client.close()
+
+llm_pool = LLMClientPool()
+
+def init_llm(temperature, model, max_tokens=1000, streaming=False):
+    return llm_pool.get(temperature, model, max_tokens, streaming=streaming)
+
+def load_template(file_name, template=None):
+    if template:
+        return template
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    template_path = os.path.join(base_dir, "template", file_name)
+
+    with open(template_path, "r", encoding="utf-8") as f:
+        return f.read()
 
 # Map function for LLM chain
 def map_function(llm, map_template=None):
-    if not map_template:
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        template_path = os.path.join(base_dir, "template", "map_template.txt")
-        
-        with open(template_path, "r", encoding="utf-8") as f:
-            map_template = f.read()
-            
-    map_prompt = PromptTemplate.from_template(map_template)
+    from langchain.chains.llm import LLMChain
+    from langchain.prompts import PromptTemplate
+    map_prompt = PromptTemplate.from_template(load_template("map_template.txt", map_template))
     return LLMChain(llm=llm, prompt=map_prompt)
 
 # Reduce function for LLM chain
 def reduce_function(llm, reduce_template=None):
-    if not reduce_template:
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        template_path = os.path.join(base_dir, "template", "reduce_template.txt")
+    from langchain.chains.llm import LLMChain
+    from langchain.prompts import PromptTemplate
+    reduce_prompt = PromptTemplate.from_template(load_template("reduce_template.txt", reduce_template))
+    return LLMChain(llm=llm, prompt=reduce_prompt)
 
-        with open(template_path, "r", encoding="utf-8") as f:
-            reduce_template = f.read()
+class MapChunkError(Exception):
+    """Raised when some map chunks failed; the outputs of the others are kept."""
 
-    reduce_prompt = PromptTemplate.from_template(reduce_template)
-    return LLMChain(llm=llm, prompt=reduce_prompt)
+    def __init__(self, results, errors):
+        self.results = results
+        self.errors = errors
+        failed = ", ".join(f"#{i}: {e}" for i, e in sorted(errors.items()))
+        super().__init__(f"{len(errors)} map chunks failed ({failed})")
+
+class SummaryCancelled(Exception):
+    """Raised between LLM calls once the cancel event passed in is set (e.g. the client went away)."""
 
-def process_map_results(split_docs, model, map_template=None):
-    temp = []
-    map_chain = map_function(init_llm(0, model, 1000), map_template=map_template)
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise SummaryCancelled()
 
-    for doc in split_docs:
-        result = map_chain.invoke(doc)
-        if isinstance(result, dict):
-            content = result.get("text", result.get("output", result.get("output_text", str(result))))
+def iter_map_concurrently(fn, items, max_concurrency=MAP_CONCURRENCY, cancel=None):
+    """
+    Call fn on every item with at most max_concurrency calls in flight.
+    Yields (index, result, error) in completion order, in the caller's thread.
+    max_concurrency is clamped to 1..MAP_CONCURRENCY_MAX. Once cancel (a
+    threading.Event) is set no more calls start and SummaryCancelled is raised
+    after the ones in flight.
+    """
+    max_concurrency = min(MAP_CONCURRENCY_MAX, max(1, int(max_concurrency)))
+    work = enumerate(items)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while True:
+            check_cancelled(cancel)
+            for index, item in islice(work, max_concurrency - len(pending)):
+                pending[pool.submit(fn, item)] = index
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                yield index, (None if error else future.result()), error
+
+def map_concurrently(fn, items, max_concurrency=MAP_CONCURRENCY, cancel=None):
+    """
+    Ordered, bounded-concurrency map. Raises MapChunkError after every item
+    has run if any of them failed.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = {}
+    for index, result, error in iter_map_concurrently(fn, items, max_concurrency, cancel):
+        if error is not None:
+            errors[index] = error
         else:
-            content = str(result)
-        temp.append(content)
-    
-    return temp
+            results[index] = result
+    if errors:
+        raise MapChunkError(results, errors)
+    return results
 
-def process_reduce_results(combined_map_results, token_max, model, reduce_template=None, reduce_temperature=0.0):
-    reduce_chain = reduce_function(init_llm(reduce_temperature, model, 4000), reduce_template=reduce_template)
+def extract_output(result):
+    if isinstance(result, dict):
+        return result.get("text", result.get("output", result.get("output_text", str(result))))
+    return str(result)
 
-    prompt = PromptTemplate.from_template("折疊此內容: {docs}")
-    llm_chain = LLMChain(llm=init_llm(0, model, 4000), prompt=prompt)
+def make_map_runner(model, map_template=None, temperature=0, max_tokens=1000, stats=None):
+    """
+    Return doc -> map output, answering from map_cache before calling the LLM.
+    The two halves are also available as run_chunk.lookup (cache only, None on
+    a miss) and run_chunk.compute (LLM call, result stored in the cache).
+    """
+    stats = stats if stats is not None else SummaryStats(model)
+    map_template = load_template("map_template.txt", map_template)
+    map_chain = map_function(init_llm(temperature, model, max_tokens), map_template=map_template)
 
-    collapse_documents_chain = StuffDocumentsChain(llm_chain=llm_chain, document_separator="docs")
-    combine_documents_chain = StuffDocumentsChain(llm_chain=reduce_chain, document_variable_name="docs")
-    reduce_documents_chain = ReduceDocumentsChain(combine_documents_chain=combine_documents_chain, collapse_documents_chain=collapse_documents_chain, token_max=token_max)
-    
-    documents = []
-    for content in combined_map_results:
-        if isinstance(content, str):
-            documents.append(Document(page_content=content))
-        else:
-            documents.append(content)
-            
-    res = reduce_documents_chain.invoke(documents)
-    # Extract string from result dict if necessary
-    if isinstance(res, dict):
-        return res.get("output_text", res.get("text", res.get("output", str(res))))
-    return res
-
-def split_text(text, chunk_size, chunk_overlap):
-    text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-        separator=" ",
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-    )
-    file_content = text_splitter.create_documents([text])
-    split_docs = text_splitter.split_documents(file_content) 
-    return split_docs
+    def cache_key(doc):
+        return map_cache.key(getattr(doc, "page_content", doc), map_template, model, temperature, max_tokens)
+
+    def lookup(doc):
+        content = map_cache.get(cache_key(doc))
+        stats.cache_lookup(content is not None)
+        return content
+
+    def compute(doc):
+        start = time.perf_counter()
+        content = extract_output(map_chain.invoke(doc))
+        stats.llm_call("map", time.perf_counter() - start)
+        map_cache.set(cache_key(doc), content)
+        return content
+
+    def run_chunk(doc):
+        content = lookup(doc)
+        return content if content is not None else compute(doc)
+
+    run_chunk.lookup = lookup
+    run_chunk.compute = compute
+    return run_chunk
+
+def process_map_results(split_docs, model, map_template=None, max_concurrency=MAP_CONCURRENCY):
+    return map_concurrently(make_map_runner(model, map_template), split_docs, max_concurrency)
+
+def interleave_passes(passes):
+    """Round-robin (pass_index, chunk_index) pairs so every pass makes progress together."""
+    slots = [[(p, i) for i in range(len(docs))] for p, docs in enumerate(passes)]
+    return [slot for group in zip_longest(*slots) for slot in group if slot is not None]
+
+def map_planned(items, run_chunk, max_concurrency=MAP_CONCURRENCY, on_result=None, stats=None, cancel=None):
+    """
+    Map (slot, chunk) items with one LLM call per distinct chunk. Each item is
+    planned when the map queue pulls it, so planning overlaps the calls already
+    in flight: exact duplicates follow their first copy, cached outputs are used
+    without a call, and only the remaining chunks are sketched for
+    near-duplicates (when MAP_DEDUP_THRESHOLD is set).
+    on_result(slot, content) is called in the caller's thread for every slot.
+    Returns ({slot: output}, {slot: error}); every slot is in one of them.
+    """
+    from langchain_core.documents import Document
+    dedup = ChunkDeduplicator(MAP_DEDUP_THRESHOLD, keep_text=False)
+    slots = []
+    followers = {}
+    mapped = []
+    results = {}
+    errors = {}
+
+    def finish(n, content):
+        results[slots[n]] = content
+        if on_result is not None:
+            on_result(slots[n], content)
+
+    def planned():
+        for slot, chunk in items:
+            n = len(slots)
+            slots.append(slot)
+            doc = chunk if hasattr(chunk, "page_content") else Document(page_content=chunk)
+            # Exact duplicates first, then the cache; only chunks that still need a call are sketched
+            content = run_chunk.lookup(doc) if dedup.exact_owner(doc.page_content) is None else None
+            owner = dedup.add(doc.page_content, similar=content is None)
+            if owner != n:
+                if slots[owner] in results:
+                    finish(n, results[slots[owner]])
+                elif slots[owner] in errors:
+                    # The first copy already failed; its duplicates fail with it
+                    errors[slot] = errors[slots[owner]]
+                else:
+                    followers.setdefault(owner, []).append(n)
+            elif content is not None:
+                finish(n, content)
+            else:
+                mapped.append(n)
+                yield doc
+
+    for u, content, error in iter_map_concurrently(run_chunk.compute, planned(), max_concurrency, cancel):
+        owner = mapped[u]
+        for n in [owner] + followers.pop(owner, []):
+            if error is not None:
+                errors[slots[n]] = error
+            else:
+                finish(n, content)
+    if stats is not None:
+        stats.map_dedup(dedup.exact, dedup.similar)
+    return results, errors
+
+
+def process_map_passes(passes, model, map_template=None, max_concurrency=MAP_CONCURRENCY, on_result=None,
+                       stats=None, cancel=None):
+    """
+    Map several chunkings of the same text as one work queue under a single
+    concurrency budget. Returns one ordered result list per pass.
+    on_result(pass_index, chunk_index, content) is called as each chunk finishes.
+    """
+    stats = stats if stats is not None else SummaryStats(model)
+    run_chunk = make_map_runner(model, map_template, stats=stats)
+    results = [[None] * len(docs) for docs in passes]
+
+    def on_slot(slot, content):
+        p, i = slot
+        results[p][i] = content
+        if on_result is not None:
+            on_result(p, i, content)
+
+    items = ((slot, passes[slot[0]][slot[1]]) for slot in interleave_passes(passes))
+    _, errors = map_planned(items, run_chunk, max_concurrency, on_slot, stats, cancel)
+    if errors:
+        raise MapChunkError(results, errors)
+    return results
+
+COLLAPSE_TEMPLATE = "折疊此內容: {docs}"
+DOCUMENT_SEPARATOR = "\n\n"
+# Collapse levels allowed before giving up on fitting the map outputs into token_max
+REDUCE_MAX_DEPTH = int(os.environ.get("REDUCE_MAX_DEPTH", "8"))
+
+def pack_groups(token_counts, token_max, overhead=0, separator_tokens=0):
+    """
+    Greedily pack consecutive items into groups whose prompt stays within token_max.
+    Order is preserved so every collapse sees a contiguous stretch of the meeting.
+    Returns lists of item indices; an item larger than token_max gets a group of its own.
+    """
+    groups = []
+    current = []
+    total = overhead
+    for i, n in enumerate(token_counts):
+        extra = n + (separator_tokens if current else 0)
+        if current and total + extra > token_max:
+            groups.append(current)
+            current = []
+            total = overhead
+            extra = n
+        current.append(i)
+        total += extra
+    if current:
+        groups.append(current)
+    return groups
+
+def reduce_token_counter(model, reduce_template):
+    """
+    (count, overhead, separator_tokens) the way tree_reduce packs groups:
+    count(text) in the model's encoding, the tokens of the loaded reduce
+    template without its documents and of DOCUMENT_SEPARATOR.
+    """
+    encoding = model_encoding(model)
+
+    def count(text):
+        return len(encoding.encode_ordinary(text))
+
+    return count, count(reduce_template.replace("{docs}", "")), count(DOCUMENT_SEPARATOR)
+
+def tree_reduce(contents, token_max, model, reduce_template=None, reduce_temperature=0.0,
+                max_concurrency=MAP_CONCURRENCY, on_event=None, stats=None, collapse_cache=None, cancel=None):
+    """
+    Collapse map outputs level by level until they fit one reduce prompt of
+    token_max tokens, then run the final reduce. All groups of a level are
+    collapsed concurrently, so latency grows with tree depth, not group count.
+    collapse_cache (get/set, e.g. an LRUCache) lets repeated reduces over a
+    growing list skip the groups that have not changed. cancel is checked
+    before every LLM call and between streamed reduce tokens.
+    Returns (summary, tree) where tree lists each collapse level.
+    """
+    from langchain.chains.llm import LLMChain
+    from langchain.prompts import PromptTemplate
+    stats = stats if stats is not None else SummaryStats(model)
+    reduce_template = load_template("reduce_template.txt", reduce_template)
+    count, reduce_overhead, separator_tokens = reduce_token_counter(model, reduce_template)
+    collapse_chain = LLMChain(llm=init_llm(0, model, 4000), prompt=PromptTemplate.from_template(COLLAPSE_TEMPLATE))
+
+    def collapse(group):
+        key = content_key(model, *group) if collapse_cache is not None else None
+        output = collapse_cache.get(key) if key else None
+        if output is None:
+            start = time.perf_counter()
+            output = extract_output(collapse_chain.invoke({"docs": DOCUMENT_SEPARATOR.join(group)}))
+            stats.llm_call("collapse", time.perf_counter() - start)
+            if key:
+                collapse_cache.set(key, output)
+        return output
+
+    level = [getattr(content, "page_content", content) for content in contents]
+    tokens = [count(text) for text in level]
+    stats.add_tokens("reduce_input", sum(tokens))
+    tree = []
+    while len(level) > 0 and reduce_overhead + sum(tokens) + separator_tokens * (len(level) - 1) > token_max:
+        if len(tree) >= REDUCE_MAX_DEPTH:
+            raise ValueError(f"Map outputs still exceed token_max={token_max} after {len(tree)} collapse levels")
+        groups = pack_groups(tokens, token_max, reduce_overhead, separator_tokens)
+        with stats.stage("collapse"):
+            level = map_concurrently(collapse, [[level[i] for i in group] for group in groups], max_concurrency,
+                                     cancel)
+        new_tokens = [count(text) for text in level]
+        tree.append({
+            "level": len(tree) + 1,
+            "groups": [len(group) for group in groups],
+            "tokens_in": sum(tokens),
+            "tokens_out": sum(new_tokens),
+        })
+        tokens = new_tokens
+        if on_event is not None:
+            on_event({"event": "collapse", **tree[-1]})
+
+    # Token streaming is only worth its overhead when someone is listening
+    reduce_chain = reduce_function(init_llm(reduce_temperature, model, 4000, streaming=on_event is not None),
+                                   reduce_template=reduce_template)
+    config = {"callbacks": [summary_event_handler_class()(on_event, cancel)]} if on_event is not None else None
+    check_cancelled(cancel)
+    with stats.stage("reduce"):
+        start = time.perf_counter()
+        summary = extract_output(reduce_chain.invoke({"docs": DOCUMENT_SEPARATOR.join(level)}, config=config))
+        stats.llm_call("reduce", time.perf_counter() - start)
+    stats.add_tokens("summary", count(summary))
+    return summary, tree
+
+def process_reduce_results(combined_map_results, token_max, model, reduce_template=None, reduce_temperature=0.0,
+                           max_concurrency=MAP_CONCURRENCY, on_event=None, stats=None, collapse_cache=None,
+                           cancel=None):
+    summary, tree = tree_reduce(combined_map_results, token_max, model, reduce_template=reduce_template,
+                                reduce_temperature=reduce_temperature, max_concurrency=max_concurrency,
+                                on_event=on_event, stats=stats, collapse_cache=collapse_cache, cancel=cancel)
+    if on_event is not None:
+        on_event({"event": "reduce_tree", "tree": tree})
+    return summary
+
+def split_text(text, chunk_size, chunk_overlap, index=None):
+    # Pass a prebuilt TokenIndex to split the same text several ways without re-tokenizing it
+    from langchain_core.documents import Document
+    if index is None:
+        index = cached_index(text)
+    return [Document(page_content=chunk) for chunk in index.split(chunk_size, chunk_overlap)]
+
+def test_summary(model, length):
+    return f"【測試模式】這是一段自動生成的摘要測試文字。\n\n*   模型：{model}\n*   輸入長度：{length} 字\n*   這是為了確認資料庫儲存功能是否正常而生成的佔位符。"
 
 def generate_summary(text: str, model: str, chunk_size_1: int, chunk_overlap_1: int, 
                      chunk_size_2: int, chunk_overlap_2: int, token_max: int, 
                      use_map: bool, test_mode: bool = False, 
                      map_template: str = None, reduce_template: str = None,
-                     reduce_temperature: float = 0.0) -> str:
+                     reduce_temperature: float = 0.0,
+                     map_concurrency: int = MAP_CONCURRENCY,
+                     on_event=None, stats: SummaryStats = None, cancel=None) -> str:
+    """
+    on_event, if given, receives progress dicts: split, map (one per chunk),
+    collapse and the reduce output as token events.
+    stats, if given, is filled with per-stage timings, LLM latencies, token
+    and chunk counts; the same numbers always feed the /metrics endpoint.
+    cancel, a threading.Event, stops the run with SummaryCancelled before its next LLM call.
+    """
     
     if test_mode:
-        return f"【測試模式】這是一段自動生成的摘要測試文字。\n\n*   模型：{model}\n*   輸入長度：{len(text)} 字\n*   這是為了確認資料庫儲存功能是否正常而生成的佔位符。"
+        return test_summary(model, len(text))
     
-    split_docs1 = split_text(text, chunk_size_1, chunk_overlap_1)
-    split_docs2 = split_text(text, chunk_size_2, chunk_overlap_2)
+    stats = stats if stats is not None else SummaryStats(model)
+    with stats.stage("split"):
+        index = cached_index(text)
+        split_docs1 = split_text(text, chunk_size_1, chunk_overlap_1, index=index)
+        split_docs2 = split_text(text, chunk_size_2, chunk_overlap_2, index=index)
+    stats.add_chunks([len(split_docs1), len(split_docs2)])
+    stats.add_tokens("input", index.span_tokens())
+    for chunk_size, chunk_overlap in ((chunk_size_1, chunk_overlap_1), (chunk_size_2, chunk_overlap_2)):
+        stats.add_tokens("map_input", sum(index.span_tokens(first, end)
+                                          for first, end in index.windows(chunk_size, chunk_overlap)))
+    if on_event is not None:
+        on_event({"event": "split", "chunks": [len(split_docs1), len(split_docs2)]})
     
     combined_map_results = []
     
     if use_map:
-        map1_results = process_map_results(split_docs1, model, map_template=map_template)
-        map2_results = process_map_results(split_docs2, model, map_template=map_template)
+        on_result = None
+        if on_event is not None:
+            def on_result(p, i, content):
+                on_event({"event": "map", "pass": p + 1, "index": i, "content": content})
+
+        with stats.stage("map"):
+            map1_results, map2_results = process_map_passes([split_docs1, split_docs2], model,
+                                                            map_template=map_template,
+                                                            max_concurrency=map_concurrency,
+                                                            on_result=on_result,
+                                                            stats=stats,
+                                                            cancel=cancel)
         combined_map_results = map1_results + map2_results
     else:
         combined_map_results = split_docs1 + split_docs2
 
     response = process_reduce_results(combined_map_results, token_max, model, 
                                       reduce_template=reduce_template, 
-                                      reduce_temperature=reduce_temperature)
+                                      reduce_temperature=reduce_temperature,
+                                      max_concurrency=map_concurrency,
+                                      on_event=on_event,
+                                      stats=stats,
+                                      cancel=cancel)
     return response
+
+
+def iter_decoded(parts, encoding="utf-8"):
+    """Decode an iterable of byte parts; multi-byte characters may span parts."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for part in parts:
+        text = decoder.decode(part)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def generate_summary_stream(parts, model: str, chunk_size_1: int, chunk_overlap_1: int,
+                            chunk_size_2: int, chunk_overlap_2: int, token_max: int,
+                            use_map: bool, test_mode: bool = False,
+                            map_template: str = None, reduce_template: str = None,
+                            reduce_temperature: float = 0.0,
+                            map_concurrency: int = MAP_CONCURRENCY,
+                            on_event=None, stats: SummaryStats = None, cancel=None) -> str:
+    """
+    generate_summary for a transcript given as an iterable of UTF-8 byte parts
+    (e.g. an upload as it is read). Chunks of both passes are sent to the map
+    stage as soon as they are final and parts are only pulled while a map slot
+    is free, so neither the transcript nor the chunk lists are held in memory;
+    only the map outputs are. Without use_map the reduce needs every chunk, so
+    the chunks are kept.
+    """
+    stats = stats if stats is not None else SummaryStats(model)
+    texts = iter_decoded(parts)
+    if test_mode:
+        return test_summary(model, sum(map(len, texts)))
+
+    splitter = StreamingSplitter([(chunk_size_1, chunk_overlap_1), (chunk_size_2, chunk_overlap_2)])
+    counts = [0, 0]
+
+    def chunks():
+        # (pass_index, chunk_index, text) as the splitter releases them
+        for text in chain(texts, [None]):
+            for p, chunk, tokens in (splitter.feed(text) if text is not None else splitter.finish()):
+                stats.add_tokens("map_input", tokens)
+                counts[p] += 1
+                yield p, counts[p] - 1, chunk
+
+    with stats.stage("map"):
+        if use_map:
+            results = map_stream(chunks(), model, map_template, map_concurrency, on_event, stats, cancel)
+        else:
+            results = [{}, {}]
+            for p, i, chunk in chunks():
+                results[p][i] = chunk
+    stats.add_chunks(counts)
+    stats.add_tokens("input", splitter.tokens())
+    if on_event is not None:
+        on_event({"event": "split", "chunks": list(counts)})
+    combined = [results[p][i] for p in range(2) for i in range(counts[p])]
+    return process_reduce_results(combined, token_max, model,
+                                  reduce_template=reduce_template,
+                                  reduce_temperature=reduce_temperature,
+                                  max_concurrency=map_concurrency,
+                                  on_event=on_event,
+                                  stats=stats,
+                                  cancel=cancel)
+
+def map_stream(chunks, model, map_template=None, max_concurrency=MAP_CONCURRENCY, on_event=None, stats=None,
+               cancel=None):
+    """
+    process_map_passes over an iterator of (pass_index, chunk_index, text);
+    no chunk text is kept once it has been mapped.
+    Returns one {chunk_index: output} dict per pass.
+    """
+    stats = stats if stats is not None else SummaryStats(model)
+    run_chunk = make_map_runner(model, map_template, stats=stats)
+
+    def on_slot(slot, content):
+        if on_event is not None:
+            on_event({"event": "map", "pass": slot[0] + 1, "index": slot[1], "content": content})
+
+    items = (((p, i), chunk) for p, i, chunk in chunks)
+    outputs, errors = map_planned(items, run_chunk, max_concurrency, on_slot, stats, cancel)
+    results = [{}, {}]
+    for (p, i), content in outputs.items():
+        results[p][i] = content
+    if errors:
+        sizes = [len(results[p]) + sum(1 for q, _ in errors if q == p) for p in range(2)]
+        raise MapChunkError([[results[p].get(i) for i in range(sizes[p])] for p in range(2)], errors)
+    return results
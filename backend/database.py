@@ -1,53 +1,464 @@
 # backend/database.py
-from pymongo import MongoClient
-from bson import ObjectId
-from datetime import datetime
+from pymongo import MongoClient, AsyncMongoClient, DESCENDING, ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId, json_util
+from datetime import datetime, timedelta
+import base64
 import os
+import queue
+import random
+import threading
+import time
 import dotenv
+from backend.compression import compress_text, decompress_text, text_hash
 dotenv.load_dotenv()
 
+# Connection pool shared by all requests of one client (sync and async clients each have one)
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_TIMEOUT_MS = int(os.environ.get("MONGODB_TIMEOUT_MS", "2000"))
+
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "20"))
+# Characters of the transcript returned by the history list; /history/{id} has the full text
+HISTORY_PREVIEW_CHARS = int(os.environ.get("HISTORY_PREVIEW_CHARS", "200"))
+
+# Write-behind history queue, see HistoryWriter
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "50"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_QUEUE_SIZE = int(os.environ.get("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_MAX_RETRIES = int(os.environ.get("HISTORY_MAX_RETRIES", "3"))
+HISTORY_SPILL_PATH = os.environ.get("HISTORY_SPILL_PATH", "history_spill.jsonl")
+
+# Seconds a transcript stays after it was last stored, even with no history record referencing it
+TRANSCRIPT_GC_GRACE = float(os.environ.get("TRANSCRIPT_GC_GRACE", "3600"))
+
+def encode_cursor(created_at, id):
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+def decode_cursor(cursor):
+    """Raises ValueError for anything that is not a cursor we produced."""
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), ObjectId(id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def mongo_url():
+    return os.environ.get("MONGODB_URL", "").strip() or "mongodb://localhost:27017"
+
+def client_options():
+    return {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGODB_TIMEOUT_MS,
+    }
+
+HISTORY_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+HISTORY_PROJECTION = {
+    "summary": 1,
+    "model": 1,
+    "processing_time": 1,
+    "created_at": 1,
+    # Records from before the transcripts collection have text instead of preview
+    "preview": {"$ifNull": ["$preview", {"$substrCP": [{"$ifNull": ["$text", ""]}, 0, HISTORY_PREVIEW_CHARS]}]},
+    "text_length": {"$ifNull": ["$text_length", {"$strLenCP": {"$ifNull": ["$text", ""]}}]},
+}
+
+def history_query(cursor=None):
+    if not cursor:
+        return {}
+    created_at, id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": id}},
+    ]}
+
+def format_history(r):
+    return {
+        "id": str(r["_id"]),
+        "original_text": r.get("preview", ""),
+        "text_length": r.get("text_length", 0),
+        "summary": decompress_text(r.get("summary", "")),
+        "model": r.get("model", ""),
+        "processing_time": r.get("processing_time", 0.0),
+        "created_at": r["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+        "cursor": encode_cursor(r["created_at"], r["_id"])
+    }
+
+def format_history_item(r, text):
+    r["original_text"] = text
+    r.pop("text", None)
+    r["id"] = str(r.pop("_id"))
+    r["summary"] = decompress_text(r.get("summary", ""))
+    r["created_at"] = r["created_at"].strftime("%Y-%m-%d %H:%M:%S")
+    return r
+
+class HistoryWriter:
+    """
+    Write-behind queue for history records. put() returns immediately; a
+    background thread writes batches with insert_many once batch_size records
+    are queued or flush_interval seconds have passed, retrying with jittered
+    backoff. Batches that still fail are appended to spill_path as JSON lines
+    and written again by start() on the next run or by close().
+
+    Records get their _id up front, so a retried or replayed batch that was
+    partly written only produces duplicate key errors, which are ignored.
+    """
+
+    def __init__(self, database, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 max_size=HISTORY_QUEUE_SIZE, max_retries=HISTORY_MAX_RETRIES, base_delay=0.5,
+                 spill_path=HISTORY_SPILL_PATH):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.spill_path = spill_path
+        self.queue = queue.Queue(maxsize=max_size)
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+        self.drain_spill()
+
+    def put(self, data):
+        record = {**data, "_id": data.get("_id") or ObjectId(), "created_at": datetime.now()}
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._spill([record])
+        return record["_id"]
+
+    def close(self, timeout=10):
+        """Stop the thread after writing (or spilling) everything still queued."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopping.set()
+        self.queue.put(None)
+        thread.join(timeout)
+        self.drain_spill()
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [] if first is None else [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                record = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                batch.append(record)
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch and not self._write(batch):
+                self._spill(batch)
+
+    def _write(self, batch):
+        if self.database.collection is None:
+            return False
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.database.insert_history_batch(batch)
+                self._record_write(len(batch))
+                return True
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if errors and all(error.get("code") == 11000 for error in errors):
+                    self._record_write(len(batch))
+                    return True
+            except Exception as e:
+                print(f"Warning: History write failed. {e}")
+            if attempt < self.max_retries and not self._stopping.is_set():
+                with self._lock:
+                    self.retries += 1
+                time.sleep(random.uniform(0, self.base_delay * 2 ** attempt))
+        return False
+
+    def _record_write(self, count):
+        with self._lock:
+            self.written += count
+            self.batches += 1
+
+    def _spill(self, records):
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json_util.dumps(record) + "\n")
+        with self._lock:
+            self.spilled += len(records)
+
+    def drain_spill(self):
+        """Write records spilled by this or an earlier process; keeps the file if that fails."""
+        if self.database.collection is None:
+            return 0
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return 0
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                records = [json_util.loads(line) for line in f if line.strip()]
+            for i in range(0, len(records), self.batch_size):
+                if not self._write(records[i:i + self.batch_size]):
+                    with open(self.spill_path, "w", encoding="utf-8") as f:
+                        for record in records[i:]:
+                            f.write(json_util.dumps(record) + "\n")
+                    return i
+            os.remove(self.spill_path)
+            return len(records)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+                "retries": self.retries,
+                "spilled": self.spilled,
+            }
+
+
 class Database:
-    def __init__(self):
+    """
+    Blocking data layer, used from worker threads (history writer, jobs).
+    Request handlers read through AsyncDatabase instead.
+    """
+
+    def __init__(self, connect=True):
         self.client = None
         self.db = None
         self.collection = None
+        self.transcripts = None
+        self.jobs = None
+        self.history_writer = HistoryWriter(self)
+        if connect:
+            self.connect()
+
+    def connect(self):
         try:
-            mongo_url = os.environ.get("MONGODB_URL", "").strip()
-            if not mongo_url:
-                mongo_url = "mongodb://localhost:27017"
-            self.client = MongoClient(mongo_url, serverSelectionTimeoutMS=2000)
+            self.client = MongoClient(mongo_url(), **client_options())
             self.client.admin.command('ping')
             self.db = self.client["mmsummary"]
             self.collection = self.db["history"]
+            self.transcripts = self.db["transcripts"]
+            self.jobs = self.db["jobs"]
+            self.ensure_indexes()
         except Exception as e:
             print(f"Warning: Database connection failed. {e}")
 
 
+    def pack_history(self, data):
+        """
+        Split a history record into its transcript document, stored once per
+        SHA-256 in the transcripts collection, and a history document that
+        only references it. Transcript and summary are compressed.
+        """
+        record = dict(data)
+        text = record.pop("text", "") or ""
+        record["text_id"] = text_hash(text)
+        record["text_length"] = len(text)
+        record["preview"] = text[:HISTORY_PREVIEW_CHARS]
+        if record.get("summary") is not None:
+            record["summary"] = compress_text(record["summary"])
+        transcript = {"_id": record["text_id"], "text": compress_text(text), "length": len(text)}
+        return transcript, record
+
+    def store_transcripts(self, transcripts):
+        # $setOnInsert makes repeats (and retried batches) free; used_at keeps
+        # collect_transcripts away from a transcript whose history record is about to be written
+        now = datetime.now()
+        self.transcripts.bulk_write([
+            UpdateOne({"_id": t["_id"]}, {"$setOnInsert": {**t, "created_at": now}, "$set": {"used_at": now}},
+                      upsert=True)
+            for t in {t["_id"]: t for t in transcripts}.values()
+        ], ordered=False)
+
+    def collect_transcripts(self, grace=TRANSCRIPT_GC_GRACE, batch_size=500):
+        """
+        Delete transcripts that no history record references. Deleting a
+        history record leaves its transcript in place, because another insert
+        may be reusing it at the same moment; this pass removes the leftovers.
+        Transcripts stored within the last grace seconds are skipped, and the
+        delete re-checks that, so a concurrent insert always keeps its transcript.
+        """
+        if self.transcripts is None:
+            return 0
+        idle = {"used_at": {"$not": {"$gte": datetime.now() - timedelta(seconds=grace)}}}
+        deleted = 0
+        last_id = None
+        while True:
+            query = dict(idle)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            ids = [t["_id"] for t in self.transcripts.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+            if not ids:
+                return deleted
+            last_id = ids[-1]
+            referenced = set(self.collection.distinct("text_id", {"text_id": {"$in": ids}}))
+            unreferenced = [id for id in ids if id not in referenced]
+            if unreferenced:
+                deleted += self.transcripts.delete_many({"_id": {"$in": unreferenced}, **idle}).deleted_count
+
     def insert_history(self, data):
         if self.collection is None:
             print("Warning: Skipping DB insert, collection not initialized.")
             return None
         data["created_at"] = datetime.now()
-        return self.collection.insert_one(data)
+        transcript, record = self.pack_history(data)
+        self.store_transcripts([transcript])
+        return self.collection.insert_one(record)
+
+    def insert_history_batch(self, records):
+        packed = [self.pack_history(record) for record in records]
+        self.store_transcripts([transcript for transcript, _ in packed])
+        return self.collection.insert_many([record for _, record in packed], ordered=False)
 
-    def get_history(self):
+    def get_text(self, record):
+        # Records written before transcripts were split out still carry their text
+        if "text" in record:
+            return decompress_text(record["text"])
+        transcript = self.transcripts.find_one({"_id": record.get("text_id")})
+        return decompress_text(transcript["text"]) if transcript else ""
+
+    def queue_history(self, data):
+        """Write-behind insert_history: returns the new record's id before it is written."""
+        return self.history_writer.put(data)
+
+    def close(self):
+        self.history_writer.close()
+        if self.client is not None:
+            self.client.close()
+
+    def ensure_indexes(self):
+        # Keyset pagination walks (created_at, _id) newest first
+        self.collection.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+        self.collection.create_index("text_id")
+        self.jobs.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+
+    def get_history(self, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """
+        One page of history, newest first, without the full transcript.
+        Pass the last item's cursor to get the next page.
+        """
         if self.collection is None:
             return []
-        records = list(self.collection.find().sort("created_at", -1).limit(20))
-        
-        formatted_history = []
-        for r in records:
-            formatted_history.append({
-                "id": str(r["_id"]),
-                "original_text": r.get("text", ""),
-                "summary": r.get("summary", ""),
-                "model": r.get("model", ""),
-                "processing_time": r.get("processing_time", 0.0),
-                "created_at": r["created_at"].strftime("%Y-%m-%d %H:%M:%S")
-            })
-        return formatted_history
+        records = self.collection.find(history_query(cursor), HISTORY_PROJECTION).sort(HISTORY_SORT).limit(limit)
+        return [format_history(r) for r in records]
+
+    def get_history_item(self, id):
+        if self.collection is None:
+            return None
+        if not ObjectId.is_valid(id):
+            return None
+        r = self.collection.find_one({"_id": ObjectId(id)})
+        if r is None:
+            return None
+        return format_history_item(r, self.get_text(r))
 
     def delete_history(self, id):
         if self.collection is None:
             return None
-        return self.collection.delete_one({"_id": ObjectId(id)})
\ No newline at end of file
+        # The transcript may be shared; collect_transcripts removes it once unreferenced
+        return self.collection.delete_one({"_id": ObjectId(id)})
+
+    def insert_job(self, job):
+        if self.jobs is None:
+            return None
+        return self.jobs.insert_one(job)
+
+    def update_job(self, id, fields, push=None):
+        if self.jobs is None:
+            return None
+        update = {"$set": {**fields, "updated_at": datetime.now()}}
+        if push:
+            update["$push"] = push
+        return self.jobs.update_one({"_id": id}, update)
+
+    def get_job(self, id):
+        if self.jobs is None:
+            return None
+        return self.jobs.find_one({"_id": id})
+
+    def find_jobs(self, statuses):
+        if self.jobs is None:
+            return []
+        return list(self.jobs.find({"status": {"$in": list(statuses)}}).sort("created_at", 1))
+
+
+class AsyncDatabase:
+    """
+    Non-blocking reads and deletes for the request handlers, on pymongo's
+    asyncio client. connect() only creates the client (pymongo opens its pool
+    in the background), so the API can call it from its lifespan without
+    delaying startup; close() releases the pool on shutdown.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+        self.collection = None
+        self.transcripts = None
+
+    async def connect(self):
+        # The client connects in the background; ping() or the first query waits for it
+        self.client = AsyncMongoClient(mongo_url(), **client_options())
+        self.db = self.client["mmsummary"]
+        self.collection = self.db["history"]
+        self.transcripts = self.db["transcripts"]
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def ping(self):
+        if self.client is None:
+            raise RuntimeError("Database not connected")
+        return await self.client.admin.command('ping')
+
+    async def get_history(self, limit=HISTORY_PAGE_SIZE, cursor=None):
+        if self.collection is None:
+            return []
+        records = self.collection.find(history_query(cursor), HISTORY_PROJECTION).sort(HISTORY_SORT).limit(limit)
+        return [format_history(r) async for r in records]
+
+    async def get_history_item(self, id):
+        if self.collection is None or not ObjectId.is_valid(id):
+            return None
+        r = await self.collection.find_one({"_id": ObjectId(id)})
+        if r is None:
+            return None
+        if "text" in r:
+            text = decompress_text(r["text"])
+        else:
+            transcript = await self.transcripts.find_one({"_id": r.get("text_id")})
+            text = decompress_text(transcript["text"]) if transcript else ""
+        return format_history_item(r, text)
+
+    async def delete_history(self, id):
+        if self.collection is None:
+            return None
+        # Leaves the transcript to Database.collect_transcripts, see there
+        return await self.collection.delete_one({"_id": ObjectId(id)})
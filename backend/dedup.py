@@ -0,0 +1,109 @@
+import hashlib
+import heapq
+import os
+import zlib
+
+# Opt-in: chunks whose estimated shingle Jaccard similarity reaches this share one map call,
+# so a near-duplicate gets the other chunk's summary. 0 (the default) or above 1 only skips exact duplicates
+MAP_DEDUP_THRESHOLD = float(os.environ.get("MAP_DEDUP_THRESHOLD", "0"))
+# Shingles are byte windows of the whitespace-normalized UTF-8 text, so CJK text without spaces works too
+SHINGLE_BYTES = int(os.environ.get("MAP_DEDUP_SHINGLE_BYTES", "16"))
+# Bottom-k MinHash: the smallest SKETCH_SIZE shingle hashes stand in for the whole shingle set
+SKETCH_SIZE = int(os.environ.get("MAP_DEDUP_SKETCH_SIZE", "128"))
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def sketch(text, shingle_bytes=SHINGLE_BYTES, size=SKETCH_SIZE):
+    data = text.encode("utf-8")
+    if len(data) <= shingle_bytes:
+        return frozenset([zlib.crc32(data)])
+    hashes = set(map(zlib.crc32, (data[i:i + shingle_bytes] for i in range(len(data) - shingle_bytes + 1))))
+    return frozenset(heapq.nsmallest(size, hashes))
+
+
+def similarity(a, b, size=SKETCH_SIZE):
+    """
+    Jaccard estimate from two bottom-k sketches: the share of the k smallest
+    hashes of the union that both sets contain.
+    """
+    union = heapq.nsmallest(size, a | b)
+    return sum(1 for h in union if h in a and h in b) / len(union) if union else 1.0
+
+
+class ChunkDeduplicator:
+    """
+    Decides chunk by chunk, in arrival order, which chunks need a map call.
+    With keep_text=False only digests and sketches of mapped chunks are kept,
+    so it can run over a stream of chunks without holding their text; sketches
+    are then computed up front instead of only for candidate pairs.
+    Chunks are only compared for similarity when their lengths are within
+    the threshold ratio of each other, as Jaccard similarity requires.
+    add(text, similar=False) only looks for an exact duplicate; such chunks
+    (e.g. ones whose map output is already cached) are never sketched and
+    only serve as owners of exact duplicates.
+    """
+
+    def __init__(self, threshold=MAP_DEDUP_THRESHOLD, keep_text=True):
+        self.threshold = threshold
+        self.keep_text = keep_text
+        self.by_digest = {}
+        # [index, length, text or None, sketch or None] per mapped chunk
+        self.mapped = []
+        self.count = 0
+        self.exact = 0
+        self.similar = 0
+
+    @property
+    def near_duplicates(self):
+        return 0 < self.threshold <= 1
+
+    @staticmethod
+    def digest(text):
+        return hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=16).digest()
+
+    def exact_owner(self, text):
+        """Index of an earlier chunk with the same normalized text, or None; records nothing."""
+        return self.by_digest.get(self.digest(text))
+
+    def add(self, text, similar=True):
+        """Return the index of the chunk whose map output this one uses (its own if it must be mapped)."""
+        i = self.count
+        self.count += 1
+        digest = self.digest(text)
+        text = normalize(text)
+        owner = self.by_digest.get(digest)
+        if owner is not None:
+            self.exact += 1
+            return owner
+        if not (similar and self.near_duplicates):
+            self.by_digest[digest] = i
+            return i
+        own_sketch = None if self.keep_text else sketch(text)
+        for entry in self.mapped:
+            j, length, other, other_sketch = entry
+            if min(len(text), length) < self.threshold * max(len(text), length):
+                continue
+            if own_sketch is None:
+                own_sketch = sketch(text)
+            if other_sketch is None:
+                other_sketch = entry[3] = sketch(other)
+            if similarity(own_sketch, other_sketch) >= self.threshold:
+                self.similar += 1
+                return j
+        self.by_digest[digest] = i
+        self.mapped.append([i, len(text), text if self.keep_text else None, own_sketch])
+        return i
+
+
+def plan_dedup(texts, threshold=MAP_DEDUP_THRESHOLD):
+    """
+    Decide which chunks need a map call. Returns (owners, exact, similar):
+    owners[i] is the index of the chunk whose map output chunk i uses (i
+    itself if chunk i is mapped), exact and similar count the calls saved.
+    """
+    dedup = ChunkDeduplicator(threshold)
+    owners = [dedup.add(text) for text in texts]
+    return owners, dedup.exact, dedup.similar
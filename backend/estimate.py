@@ -0,0 +1,147 @@
+import json
+import math
+import os
+import time
+from backend.splitter import cached_index
+from backend.core import (pack_groups, load_template, provider_for, schedulers, reduce_token_counter,
+                          MAP_CONCURRENCY, COLLAPSE_TEMPLATE, REDUCE_MAX_DEPTH)
+
+# Expected output lengths; the real ones are only known after the LLM has answered
+ESTIMATE_MAP_OUTPUT_TOKENS = int(os.environ.get("ESTIMATE_MAP_OUTPUT_TOKENS", "400"))
+ESTIMATE_COLLAPSE_OUTPUT_TOKENS = int(os.environ.get("ESTIMATE_COLLAPSE_OUTPUT_TOKENS", "600"))
+ESTIMATE_SUMMARY_TOKENS = int(os.environ.get("ESTIMATE_SUMMARY_TOKENS", "1000"))
+# max_tokens of the map and collapse/reduce calls in backend.core
+MAP_MAX_TOKENS = 1000
+REDUCE_MAX_TOKENS = 4000
+
+# USD per million input/output tokens, seconds to first token and output tokens per second.
+# Point MODEL_PROFILES_PATH at a JSON file of the same shape to add or override models.
+MODEL_PROFILES = {
+    "gpt-5-mini": {"input_price": 0.25, "output_price": 2.0, "first_token_seconds": 2.0, "tokens_per_second": 80},
+    "gpt-5": {"input_price": 1.25, "output_price": 10.0, "first_token_seconds": 4.0, "tokens_per_second": 50},
+    "gpt-4.1-mini": {"input_price": 0.4, "output_price": 1.6, "first_token_seconds": 0.8, "tokens_per_second": 90},
+    "gpt-4o-mini": {"input_price": 0.15, "output_price": 0.6, "first_token_seconds": 0.6, "tokens_per_second": 90},
+    "gpt-4o": {"input_price": 2.5, "output_price": 10.0, "first_token_seconds": 0.8, "tokens_per_second": 70},
+    "gpt-4-1106-preview": {"input_price": 10.0, "output_price": 30.0, "first_token_seconds": 1.0, "tokens_per_second": 30},
+}
+if os.environ.get("MODEL_PROFILES_PATH"):
+    with open(os.environ["MODEL_PROFILES_PATH"], "r", encoding="utf-8") as f:
+        MODEL_PROFILES.update(json.load(f))
+
+
+def project_reduce_tree(token_counts, token_max, overhead, separator_tokens,
+                        collapse_output_tokens=ESTIMATE_COLLAPSE_OUTPUT_TOKENS):
+    """
+    Replay tree_reduce's packing with an assumed output length per collapse;
+    overhead and separator_tokens come from reduce_token_counter, as in tree_reduce.
+    Returns (levels, fits) where fits is False if REDUCE_MAX_DEPTH would be hit.
+    """
+    tokens = list(token_counts)
+    levels = []
+    while tokens and overhead + sum(tokens) + separator_tokens * (len(tokens) - 1) > token_max:
+        if len(levels) >= REDUCE_MAX_DEPTH:
+            return levels, False
+        groups = pack_groups(tokens, token_max, overhead, separator_tokens)
+        new_tokens = [min(collapse_output_tokens, REDUCE_MAX_TOKENS, sum(tokens[i] for i in group)) for group in groups]
+        levels.append({
+            "level": len(levels) + 1,
+            "groups": [len(group) for group in groups],
+            "tokens_in": sum(tokens),
+            "tokens_out": sum(new_tokens),
+        })
+        tokens = new_tokens
+    return levels, True
+
+
+def call_seconds(profile, output_tokens):
+    return profile["first_token_seconds"] + output_tokens / profile["tokens_per_second"]
+
+
+def stage_seconds(calls, seconds_per_call, concurrency, rpm):
+    """Calls run in waves of `concurrency`, but never faster than the provider's requests/min."""
+    if calls == 0:
+        return 0.0
+    waves = math.ceil(calls / max(1, concurrency)) * seconds_per_call
+    return max(waves, calls * 60.0 / rpm) if rpm > 0 else waves
+
+
+def estimate_summary(text, model, chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, token_max,
+                     use_map=True, map_template=None, reduce_template=None, map_concurrency=MAP_CONCURRENCY,
+                     map_output_tokens=ESTIMATE_MAP_OUTPUT_TOKENS, summary_tokens=ESTIMATE_SUMMARY_TOKENS):
+    """
+    Project what generate_summary would do with these settings, without calling
+    any LLM: exact chunk and token counts for both passes, the collapse tree
+    and, per model, cost and wall-clock time. Only chunks both passes share
+    are deduplicated; map cache hits and near-duplicate chunks are not
+    subtracted, so map calls and cost are upper bounds.
+    """
+    start = time.perf_counter()
+    index = cached_index(text)
+    passes = [index.spans(chunk_size_1, chunk_overlap_1), index.spans(chunk_size_2, chunk_overlap_2)]
+    chunk_tokens = [[index.span_tokens(first, end) for first, end in spans] for spans in passes]
+
+    # Prompts are counted in the model's encoding, like tree_reduce does; chunk sizes stay in the splitter's
+    count, reduce_overhead, separator_tokens = reduce_token_counter(
+        model, load_template("reduce_template.txt", reduce_template))
+    map_overhead = count(load_template("map_template.txt", map_template).replace("{docs}", ""))
+    collapse_overhead = count(COLLAPSE_TEMPLATE.replace("{docs}", ""))
+
+    all_chunks = chunk_tokens[0] + chunk_tokens[1]
+    # A span both passes produce is the same text, which the map stage dedup maps once
+    mapped_tokens = [index.span_tokens(first, end) for first, end in dict.fromkeys(passes[0] + passes[1])]
+    map_calls = len(mapped_tokens) if use_map else 0
+    if use_map:
+        reduce_inputs = [min(n, map_output_tokens, MAP_MAX_TOKENS) for n in all_chunks]
+    else:
+        reduce_inputs = [count(index.chunk_text(first, end)) for spans in passes for first, end in spans]
+    levels, fits = project_reduce_tree(reduce_inputs, token_max, reduce_overhead, separator_tokens)
+    collapse_calls = sum(len(level["groups"]) for level in levels)
+    final_input = levels[-1]["tokens_out"] if levels else sum(reduce_inputs)
+    groups_in_last = len(levels[-1]["groups"]) if levels else len(reduce_inputs)
+
+    tokens = {
+        "input": index.span_tokens(),
+        "map_input": sum(mapped_tokens) + map_overhead * map_calls if use_map else 0,
+        "map_output": sum(min(n, map_output_tokens, MAP_MAX_TOKENS) for n in mapped_tokens) if use_map else 0,
+        "collapse_input": sum(level["tokens_in"] + collapse_overhead * len(level["groups"])
+                              + separator_tokens * (sum(level["groups"]) - len(level["groups"]))
+                              for level in levels),
+        "collapse_output": sum(level["tokens_out"] for level in levels),
+        "reduce_input": final_input + reduce_overhead + separator_tokens * max(0, groups_in_last - 1),
+        "summary": summary_tokens,
+    }
+    input_tokens = tokens["map_input"] + tokens["collapse_input"] + tokens["reduce_input"]
+    output_tokens = tokens["map_output"] + tokens["collapse_output"] + tokens["summary"]
+
+    models = {}
+    for name in dict.fromkeys([model, *MODEL_PROFILES]):
+        profile = MODEL_PROFILES.get(name)
+        if profile is None:
+            models[name] = None
+            continue
+        scheduler = schedulers[provider_for(name)]
+        concurrency = min(map_concurrency, scheduler.concurrency.maximum)
+        rpm = scheduler.requests.capacity
+        map_seconds = stage_seconds(map_calls, call_seconds(profile, map_output_tokens), concurrency, rpm)
+        collapse_seconds = sum(stage_seconds(len(level["groups"]),
+                                             call_seconds(profile, ESTIMATE_COLLAPSE_OUTPUT_TOKENS), concurrency, rpm)
+                               for level in levels)
+        reduce_seconds = call_seconds(profile, summary_tokens)
+        models[name] = {
+            "cost_usd": round((input_tokens * profile["input_price"] + output_tokens * profile["output_price"]) / 1e6, 6),
+            "latency_seconds": round(map_seconds + collapse_seconds + reduce_seconds, 2),
+            "stages": {"map": round(map_seconds, 2), "collapse": round(collapse_seconds, 2),
+                       "reduce": round(reduce_seconds, 2)},
+        }
+
+    return {
+        "chunks": [len(spans) for spans in passes],
+        "chunk_tokens": {"max": max(all_chunks, default=0), "total": sum(all_chunks)},
+        "tokens": tokens,
+        "llm_calls": {"map": map_calls, "collapse": collapse_calls, "reduce": 1},
+        "reduce_tree": levels,
+        "reduce_depth": len(levels),
+        "fits": fits,
+        "models": models,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
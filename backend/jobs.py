@@ -0,0 +1,169 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Finished jobs kept in memory; older ones are still served from the database
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "256"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, id, request, created_at=None):
+        self.id = id
+        self.request = request
+        self.status = QUEUED
+        self.created_at = created_at or datetime.now()
+        self.chunks = []
+        self.partial_results = []
+        self.summary = None
+        self.error = None
+        self.processing_time = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "chunks": self.chunks,
+            "mapped": len(self.partial_results),
+            "partial_results": self.partial_results,
+            "summary": self.summary,
+            "error": self.error,
+            "processing_time": self.processing_time,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+def job_from_record(record):
+    job = Job(record["_id"], record["request"], record.get("created_at"))
+    job.status = record.get("status", QUEUED)
+    job.chunks = record.get("chunks", [])
+    job.partial_results = record.get("partial_results", [])
+    job.summary = record.get("summary")
+    job.error = record.get("error")
+    job.processing_time = record.get("processing_time")
+    return job
+
+
+class JobManager:
+    """
+    Runs summaries on a bounded worker pool instead of inside the HTTP request.
+    Job state is written through the Database so unfinished jobs can be picked
+    up again by resume() after a restart.
+
+    runner(request, on_event, cancel) must return the summary; it is called on
+    a worker thread. cancel is the job's threading.Event, set by cancel(), for
+    the runner to stop between LLM calls; on_event also raises JobCancelled
+    once it is set.
+    """
+
+    def __init__(self, database, runner, max_workers=JOB_WORKERS):
+        self.database = database
+        self.runner = runner
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary-job")
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        job = Job(uuid.uuid4().hex, request)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.database.insert_job({
+            "_id": job.id,
+            "status": job.status,
+            "request": request,
+            "created_at": job.created_at,
+        })
+        self.executor.submit(self._run, job)
+        return job
+
+    def resume(self):
+        """Re-queue jobs that were queued or running when the last process stopped."""
+        resumed = []
+        for record in self.database.find_jobs([QUEUED, RUNNING]):
+            job = job_from_record(record)
+            job.status = QUEUED
+            job.partial_results = []
+            with self._lock:
+                if job.id in self.jobs:
+                    continue
+                self.jobs[job.id] = job
+            self.database.update_job(job.id, {"status": QUEUED, "partial_results": []})
+            self.executor.submit(self._run, job)
+            resumed.append(job.id)
+        return resumed
+
+    def get(self, id):
+        with self._lock:
+            job = self.jobs.get(id)
+        if job is None:
+            record = self.database.get_job(id)
+            if not record:
+                return None
+            job = job_from_record(record)
+        return job.to_dict()
+
+    def cancel(self, id):
+        with self._lock:
+            job = self.jobs.get(id)
+        if job is None or job.status in (DONE, FAILED, CANCELLED):
+            return False
+        job.cancel_event.set()
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+        return True
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _finish(self, job, status, **fields):
+        job.status = status
+        for name, value in fields.items():
+            setattr(job, name, value)
+        self.database.update_job(job.id, {"status": status, **fields})
+        with self._lock:
+            finished = [j.id for j in self.jobs.values() if j.status in (DONE, FAILED, CANCELLED)]
+            for id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[id]
+
+    def _on_event(self, job, event):
+        if job.cancel_event.is_set():
+            raise JobCancelled(job.id)
+        if event["event"] == "split":
+            job.chunks = event["chunks"]
+            self.database.update_job(job.id, {"chunks": job.chunks})
+        elif event["event"] == "map":
+            result = {"pass": event["pass"], "index": event["index"], "content": event["content"]}
+            job.partial_results.append(result)
+            self.database.update_job(job.id, {}, push={"partial_results": result})
+
+    def _run(self, job):
+        if job.cancel_event.is_set() or job.status == CANCELLED:
+            return
+        start_time = time.time()
+        job.status = RUNNING
+        self.database.update_job(job.id, {"status": RUNNING})
+        try:
+            summary = self.runner(job.request, lambda event: self._on_event(job, event), job.cancel_event)
+            if job.cancel_event.is_set():
+                raise JobCancelled(job.id)
+            self._finish(job, DONE, summary=summary, processing_time=time.time() - start_time)
+        except Exception as e:
+            # Whatever the runner raised after a cancel (e.g. core.SummaryCancelled) means cancelled
+            if isinstance(e, JobCancelled) or job.cancel_event.is_set():
+                self._finish(job, CANCELLED, processing_time=time.time() - start_time)
+                return
+            self._finish(job, FAILED, error=str(e), processing_time=time.time() - start_time)
@@ -0,0 +1,8 @@
+import os
+import dotenv
+dotenv.load_dotenv()
+
+# Default number of map calls allowed in flight for one request
+MAP_CONCURRENCY = int(os.environ.get("MAP_CONCURRENCY", "4"))
+# Server-side cap on calls in flight for one request, whatever the client asks for
+MAP_CONCURRENCY_MAX = int(os.environ.get("MAP_CONCURRENCY_MAX", "16"))
@@ -0,0 +1,229 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; LLM calls range from sub-second cache-warm replies to multi-minute reduces
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + "_total", dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield self.name + "_bucket", {**labels, "le": format_value(bound)}, count
+            yield self.name + "_count", labels, counts[-1]
+            yield self.name + "_sum", labels, total
+
+
+class StatsCollector:
+    """
+    Gauges read from an existing stats() dict at scrape time. With label set,
+    fn returns {label_value: stats_dict}, e.g. one entry per provider.
+    """
+
+    def __init__(self, prefix, fn, label=None):
+        self.prefix = prefix
+        self.fn = fn
+        self.label = label
+
+    def families(self):
+        groups = self.fn().items() if self.label else [(None, self.fn())]
+        families = {}
+        for label_value, stats in groups:
+            labels = {self.label: label_value} if self.label else {}
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    families.setdefault(f"{self.prefix}_{key}", []).append((labels, value))
+        return families
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix, fn, label=None):
+        self.collectors.append(StatsCollector(prefix, fn, label))
+
+    def render(self):
+        """Prometheus text exposition format, version 0.0.4."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for collector in self.collectors:
+            for name, samples in collector.families().items():
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("mmsummary_stage_seconds", "Wall-clock time per summary stage", ["stage"])
+LLM_CALL_SECONDS = registry.histogram("mmsummary_llm_call_seconds", "Latency of one LLM call", ["stage", "model"])
+TOKENS = registry.counter("mmsummary_tokens", "Tokens flowing through the pipeline", ["kind"])
+CHUNKS = registry.counter("mmsummary_chunks", "Chunks produced by the splitter", ["pass"])
+MAP_CACHE_LOOKUPS = registry.counter("mmsummary_map_cache_lookups", "Map-stage cache lookups", ["result"])
+MAP_DEDUP_SAVED = registry.counter("mmsummary_map_dedup_saved", "Map calls skipped as duplicate chunks", ["kind"])
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SummaryStats:
+    """
+    Measurements for one generate_summary call. Everything recorded here is
+    also added to the process-wide Prometheus metrics above.
+    """
+
+    def __init__(self, model=""):
+        self.model = model
+        self.stages = {}
+        self.chunks = []
+        self.tokens = {}
+        self.latencies = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.dedup = {"exact": 0, "similar": 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def llm_call(self, stage, seconds):
+        with self._lock:
+            self.latencies.setdefault(stage, []).append(seconds)
+        LLM_CALL_SECONDS.observe(seconds, stage=stage, model=self.model)
+
+    def cache_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        MAP_CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+
+    def map_dedup(self, exact, similar):
+        with self._lock:
+            self.dedup["exact"] += exact
+            self.dedup["similar"] += similar
+        for kind, count in (("exact", exact), ("similar", similar)):
+            if count:
+                MAP_DEDUP_SAVED.inc(count, kind=kind)
+
+    def add_tokens(self, kind, count):
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+        TOKENS.inc(count, kind=kind)
+
+    def add_chunks(self, counts):
+        self.chunks = list(counts)
+        for p, count in enumerate(counts, 1):
+            CHUNKS.inc(count, **{"pass": p})
+
+    def to_dict(self):
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                "chunks": self.chunks,
+                "tokens": dict(self.tokens),
+                "llm_calls": {
+                    stage: {
+                        "count": len(values),
+                        "mean": round(sum(values) / len(values), 4),
+                        "p50": round(percentile(values, 0.5), 4),
+                        "p95": round(percentile(values, 0.95), 4),
+                        "max": round(max(values), 4),
+                    }
+                    for stage, values in self.latencies.items()
+                },
+                "map_cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+                },
+                "map_dedup": {**self.dedup, "saved_calls": self.dedup["exact"] + self.dedup["similar"]},
+            }
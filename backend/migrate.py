@@ -0,0 +1,79 @@
+"""
+Move history records written before the transcripts collection existed to
+the deduplicated, compressed layout (see Database.pack_history). Safe to run
+more than once and while the API is serving.
+
+    python -m backend.migrate --dry-run
+    python -m backend.migrate --batch-size 200
+
+--collect-transcripts instead deletes transcripts that no history record
+references any more (deleting a record leaves its transcript behind); run it
+now and then, e.g. from cron.
+"""
+import argparse
+from bson import BSON
+from pymongo import UpdateOne
+from backend.database import Database, TRANSCRIPT_GC_GRACE
+
+
+def migrate_history(database, batch_size=100, dry_run=False):
+    stats = {"records": 0, "transcripts": 0, "bytes_before": 0, "bytes_after": 0}
+    seen = set()
+    last_id = None
+    while True:
+        query = {"text": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        records = list(database.collection.find(query).sort("_id", 1).limit(batch_size))
+        if not records:
+            break
+        last_id = records[-1]["_id"]
+
+        updates = []
+        transcripts = []
+        for record in records:
+            transcript, packed = database.pack_history(record)
+            if transcript["_id"] not in seen:
+                seen.add(transcript["_id"])
+                transcripts.append(transcript)
+                stats["bytes_after"] += len(BSON.encode(transcript))
+            packed.pop("_id")
+            stats["bytes_before"] += len(BSON.encode(record))
+            stats["bytes_after"] += len(BSON.encode({"_id": record["_id"], **packed}))
+            updates.append(UpdateOne({"_id": record["_id"], "text": record["text"]},
+                                     {"$set": packed, "$unset": {"text": ""}}))
+        stats["records"] += len(records)
+        stats["transcripts"] += len(transcripts)
+        if not dry_run:
+            if transcripts:
+                database.store_transcripts(transcripts)
+            database.collection.bulk_write(updates, ordered=False)
+        print(f"{stats['records']} records, {stats['transcripts']} distinct transcripts")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate and compress stored history transcripts")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true", help="Report the savings without writing")
+    parser.add_argument("--collect-transcripts", action="store_true",
+                        help="Only delete transcripts no history record references")
+    parser.add_argument("--grace", type=float, default=TRANSCRIPT_GC_GRACE,
+                        help="Keep transcripts stored within this many seconds")
+    args = parser.parse_args()
+
+    database = Database()
+    if database.collection is None:
+        raise SystemExit("MongoDB is not reachable, check MONGODB_URL")
+    if args.collect_transcripts:
+        print(f"deleted {database.collect_transcripts(grace=args.grace)} unreferenced transcripts")
+        return
+    stats = migrate_history(database, batch_size=args.batch_size, dry_run=args.dry_run)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"migrated {stats['records']} records into {stats['transcripts']} transcripts: "
+          f"{stats['bytes_before']} -> {stats['bytes_after']} bytes ({saved} saved)"
+          + (" [dry run]" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
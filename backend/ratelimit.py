@@ -0,0 +1,198 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """Refills rate_per_minute units per minute up to one minute's worth; rate <= 0 disables it."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Block until amount units are available; returns the seconds spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase (+1 per limit successes) and
+    multiplicative decrease on throttling, like TCP congestion control.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+def status_code(error):
+    code = getattr(error, "status_code", None)
+    if code is None and getattr(error, "response", None) is not None:
+        code = getattr(error.response, "status_code", None)
+    return code
+
+
+def is_throttle(error):
+    return status_code(error) == 429
+
+
+def is_timeout(error):
+    # Imported here so the API can start without the HTTP client stack; it is loaded by the time a call times out
+    import httpx
+    return isinstance(error, (TimeoutError, httpx.TimeoutException)) or type(error).__name__ == "APITimeoutError"
+
+
+def is_retryable(error):
+    code = status_code(error)
+    return (is_throttle(error) or is_timeout(error) or (code is not None and code >= 500)
+            or type(error).__name__ == "APIConnectionError")
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from Retry-After / retry-after-ms headers."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class ProviderScheduler:
+    """
+    Gate for every LLM call to one provider: requests/min and tokens/min buckets,
+    an AIMD concurrency limit that shrinks on 429s and timeouts, and retries with
+    jittered exponential backoff that honours Retry-After.
+    """
+
+    def __init__(self, rpm=0, tpm=0, max_concurrency=16, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AIMDLimiter(max_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hinted = retry_after(error)
+        if hinted is not None:
+            delay = min(self.max_delay, hinted) + random.uniform(0, self.base_delay)
+        return delay
+
+    def _wait_for_pause(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+    def call(self, fn, tokens=0, retryable=None):
+        """
+        Run fn under the limits, retrying throttles, timeouts and 5xx.
+        retryable(error), if given, can veto a retry (e.g. once part of a
+        streamed answer has been passed on).
+        """
+        attempt = 0
+        while True:
+            waited = self._wait_for_pause()
+            waited += self.requests.acquire(1)
+            waited += self.tokens.acquire(tokens)
+            self.concurrency.acquire()
+            with self._lock:
+                self.calls += 1
+                self.wait_seconds += waited
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = is_throttle(e) or is_timeout(e)
+                self.concurrency.release(throttled=throttled)
+                if (not is_retryable(e) or attempt >= self.max_retries
+                        or (retryable is not None and not retryable(e))):
+                    raise
+                delay = self.backoff(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                    self.throttled += throttled
+                    if is_throttle(e):
+                        # Hold back every caller, not just this one, until the provider recovers
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.release()
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "concurrency_limit": round(self.concurrency.limit, 2),
+                "in_flight": self.concurrency.in_flight,
+            }
+
+
+def scheduler_from_env(provider, rpm=0, tpm=0, max_concurrency=16):
+    prefix = provider.upper()
+    return ProviderScheduler(
+        rpm=int(os.environ.get(f"{prefix}_RPM", rpm)),
+        tpm=int(os.environ.get(f"{prefix}_TPM", tpm)),
+        max_concurrency=int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", "5")),
+    )
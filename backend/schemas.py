@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+from backend.limits import MAP_CONCURRENCY, MAP_CONCURRENCY_MAX
 
 
 class TextSplitRequest(BaseModel):
@@ -12,8 +13,7 @@ class TextSplitResponse(BaseModel):
     chunks: List[str]
     total_chunks: int
 
-class SummarizeRequest(BaseModel):
-    text: str
+class SummarizeSettings(BaseModel):
     chunk_size_1: int = 16000
     chunk_overlap_1: int = 4000
     chunk_size_2: int = 8000
@@ -26,15 +26,98 @@ class SummarizeRequest(BaseModel):
     reduce_temple: Optional[str] = None
     map_temple: Optional[str] = None
     reduce_temperature: float = 0.0
+    map_concurrency: int = Field(default=MAP_CONCURRENCY, ge=1, le=MAP_CONCURRENCY_MAX)
+
+class SummarizeRequest(SummarizeSettings):
+    text: str
 
 class SummarizeResponse(BaseModel):
     summary: str
     processing_time: float
+    cached: bool = False
+    # Per-stage timings, LLM latencies, token and chunk counts; None for cached answers
+    stats: Optional[Dict[str, Any]] = None
+
+class ModelEstimate(BaseModel):
+    cost_usd: float
+    latency_seconds: float
+    stages: Dict[str, float]
+
+class EstimateResponse(BaseModel):
+    chunks: List[int]
+    chunk_tokens: Dict[str, int]
+    tokens: Dict[str, int]
+    llm_calls: Dict[str, int]
+    reduce_tree: List[Dict[str, Any]]
+    reduce_depth: int
+    fits: bool
+    # None for models without a profile in backend.estimate.MODEL_PROFILES
+    models: Dict[str, Optional[ModelEstimate]]
+    elapsed_ms: float
 
 class HistoryResponse(BaseModel):
     id: str
+    # Only the first HISTORY_PREVIEW_CHARS characters; see HistoryDetailResponse
     original_text: str
+    text_length: int = 0
     summary: str
     model: str
     processing_time: float
     created_at: str
+    cursor: Optional[str] = None
+
+class HistoryDetailResponse(BaseModel):
+    id: str
+    original_text: str
+    summary: str
+    model: str
+    processing_time: float
+    created_at: str
+    chunk_size_1: Optional[int] = None
+    chunk_overlap_1: Optional[int] = None
+    chunk_size_2: Optional[int] = None
+    chunk_overlap_2: Optional[int] = None
+    token_max: Optional[int] = None
+    use_map: Optional[bool] = None
+    map_temple: Optional[str] = None
+    reduce_temple: Optional[str] = None
+    reduce_temperature: Optional[float] = None
+    stats: Optional[Dict[str, Any]] = None
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    chunks: List[int] = []
+    mapped: int = 0
+    partial_results: List[Dict[str, Any]] = []
+    summary: Optional[str] = None
+    error: Optional[str] = None
+    processing_time: Optional[float] = None
+    created_at: str
+
+class SessionCreateRequest(SummarizeRequest):
+    # Settings used for every summary of the session; text, if any, is the first segment
+    text: str = ""
+
+class SessionSegmentRequest(BaseModel):
+    text: str
+    # False only appends, e.g. to batch several segments before the next summary
+    summarize: bool = True
+
+class SessionResponse(BaseModel):
+    id: str
+    model: str
+    segments: int
+    characters: int
+    tokens: int
+    chunks: List[int]
+    summary: Optional[str] = None
+    processing_time: float
+    created_at: str
+
+class SessionUpdateResponse(SessionResponse):
+    # Pieces tokenized for this segment, chunks sent to the LLM and chunks answered from earlier updates
+    retokenized: int = 0
+    mapped: int = 0
+    reused: int = 0
+    stats: Optional[Dict[str, Any]] = None
@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from backend.cache import LRUCache
+from backend.core import process_map_passes, process_reduce_results
+from backend.metrics import SummaryStats
+from backend.splitter import TokenIndex
+
+# Live sessions idle for longer than this are dropped
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "14400"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "64"))
+# Per-session cache of collapse outputs, so re-reducing a longer meeting only collapses the groups that changed
+SESSION_COLLAPSE_CACHE_BYTES = int(os.environ.get("SESSION_COLLAPSE_CACHE_BYTES", str(4 * 1024 * 1024)))
+
+
+class SummarySession:
+    """
+    Summary of a meeting that is still running. Transcript segments are
+    appended to the session's own TokenIndex, so only the tail is tokenized
+    and re-chunked, map outputs are kept per chunk span, and each summary only
+    maps the chunks that are new or that the appended text changed.
+
+    request holds the SummarizeRequest fields (without text) used for every summary.
+    """
+
+    def __init__(self, id, request):
+        self.id = id
+        self.request = request
+        self.index = TokenIndex("")
+        # One {(first_piece, end_piece): map output} per chunking pass
+        self.map_outputs = ({}, {})
+        self.collapse_cache = LRUCache(SESSION_COLLAPSE_CACHE_BYTES)
+        self.segments = 0
+        self.summary = None
+        self.processing_time = 0.0
+        self.created_at = datetime.now()
+        self.updated_at = time.time()
+        # Appends and summaries of one session run one at a time
+        self.lock = threading.Lock()
+
+    @property
+    def text(self):
+        return self.index.text
+
+    def passes(self):
+        request = self.request
+        return [self.index.spans(request["chunk_size_1"], request["chunk_overlap_1"]),
+                self.index.spans(request["chunk_size_2"], request["chunk_overlap_2"])]
+
+    def append(self, text):
+        """Add a transcript segment; returns the number of pieces re-tokenized."""
+        changed = self.index.append(text)
+        # Chunks reaching past the changed piece now have different text
+        for outputs in self.map_outputs:
+            for span in [span for span in outputs if span[1] > changed]:
+                del outputs[span]
+        self.segments += 1
+        self.updated_at = time.time()
+        return len(self.index) - changed
+
+    def summarize(self, on_event=None, stats=None):
+        """
+        Map the chunks without a stored output and reduce all of them.
+        Returns (summary, counts) where counts has chunks per pass and the
+        number of chunks mapped now versus reused from earlier updates.
+        """
+        from langchain_core.documents import Document
+        if not self.text.strip():
+            raise ValueError("Session has no transcript yet")
+        request = self.request
+        start_time = time.time()
+        stats = stats if stats is not None else SummaryStats(request["model"])
+        with stats.stage("split"):
+            passes = self.passes()
+        chunks = [len(spans) for spans in passes]
+        stats.add_chunks(chunks)
+        stats.add_tokens("input", self.index.span_tokens())
+        if on_event is not None:
+            on_event({"event": "split", "chunks": chunks})
+
+        mapped = 0
+        if request["use_map"]:
+            pending = [[span for span in spans if span not in outputs] for spans, outputs in zip(passes, self.map_outputs)]
+            mapped = sum(len(spans) for spans in pending)
+            positions = [{span: i for i, span in enumerate(spans)} for spans in passes]
+            stats.add_tokens("map_input", sum(self.index.span_tokens(*span) for spans in pending for span in spans))
+
+            def on_result(p, i, content):
+                # Stored as they finish, so a failed update only has to redo the chunks that failed
+                self.map_outputs[p][pending[p][i]] = content
+                if on_event is not None:
+                    on_event({"event": "map", "pass": p + 1, "index": positions[p][pending[p][i]],
+                              "content": content})
+
+            docs = [[Document(page_content=self.index.chunk_text(*span)) for span in spans] for spans in pending]
+            with stats.stage("map"):
+                process_map_passes(docs, request["model"], map_template=request["map_temple"],
+                                   max_concurrency=request["map_concurrency"], on_result=on_result, stats=stats)
+            contents = [self.map_outputs[p][span] for p, spans in enumerate(passes) for span in spans]
+        else:
+            contents = [self.index.chunk_text(*span) for spans in passes for span in spans]
+
+        summary = process_reduce_results(contents, request["token_max"], request["model"],
+                                         reduce_template=request["reduce_temple"],
+                                         reduce_temperature=request["reduce_temperature"],
+                                         max_concurrency=request["map_concurrency"],
+                                         on_event=on_event,
+                                         stats=stats,
+                                         collapse_cache=self.collapse_cache)
+        self.summary = summary
+        self.processing_time += time.time() - start_time
+        self.updated_at = time.time()
+        return summary, {"chunks": chunks, "mapped": mapped, "reused": sum(chunks) - mapped}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "model": self.request["model"],
+            "segments": self.segments,
+            "characters": len(self.text),
+            "tokens": self.index.span_tokens(),
+            "chunks": [len(spans) for spans in self.passes()],
+            "summary": self.summary,
+            "processing_time": self.processing_time,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class SessionManager:
+    """
+    In-memory registry of live sessions. Sessions are not shared between
+    processes, so clients must reach the same worker for a whole meeting.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, request):
+        session = SummarySession(uuid.uuid4().hex, request)
+        with self._lock:
+            self._expire()
+            self.sessions[session.id] = session
+            # Over capacity: drop the sessions idle the longest
+            excess = max(0, len(self.sessions) - self.max_sessions)
+            for old in sorted(self.sessions.values(), key=lambda s: s.updated_at)[:excess]:
+                del self.sessions[old.id]
+        return session
+
+    def get(self, id):
+        with self._lock:
+            self._expire()
+            return self.sessions.get(id)
+
+    def remove(self, id):
+        with self._lock:
+            return self.sessions.pop(id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for id in [id for id, session in self.sessions.items() if session.updated_at < cutoff]:
+            del self.sessions[id]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self.sessions)}
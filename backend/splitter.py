@@ -0,0 +1,263 @@
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate, compress, islice, repeat
+from operator import add
+import tiktoken
+
+# Same defaults as CharacterTextSplitter.from_tiktoken_encoder(separator=" ")
+SEPARATOR = " "
+ENCODING_NAME = "gpt2"
+# Recently indexed transcripts kept per process (e.g. /estimate followed by /summarize)
+TOKEN_INDEX_CACHE_SIZE = int(os.environ.get("TOKEN_INDEX_CACHE_SIZE", "8"))
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    # tiktoken loads (and may download) the BPE ranks; do it once per process
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=None)
+def model_encoding(model):
+    # Same fallback as ChatOpenAI.get_num_tokens for models tiktoken doesn't know
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, encoding_name=ENCODING_NAME):
+    return len(get_encoding(encoding_name).encode(text, allowed_special=set(), disallowed_special="all"))
+
+
+class TokenIndex:
+    """
+    Char offsets and token counts for every separator-delimited piece of a text.
+    The text is tokenized once; windows for any (chunk_size, chunk_overlap) pair
+    are then computed with integer arithmetic only and match what
+    CharacterTextSplitter.from_tiktoken_encoder would produce.
+    """
+
+    def __init__(self, text, separator=SEPARATOR, encoding_name=ENCODING_NAME):
+        self.text = text
+        self.separator = separator
+        self.starts = array("q")
+        self.ends = array("q")
+        self.tokens = array("q")
+        self.encoding_name = encoding_name
+        self.separator_tokens = count_tokens(separator, encoding_name) if separator else 0
+        # (chunk_size, chunk_overlap) -> (spans, resume state or None once complete)
+        self._windows = {}
+        self._offsets = None
+        self._extend(text, 0, encoding_name)
+
+    def _extend(self, text, offset, encoding_name):
+        # Same pieces as re.split on the escaped separator, computed with C-level iterators
+        parts = text.split(self.separator) if self.separator else list(text)
+        lengths = list(map(len, parts))
+        positions = accumulate(map(add, lengths, repeat(len(self.separator))), initial=offset)
+        pieces = list(compress(parts, lengths))
+        starts = list(compress(positions, lengths))
+        self.starts.fromlist(starts)
+        self.ends.fromlist(list(map(add, starts, compress(lengths, lengths))))
+
+        # Transcripts repeat the same words constantly, so only encode distinct pieces
+        unique = list(dict.fromkeys(pieces))
+        encoded = get_encoding(encoding_name).encode_batch(unique, allowed_special=set(), disallowed_special="all")
+        counts = {piece: len(ids) for piece, ids in zip(unique, encoded)}
+        self.tokens.fromlist(list(map(counts.__getitem__, pieces)))
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def append(self, text):
+        """
+        Index text appended to the end of the indexed one. Only the last piece,
+        which text may continue, and the new pieces are tokenized, and cached
+        windows are cut back to the spans the new text cannot change.
+        Returns the first piece that changed: a span (first, end) with
+        end <= that piece covers exactly the same text as before.
+        """
+        n = len(self.tokens)
+        if n and self.ends[-1] == len(self.text):
+            changed = n - 1
+            start = self.starts[-1]
+        else:
+            changed = n
+            start = len(self.text)
+        del self.starts[changed:]
+        del self.ends[changed:]
+        del self.tokens[changed:]
+        if self._offsets is not None:
+            del self._offsets[changed + 1:]
+        self.text += text
+        self._extend(self.text[start:], start, self.encoding_name)
+
+        for key, (spans, state) in self._windows.items():
+            # A span ending at k was cut because piece k did not fit, so it depends on pieces <= k
+            kept = bisect_left([end for _, end in spans], changed)
+            if kept < len(spans):
+                state = (spans[kept][0], spans[kept - 1][1] + 1 if kept else 0)
+            elif state is None:
+                state = (0, 0)
+            self._windows[key] = (spans[:kept], state)
+        return changed
+
+    def drop(self, first):
+        """
+        Forget pieces before first and the text they cover. Windows are then
+        computed as if the text started at piece first.
+        """
+        offset = self.starts[first] if first < len(self.tokens) else len(self.text)
+        self.text = self.text[offset:]
+        self.starts = array("q", (start - offset for start in self.starts[first:]))
+        self.ends = array("q", (end - offset for end in self.ends[first:]))
+        self.tokens = self.tokens[first:]
+        self._offsets = None
+        self._windows = {}
+
+    def offsets(self):
+        """offsets[i] = tokens of pieces [0, i) plus one separator per piece, so spans are O(1)."""
+        if self._offsets is None:
+            self._offsets = array("q", [0])
+        done = len(self._offsets) - 1
+        if done < len(self.tokens):
+            self._offsets.extend(islice(accumulate(map(add, self.tokens[done:], repeat(self.separator_tokens)),
+                                                   initial=self._offsets[-1]), 1, None))
+        return self._offsets
+
+    def span_tokens(self, first=0, end=None):
+        """Tokens in pieces [first, end) joined by the separator, as the splitter counts them."""
+        end = len(self.tokens) if end is None else end
+        if end <= first:
+            return 0
+        offsets = self.offsets()
+        return offsets[end] - offsets[first] - self.separator_tokens
+
+    def windows(self, chunk_size, chunk_overlap):
+        """Return (first_piece, end_piece) spans, mirroring TextSplitter._merge_splits."""
+        key = (chunk_size, chunk_overlap)
+        spans, state = self._windows.get(key, ([], (0, 0)))
+        if state is not None:
+            # Not computed yet, or cut back by append(): carry on from the last span still valid
+            spans = spans + self._compute_windows(chunk_size, chunk_overlap, *state)
+            self._windows[key] = (spans, None)
+        return spans
+
+    def _compute_windows(self, chunk_size, chunk_overlap, head=0, k=0):
+        """
+        _merge_splits adds pieces one at a time. Here each step jumps straight to
+        the first piece that no longer fits and to the first piece kept as
+        overlap, by bisecting the cumulative offsets, so the cost grows with
+        the number of chunks rather than the number of pieces.
+        (head, k) is the loop state to start from, see append().
+        """
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+                f"({chunk_size}), should be smaller."
+            )
+        offsets = self.offsets()
+        sep = self.separator_tokens
+        n = len(self.tokens)
+        spans = []
+        while True:
+            # First piece k that would push the chunk starting at head past chunk_size
+            k = bisect_right(offsets, offsets[head] + sep + chunk_size, k + 1) - 1
+            if k >= n:
+                break
+            if k > head:
+                spans.append((head, k))
+                # Drop pieces until what is left fits the overlap and leaves room for piece k
+                head = bisect_left(offsets, max(offsets[k] - sep - chunk_overlap,
+                                                offsets[k + 1] - sep - chunk_size), head, k)
+            k += 1
+        if head < n:
+            spans.append((head, n))
+        return spans
+
+    def spans(self, chunk_size, chunk_overlap):
+        """windows() without the spans whose chunk text strips to nothing, i.e. one per chunk of split()."""
+        text = self.text
+        starts = self.starts
+        ends = self.ends
+        # A span can only be empty if the stretch of text it covers is all whitespace
+        return [(first, end) for first, end in self.windows(chunk_size, chunk_overlap)
+                if not text[starts[first]:ends[end - 1]].isspace() or self.chunk_text(first, end)]
+
+    def chunk_text(self, first, end):
+        text = self.text
+        return self.separator.join(text[self.starts[k]:self.ends[k]] for k in range(first, end)).strip()
+
+    def split(self, chunk_size, chunk_overlap):
+        return [self.chunk_text(first, end) for first, end in self.spans(chunk_size, chunk_overlap)]
+
+
+@lru_cache(maxsize=TOKEN_INDEX_CACHE_SIZE)
+def cached_index(text, separator=SEPARATOR, encoding_name=ENCODING_NAME):
+    """Shared TokenIndex for text; callers must not append() to it."""
+    return TokenIndex(text, separator, encoding_name)
+
+
+class StreamingSplitter:
+    """
+    TokenIndex chunking for text that arrives in parts, e.g. an upload read
+    from the socket, for one or more (chunk_size, chunk_overlap) passes at
+    once. A chunk is handed out as soon as later text can no longer change
+    it, and text that no pass needs any more is dropped, so memory stays
+    around the largest chunk plus one part however long the text is.
+    Together, feed() and finish() produce the same chunks as TokenIndex.split.
+    """
+
+    def __init__(self, chunkings, separator=SEPARATOR, encoding_name=ENCODING_NAME):
+        self.chunkings = list(chunkings)
+        for chunk_size, chunk_overlap in self.chunkings:
+            if chunk_overlap > chunk_size:
+                raise ValueError(
+                    f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+                    f"({chunk_size}), should be smaller."
+                )
+        self.index = TokenIndex("", separator, encoding_name)
+        # First piece of the next chunk of each pass
+        self.heads = [0] * len(self.chunkings)
+        self.dropped_tokens = 0
+
+    def tokens(self):
+        """Tokens of all text fed so far, counted like TokenIndex.span_tokens()."""
+        return self.dropped_tokens + self.index.span_tokens()
+
+    def _chunks(self, stable):
+        index = self.index
+        for p, (chunk_size, chunk_overlap) in enumerate(self.chunkings):
+            head = self.heads[p]
+            for first, end in index._compute_windows(chunk_size, chunk_overlap, head, head):
+                self.heads[p] = first
+                # The window reaching the last pieces can still grow
+                if end >= stable:
+                    break
+                chunk = index.chunk_text(first, end)
+                if chunk:
+                    yield p, chunk, index.span_tokens(first, end)
+
+    def feed(self, text):
+        """Add text; returns [(pass_index, chunk_text, tokens)] for the chunks that are now final."""
+        index = self.index
+        index.append(text)
+        n = len(index)
+        # append() re-tokenizes from the last piece if the text so far ends inside it
+        stable = n - 1 if n and index.ends[-1] == len(index.text) else n
+        chunks = list(self._chunks(stable))
+        first = min(self.heads)
+        if first:
+            self.dropped_tokens += index.offsets()[first]
+            index.drop(first)
+            self.heads = [head - first for head in self.heads]
+        return chunks
+
+    def finish(self):
+        """The remaining chunks once all text has been fed."""
+        chunks = list(self._chunks(len(self.index) + 1))
+        self.heads = [len(self.index)] * len(self.chunkings)
+        return chunks
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 import sys
 from types import ModuleType
 
@@ -21,5 +21,46 @@ def mock_db(monkeypatch):
     # If the app is already imported and initialized, we might need to patch the instance in api.py
     if "backend.api" in sys.modules:
         monkeypatch.setattr("backend.api.database", mock_db_instance)
+        monkeypatch.setattr("backend.api.async_database", async_facade(mock_db_instance))
     
     return mock_db_instance
+
+
+def async_facade(mock_db_instance):
+    """AsyncDatabase stand-in that answers from the same mock, so tests configure one object."""
+    facade = MagicMock()
+    for name in ("get_history", "get_history_item", "delete_history"):
+        facade.attach_mock(AsyncMock(side_effect=getattr(mock_db_instance, name)), name)
+    facade.ping = AsyncMock(side_effect=lambda: mock_db_instance.client.admin.command("ping"))
+    return facade
+
+
+class FakeEncoding:
+    """Offline stand-in for a tiktoken encoding: one token per chars_per_token characters."""
+
+    def __init__(self, chars_per_token=3):
+        self.chars_per_token = chars_per_token
+
+    def encode(self, text, allowed_special=set(), disallowed_special="all"):
+        return list(range(-(-len(text) // self.chars_per_token)))
+
+    def encode_batch(self, texts, allowed_special=set(), disallowed_special="all"):
+        return [self.encode(t) for t in texts]
+
+    def encode_ordinary(self, text):
+        return self.encode(text)
+
+
+@pytest.fixture
+def fake_encoding(monkeypatch):
+    """
+    Patch the splitter's and the models' tiktoken encodings with one FakeEncoding,
+    so nothing is downloaded; set .chars_per_token to change its granularity.
+    """
+    from backend import splitter, core
+    fake = FakeEncoding()
+    monkeypatch.setattr(splitter, "get_encoding", lambda name=splitter.ENCODING_NAME: fake)
+    monkeypatch.setattr(core, "model_encoding", lambda model: fake)
+    splitter.cached_index.cache_clear()
+    yield fake
+    splitter.cached_index.cache_clear()
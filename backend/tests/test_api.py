@@ -42,9 +42,306 @@ def test_summarize_endpoint():
     assert response.status_code == 200, f"Detail: {response.json()}"
     assert "summary" in response.json()
 
+def test_summarize_rejects_out_of_range_concurrency():
+    from backend.core import MAP_CONCURRENCY_MAX
+    for value in (0, MAP_CONCURRENCY_MAX + 1):
+        response = client.post("/summarize", json={"text": "Hello", "test_mode": True, "map_concurrency": value})
+        assert response.status_code == 422
+
 
 def test_history_endpoint():
     response = client.get("/history")
     assert response.status_code == 200, f"Detail: {response.json()}"
     assert isinstance(response.json(), list)
 
+
+def test_history_pagination(mock_db):
+    item = {"id": "1", "original_text": "preview", "text_length": 5000, "summary": "s", "model": "m",
+            "processing_time": 1.0, "created_at": "2024-01-01 00:00:00", "cursor": "next"}
+    mock_db.get_history.return_value = [item, {**item, "id": "2", "cursor": "last"}]
+    response = client.get("/history?limit=2")
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"] == "last"
+    mock_db.get_history.assert_called_with(limit=2, cursor=None)
+
+    response = client.get("/history?limit=3&cursor=last")
+    assert "X-Next-Cursor" not in response.headers
+
+    mock_db.get_history.side_effect = ValueError("Invalid cursor: bad")
+    assert client.get("/history?cursor=bad").status_code == 400
+    assert client.get("/history?limit=1000").status_code == 422
+
+
+def test_history_item_endpoint(mock_db):
+    mock_db.get_history_item.return_value = None
+    assert client.get("/history/abc").status_code == 404
+    mock_db.get_history_item.return_value = {
+        "id": "1", "original_text": "full text", "summary": "s", "model": "m",
+        "processing_time": 1.0, "created_at": "2024-01-01 00:00:00"}
+    response = client.get("/history/1")
+    assert response.status_code == 200
+    assert response.json()["original_text"] == "full text"
+
+
+def test_cache_stats_endpoint():
+    response = client.get("/cache/stats")
+    assert response.status_code == 200
+    assert {"hits", "misses", "hit_rate"} <= set(response.json()["map"])
+
+
+def test_estimate_endpoint(fake_encoding):
+    fake_encoding.chars_per_token = 1
+    payload = {"text": "estimate this meeting " * 200, "chunk_size_1": 400, "chunk_overlap_1": 100,
+               "chunk_size_2": 200, "chunk_overlap_2": 0, "token_max": 1000}
+    response = client.post("/estimate", json=payload)
+    assert response.status_code == 200, response.json()
+    body = response.json()
+    assert body["llm_calls"]["map"] == sum(body["chunks"])
+    assert "gpt-5-mini" in body["models"]
+    assert client.post("/estimate", json={**payload, "chunk_overlap_1": 500}).status_code == 400
+
+
+def test_metrics_endpoint():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE mmsummary_stage_seconds histogram" in response.text
+    assert "mmsummary_map_cache_hits" in response.text
+
+
+def test_summarize_identical_requests_share_one_run(monkeypatch, mock_db):
+    import threading
+    import time
+    import backend.api as api
+    api.summary_cache.clear()
+    calls = []
+    release = threading.Event()
+
+    def fake_generate_summary(**kwargs):
+        calls.append(kwargs)
+        release.wait(5)
+        return "shared summary"
+
+    monkeypatch.setattr(api, "generate_summary", fake_generate_summary)
+    payload = {"text": "Identical meeting.", "model": "gpt-5-mini", "use_map": True}
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(client.post("/summarize", json=payload)))
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    deadline = time.time() + 5
+    while api.summary_flight.in_flight() == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert [r.json()["summary"] for r in responses] == ["shared summary"] * 3
+    assert mock_db.queue_history.call_count == 1
+
+    cached = client.post("/summarize", json={**payload, "map_concurrency": 8})
+    assert cached.json()["cached"] is True
+    assert len(calls) == 1
+
+
+def parse_sse(body):
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "data" in lines:
+            events.append(json.loads(lines["data"]))
+    return events
+
+
+def test_summarize_stream_emits_progress(monkeypatch):
+    import backend.api as api
+    api.summary_cache.clear()
+
+    def fake_generate_summary(on_event=None, **kwargs):
+        on_event({"event": "split", "chunks": [1, 1]})
+        on_event({"event": "map", "pass": 1, "index": 0, "content": "m1"})
+        for token in ["Final ", "summary"]:
+            on_event({"event": "token", "text": token})
+        return "Final summary"
+
+    monkeypatch.setattr(api, "generate_summary", fake_generate_summary)
+    with client.stream("POST", "/summarize/stream", json={"text": "Streamed meeting."}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.read().decode("utf-8"))
+
+    assert [e["event"] for e in events] == ["start", "split", "map", "token", "token", "done"]
+    assert events[-1]["summary"] == "Final summary"
+
+
+def test_summarize_stream_cancels_when_client_disconnects(monkeypatch):
+    import asyncio
+    import threading
+    import backend.api as api
+    from backend.core import SummaryCancelled
+    from backend.schemas import SummarizeRequest
+    api.summary_cache.clear()
+    cancelled = threading.Event()
+
+    def fake_generate_summary(on_event=None, cancel=None, **kwargs):
+        on_event({"event": "split", "chunks": [1, 1]})
+        # Stands in for the map queue, which checks cancel between LLM calls
+        if cancel.wait(5):
+            cancelled.set()
+            raise SummaryCancelled()
+        return "never read"
+
+    class Disconnecting:
+        def __init__(self):
+            self.polls = 0
+
+        async def is_disconnected(self):
+            self.polls += 1
+            return self.polls > 1
+
+    async def read_stream():
+        response = await api.api_summarize_stream(SummarizeRequest(text="Abandoned meeting."), Disconnecting())
+        parts = [part async for part in response.body_iterator]
+        assert await asyncio.to_thread(cancelled.wait, 5)
+        return parts
+
+    monkeypatch.setattr(api, "generate_summary", fake_generate_summary)
+    parts = asyncio.run(read_stream())
+    assert [e["event"] for e in parse_sse("".join(parts))] == ["start", "split"]
+    assert api.summary_cache.get(api.summarize_request_key(SummarizeRequest(text="Abandoned meeting."))) is None
+
+
+def test_summarize_stream_shares_run_with_summarize(monkeypatch, mock_db):
+    import threading
+    import time
+    import backend.api as api
+    api.summary_cache.clear()
+    calls = []
+    release = threading.Event()
+
+    def fake_generate_summary(on_event=None, **kwargs):
+        calls.append(kwargs)
+        release.wait(5)
+        return "shared summary"
+
+    monkeypatch.setattr(api, "generate_summary", fake_generate_summary)
+    payload = {"text": "Streamed and posted meeting.", "model": "gpt-5-mini"}
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(client.post("/summarize", json=payload)))
+    thread.start()
+    deadline = time.time() + 5
+    while api.summary_flight.in_flight() == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    threading.Timer(0.2, release.set).start()
+    with client.stream("POST", "/summarize/stream", json=payload) as response:
+        events = parse_sse(response.read().decode("utf-8"))
+    thread.join()
+
+    assert len(calls) == 1
+    assert events[-1]["event"] == "done" and events[-1]["summary"] == "shared summary"
+    assert events[-1]["cached"] is True
+    assert responses[0].json()["summary"] == "shared summary"
+    assert mock_db.queue_history.call_count == 1
+
+
+def test_cancelled_job_starts_no_more_llm_calls(monkeypatch, fake_encoding):
+    import threading
+    import time
+    from unittest.mock import MagicMock
+    import backend.api as api
+    from backend.core import COLLAPSE_TEMPLATE
+    from backend.jobs import JobManager, CANCELLED
+    from langchain.chains.llm import LLMChain
+    started = []
+    first = threading.Event()
+    release = threading.Event()
+
+    def fake_invoke(self, inputs, config=None):
+        if self.prompt.template == COLLAPSE_TEMPLATE:
+            started.append(inputs)
+            first.set()
+            release.wait(5)
+        return {"text": "c"}
+
+    monkeypatch.setattr(LLMChain, "invoke", fake_invoke)
+    manager = JobManager(MagicMock(), api.run_job, max_workers=1)
+    text = " ".join(f"speaker{i % 3} item{i}" for i in range(400))
+    # A collapse level of many groups emits no event until all of them are done, so only the
+    # cancel flag passed to the job can stop the queue from starting the rest
+    job = manager.submit({"text": text, "model": "gpt-5-mini", "chunk_size_1": 40, "chunk_overlap_1": 0,
+                          "chunk_size_2": 30, "chunk_overlap_2": 0, "token_max": 200, "use_map": False,
+                          "map_concurrency": 2})
+    assert first.wait(5)
+    assert manager.cancel(job.id) is True
+    release.set()
+    deadline = time.time() + 5
+    while manager.get(job.id)["status"] != CANCELLED and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.get(job.id)["status"] == CANCELLED
+    assert len(started) <= 2
+    manager.shutdown(wait=True)
+
+
+def test_jobs_endpoints():
+    import time
+    response = client.post("/jobs", json={"text": "Hello job test.", "test_mode": True})
+    assert response.status_code == 202, f"Detail: {response.json()}"
+    job_id = response.json()["id"]
+
+    deadline = time.time() + 5
+    job = client.get(f"/jobs/{job_id}").json()
+    while job["status"] not in ("done", "failed") and time.time() < deadline:
+        time.sleep(0.01)
+        job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "done"
+    assert "summary" in job
+
+    assert client.delete(f"/jobs/{job_id}").json()["cancelled"] is False
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+def test_session_endpoints(monkeypatch, mock_db, fake_encoding):
+    fake_encoding.chars_per_token = 1
+
+    def fake_summarize(self, on_event=None, stats=None):
+        self.summary = f"summary of {len(self.text)} chars"
+        return self.summary, {"chunks": [1, 1], "mapped": 2, "reused": 0}
+
+    monkeypatch.setattr("backend.sessions.SummarySession.summarize", fake_summarize)
+
+    response = client.post("/sessions", json={"text": "first segment ", "model": "gpt-5-mini"})
+    assert response.status_code == 201, response.json()
+    session_id = response.json()["id"]
+
+    response = client.post(f"/sessions/{session_id}/segments", json={"text": "second segment"})
+    assert response.status_code == 200, response.json()
+    body = response.json()
+    assert body["summary"] == "summary of 28 chars"
+    assert body["mapped"] == 2 and body["segments"] == 2 and body["retokenized"] == 2
+
+    assert client.get(f"/sessions/{session_id}").json()["tokens"] == 28
+    assert client.delete(f"/sessions/{session_id}", params={"save": True}).json()["saved"] is True
+    assert mock_db.queue_history.call_args[0][0]["text"] == "first segment second segment"
+    assert client.get(f"/sessions/{session_id}").status_code == 404
+    assert client.post("/sessions", json={"chunk_size_1": 10, "chunk_overlap_1": 20}).status_code == 400
+
+def test_summarize_upload_streams_body(monkeypatch, mock_db):
+    from backend import api
+    received = {}
+
+    def fake_generate_summary_stream(parts, **kwargs):
+        received["text"] = b"".join(parts).decode("utf-8")
+        received["kwargs"] = kwargs
+        return "streamed summary"
+
+    monkeypatch.setattr(api, "generate_summary_stream", fake_generate_summary_stream)
+    body = ("會議逐字稿 line " * 5000).encode("utf-8")
+    response = client.post("/summarize/upload", params={"model": "gpt-5-mini", "chunk_size_2": 4000},
+                           content=iter([body[i:i + 1000] for i in range(0, len(body), 1000)]),
+                           headers={"Content-Type": "text/plain; charset=utf-8"})
+    assert response.status_code == 200, response.json()
+    assert response.json()["summary"] == "streamed summary"
+    assert received["text"] == body.decode("utf-8")
+    assert received["kwargs"]["chunk_size_2"] == 4000 and received["kwargs"]["model"] == "gpt-5-mini"
+    assert mock_db.queue_history.call_args[0][0]["text"] == body.decode("utf-8")
@@ -0,0 +1,30 @@
+from backend.cache import LRUCache, MapCache, content_key
+
+
+def test_content_key_separates_parts():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("ab", "c") == content_key("ab", "c")
+
+
+def test_lru_cache_evicts_by_size():
+    cache = LRUCache(max_bytes=25)
+    cache.set("a", "x" * 9)
+    cache.set("b", "y" * 9)
+    cache.get("a")
+    cache.set("c", "z" * 9)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 9
+    assert cache.get("c") == "z" * 9
+    assert cache.bytes <= 25
+
+
+def test_map_cache_persistent_tier(tmp_path):
+    path = str(tmp_path / "map_cache.sqlite")
+    key = MapCache.key("chunk", "template {text}", "gpt-5-mini", 0, 1000)
+    MapCache(path=path).set(key, "cached output")
+
+    cache = MapCache(path=path)
+    assert cache.get(key) == "cached output"
+    assert cache.get(MapCache.key("chunk", "template {text}", "gpt-5-mini", 0.5, 1000)) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["persistent_hits"] == 1
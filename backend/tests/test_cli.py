@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import pytest
+from backend import splitter
+from backend.core import MapChunkError
+
+# Imported the way the scripts run, with cli/ first on sys.path, so "cli" is cli/cli.py and not the folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "cli"))
+import cli
+
+
+class FakeChain:
+    def __init__(self, calls, fail=None, delay=0.0):
+        self.calls = calls
+        self.fail = fail
+        self.delay = delay
+
+    def run(self, doc):
+        calls = self.calls
+        with calls["lock"]:
+            calls["in_flight"] += 1
+            calls["peak"] = max(calls["peak"], calls["in_flight"])
+        try:
+            time.sleep(self.delay)
+            if self.fail is not None and self.fail in doc.page_content:
+                raise RuntimeError("map failed")
+            with calls["lock"]:
+                calls["map"].append(doc.page_content)
+            return "m" + doc.page_content[:4]
+        finally:
+            with calls["lock"]:
+                calls["in_flight"] -= 1
+
+
+@pytest.fixture
+def fake_chains(monkeypatch, fake_encoding):
+    calls = {"map": [], "reduce": 0, "in_flight": 0, "peak": 0, "lock": threading.Lock()}
+    calls["chain"] = FakeChain(calls)
+    monkeypatch.setattr(cli, "init_llm", lambda args, max_tokens=1000: None)
+    monkeypatch.setattr(cli, "map_function", lambda llm: calls["chain"])
+
+    def fake_reduce(contents, args):
+        with calls["lock"]:
+            calls["reduce"] += 1
+        return "summary of " + " | ".join(contents)
+
+    monkeypatch.setattr(cli, "process_reduce_results", fake_reduce)
+    return calls
+
+
+def cli_args(output_dir, **overrides):
+    return argparse.Namespace(**{
+        "key": None, "file": None, "input_dir": None, "manifest": None, "model": "gpt-4-1106-preview",
+        "chunk_size_1": 60, "chunk_overlap_1": 15, "chunk_size_2": 30, "chunk_overlap_2": 0, "token_max": 1000,
+        "temperature": 0, "without_map": False, "max_concurrency": 2, "batch_concurrency": 2,
+        "checkpoint_dir": None, "output_dir": str(output_dir) + os.sep, **overrides})
+
+
+def transcript(start, count):
+    return "".join(f"speaker{i % 3} item{i} " for i in range(start, start + count))
+
+
+def write_inputs(folder, names):
+    os.makedirs(folder, exist_ok=True)
+    for n, name in enumerate(names):
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(transcript(n * 1000, 60))
+
+
+def test_batch_names_files_in_relative_dir(fake_chains, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_inputs("in", ["m1.txt", "m2.txt"])
+    report = cli.run_batch(cli_args("out", input_dir="./in"))
+    assert report["done"] == 2 and report["skipped"] == 0
+    outputs = sorted(os.listdir("out"))
+    assert [name for name in outputs if name.endswith(".txt")] == [
+        "m1_output_60_15_30_0_0.txt", "m2_output_60_15_30_0_0.txt"]
+
+
+def test_batch_rejects_duplicate_names(fake_chains, tmp_path):
+    write_inputs(tmp_path / "a", ["m.txt"])
+    write_inputs(tmp_path / "b", ["m.txt"])
+    manifest = tmp_path / "files.txt"
+    manifest.write_text("a/m.txt\nb/m.txt\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        cli.run_batch(cli_args(tmp_path / "out", manifest=str(manifest)))
+    assert fake_chains["map"] == []
+
+
+def test_batch_skips_finished_files(fake_chains, tmp_path):
+    write_inputs(tmp_path / "in", ["m1.txt", "m2.txt"])
+    args = cli_args(tmp_path / "out", input_dir=str(tmp_path / "in"))
+    cli.run_batch(args)
+    mapped = len(fake_chains["map"])
+    report = cli.run_batch(args)
+    assert report["done"] == 0 and report["skipped"] == 2
+    assert len(fake_chains["map"]) == mapped
+    with open(tmp_path / "out" / "batch_report.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["skipped"] == 2
+
+
+def test_batch_caps_llm_calls_across_files(fake_chains, tmp_path):
+    fake_chains["chain"].delay = 0.01
+    write_inputs(tmp_path / "in", [f"m{i}.txt" for i in range(4)])
+    report = cli.run_batch(cli_args(tmp_path / "out", input_dir=str(tmp_path / "in"), max_concurrency=2,
+                                    batch_concurrency=4))
+    assert report["done"] == 4
+    assert 1 < fake_chains["peak"] <= 2
+
+
+def test_checkpoint_resumes_only_missing_chunks(fake_chains, tmp_path):
+    write_inputs(tmp_path / "in", ["m1.txt"])
+    path = str(tmp_path / "in" / "m1.txt")
+    args = cli_args(tmp_path / "out", file=path)
+    fake_chains["chain"].fail = "item40 "
+    with pytest.raises(MapChunkError):
+        cli.process_file(args)
+    done = len(fake_chains["map"])
+    assert done > 0
+
+    fake_chains["chain"].fail = None
+    fake_chains["map"].clear()
+    response, file_name, info = cli.process_file(args)
+    assert file_name == "m1"
+    assert info["restored"] == done and info["mapped"] == len(fake_chains["map"])
+    assert all("item40 " in chunk for chunk in fake_chains["map"])
+    # Same reduce input as a run without the crash
+    index = splitter.TokenIndex(transcript(0, 60))
+    expected = ["m" + chunk[:4] for size, overlap in ((60, 15), (30, 0)) for chunk in index.split(size, overlap)]
+    assert response == "summary of " + " | ".join(expected)
+    assert not os.listdir(tmp_path / "out" / ".checkpoints")
+
+
+def test_sweep_shares_split_map_and_reduce_work(fake_chains, tmp_path, monkeypatch):
+    import sweep
+    monkeypatch.setattr(sweep, "init_llm", cli.init_llm)
+    monkeypatch.setattr(sweep, "map_function", cli.map_function)
+    monkeypatch.setattr(sweep, "process_reduce_results", cli.process_reduce_results)
+    monkeypatch.chdir(tmp_path)
+    write_inputs("in", ["a.txt"])
+    args = argparse.Namespace(chunk_size_1=[60, 40], chunk_overlap_1=[15], chunk_size_2=[30], chunk_overlap_2=[0],
+                              token_max=[1000, 2000], temperature=[0, 0.5], reduce_temperature=[0.0],
+                              without_map=False, max_concurrency=2, evaluate=True, output_dir="out", model="m", key=None)
+    os.makedirs("out")
+    configs = sweep.grid_configs(args)
+    rows, counts = sweep.sweep_file(args, "./in/a.txt", configs)
+
+    index = splitter.TokenIndex(transcript(0, 60))
+    chunks = {size: index.split(size, overlap) for size, overlap in ((60, 15), (40, 15), (30, 0))}
+    assert counts["configs"] == 8 and counts["chunkings"] == 3
+    # Each distinct chunk once per map temperature
+    assert counts["map_calls"] == 2 * len(set(chunks[60] + chunks[40] + chunks[30])) == len(fake_chains["map"])
+    assert counts["map_naive"] == 4 * (len(chunks[60]) + len(chunks[40]) + 2 * len(chunks[30]))
+    # The stub's map output ignores temperature, so both map temperatures share each reduce
+    assert counts["reduces"] == 4 == fake_chains["reduce"]
+    assert {row["file"] for row in rows} == {"a"}
+    assert len({row["output"] for row in rows}) == 8 and all(os.path.exists(row["output"]) for row in rows)
+    assert all(0 <= row["rouge1_fmeasure"] <= 1 for row in rows)
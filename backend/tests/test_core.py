@@ -2,6 +2,13 @@ import pytest
 from backend.core import split_text, init_llm, process_map_results, process_reduce_results
 from unittest.mock import MagicMock, patch
 
+@pytest.fixture(autouse=True)
+def empty_map_cache():
+    from backend.core import map_cache
+    map_cache.clear()
+    yield
+    map_cache.clear()
+
 def test_split_text():
     text = "This is a very long text that needs to be split into multiple chunks for processing."
     chunks = split_text(text, chunk_size=10, chunk_overlap=0)
@@ -30,3 +37,369 @@ def test_process_reduce_results(mock_invoke):
     split_docs = split_text("Test content for reduce", 100, 0)
     summary = process_reduce_results(split_docs, 4000, model)
     assert summary == "Mocked Reduce Result"
+
+def test_map_concurrently_keeps_order_and_bounds_in_flight():
+    import threading, time
+    from backend.core import map_concurrently
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+
+    def work(x):
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(0.01 * (5 - x % 5))
+        with lock:
+            state["in_flight"] -= 1
+        return x * 2
+
+    results = map_concurrently(work, range(10), max_concurrency=3)
+    assert results == [x * 2 for x in range(10)]
+    assert state["peak"] <= 3
+
+def test_map_concurrently_clamps_to_server_cap(monkeypatch):
+    import threading, time
+    from backend import core
+    monkeypatch.setattr(core, "MAP_CONCURRENCY_MAX", 2)
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+
+    def work(x):
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(0.01)
+        with lock:
+            state["in_flight"] -= 1
+        return x
+
+    assert core.map_concurrently(work, range(8), max_concurrency=1000) == list(range(8))
+    assert state["peak"] == 2
+    assert core.map_concurrently(work, range(3), max_concurrency=0) == [0, 1, 2]
+
+def test_map_concurrently_reports_failed_chunks():
+    from backend.core import map_concurrently, MapChunkError
+
+    def work(x):
+        if x == 2:
+            raise ValueError("boom")
+        return x
+
+    with pytest.raises(MapChunkError) as exc_info:
+        map_concurrently(work, range(4), max_concurrency=2)
+    assert exc_info.value.results == [0, 1, None, 3]
+    assert list(exc_info.value.errors) == [2]
+
+def test_interleave_passes_round_robin():
+    from backend.core import interleave_passes
+    order = interleave_passes([["a", "b", "c"], ["x"]])
+    assert order == [(0, 0), (1, 0), (0, 1), (0, 2)]
+
+@patch('langchain.chains.base.Chain.invoke')
+def test_process_map_passes_returns_results_per_pass(mock_invoke):
+    from backend.core import process_map_passes
+    from langchain_core.documents import Document
+    mock_invoke.side_effect = lambda doc: {"text": doc.page_content.upper()}
+    passes = [[Document(page_content="a"), Document(page_content="b")], [Document(page_content="c")]]
+    results = process_map_passes(passes, "google/gemma-3-27b-it:free", max_concurrency=2)
+    assert results == [["A", "B"], ["C"]]
+
+@patch('langchain.chains.base.Chain.invoke')
+def test_map_results_are_cached(mock_invoke):
+    from backend.core import map_cache
+    from langchain_core.documents import Document
+    mock_invoke.side_effect = lambda doc: {"text": doc.page_content.upper()}
+    docs = [Document(page_content="same chunk"), Document(page_content="other chunk")]
+    model = "google/gemma-3-27b-it:free"
+    assert process_map_results(docs, model) == ["SAME CHUNK", "OTHER CHUNK"]
+    assert process_map_results(docs, model) == ["SAME CHUNK", "OTHER CHUNK"]
+    assert mock_invoke.call_count == 2
+    # A different map template is a different cache entry
+    process_map_results(docs[:1], model, map_template="Summarize: {text}")
+    assert mock_invoke.call_count == 3
+    assert map_cache.stats()["hits"] == 2
+
+def test_init_llm_reuses_pooled_clients():
+    from backend.core import llm_pool
+    model = "google/gemma-3-27b-it:free"
+    first = init_llm(0, model, 1000)
+    assert init_llm(0, model, 1000) is first
+    other = init_llm(0.5, model, 1000)
+    assert other is not first
+    # Same provider, same keep-alive connection pool
+    assert other.client is first.client
+    assert init_llm(0, "gpt-5-mini", 1000).client is not first.client
+    assert llm_pool.stats()["clients_reused"] >= 1
+
+def test_llm_pool_closes_sync_and_async_clients():
+    import asyncio
+    from backend.core import LLMClientPool
+    pool = LLMClientPool()
+    for close in (pool.clear, lambda: asyncio.run(pool.aclose())):
+        pool.get(0, "gpt-5-mini", 1000)
+        (sync_client, async_client), = pool._clients.values()
+        close()
+        assert sync_client.is_closed() and async_client.is_closed()
+        assert pool.stats()["clients"] == 0 and pool.stats()["http_pools"] == 0
+
+def test_llm_pool_uses_provider_base_url_and_retries_throttled_calls(monkeypatch):
+    from benchmarks.fake_openai import FakeOpenAI, serve
+    from backend import core
+    from backend.ratelimit import ProviderScheduler
+    encoding = MagicMock()
+    encoding.encode_ordinary.side_effect = lambda text: text.split()
+    monkeypatch.setattr(core, "get_encoding", lambda name=None: encoding)
+    fake = FakeOpenAI(latency=0, fail_first=1, retry_after_ms=10)
+    server = serve(fake)
+    core.llm_pool.clear()
+    try:
+        monkeypatch.setitem(core.PROVIDERS["openai"], "base_url", f"http://127.0.0.1:{server.server_address[1]}/v1")
+        monkeypatch.setitem(core.schedulers, "openai", ProviderScheduler(max_retries=2, base_delay=0.01))
+        assert init_llm(0, "gpt-5-mini", 3).invoke("hello").content == "summary summary summary"
+        assert fake.stats()["throttled"] == 1 and fake.stats()["completions"] == 1
+        assert core.schedulers["openai"].retries == 1
+    finally:
+        core.llm_pool.clear()
+        server.shutdown()
+
+def test_streamed_call_is_only_retried_before_the_first_token(monkeypatch):
+    from langchain_openai import ChatOpenAI
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from langchain_core.messages import AIMessage
+    from backend import core
+    from backend.ratelimit import ProviderScheduler
+
+    class ServerError(Exception):
+        status_code = 503
+
+    class Tokens(BaseCallbackHandler):
+        def __init__(self):
+            self.tokens = []
+
+        def on_llm_new_token(self, token, **kwargs):
+            self.tokens.append(token)
+
+    encoding = MagicMock()
+    encoding.encode_ordinary.side_effect = lambda text: text.split()
+    monkeypatch.setattr(core, "get_encoding", lambda name=None: encoding)
+    monkeypatch.setitem(core.schedulers, "openai", ProviderScheduler(max_retries=3, base_delay=0.01))
+    attempts = []
+
+    def fake_generate(self, messages, stop=None, run_manager=None, **kwargs):
+        attempts.append(1)
+        if len(attempts) == 1 or fail_after_token:
+            if fail_after_token:
+                run_manager.on_llm_new_token("Partial")
+            raise ServerError("stream broke")
+        run_manager.on_llm_new_token("Whole")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Whole"))])
+
+    monkeypatch.setattr(ChatOpenAI, "_generate", fake_generate)
+    core.llm_pool.clear()
+    try:
+        llm = core.init_llm(0, "gpt-5-mini", 10, streaming=True)
+        fail_after_token = False
+        handler = Tokens()
+        assert llm.invoke("hello", config={"callbacks": [handler]}).content == "Whole"
+        assert len(attempts) == 2 and handler.tokens == ["Whole"]
+
+        attempts.clear()
+        fail_after_token = True
+        handler = Tokens()
+        with pytest.raises(ServerError):
+            llm.invoke("hello", config={"callbacks": [handler]})
+        assert len(attempts) == 1 and handler.tokens == ["Partial"]
+    finally:
+        core.llm_pool.clear()
+
+def test_pack_groups_preserves_order_under_token_max():
+    from backend.core import pack_groups
+    assert pack_groups([4, 4, 4, 9, 1], token_max=10, overhead=1, separator_tokens=1) == [[0, 1], [2], [3], [4]]
+    assert pack_groups([20], token_max=10) == [[0]]
+
+def test_tree_reduce_collapses_levels_concurrently(monkeypatch, fake_encoding):
+    import threading, time
+    import backend.core as core
+    from backend.metrics import SummaryStats
+    from langchain.chains.llm import LLMChain
+    fake_encoding.chars_per_token = 1
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0, "collapses": 0}
+
+    def fake_invoke(self, inputs, config=None):
+        if self.prompt.template == core.COLLAPSE_TEMPLATE:
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+                state["collapses"] += 1
+            time.sleep(0.02)
+            with lock:
+                state["in_flight"] -= 1
+            return {"text": "c" * 20}
+        return {"text": f"final:{len(inputs['docs'])}"}
+
+    monkeypatch.setattr(LLMChain, "invoke", fake_invoke)
+    events = []
+    stats = SummaryStats("gpt-5-mini")
+    summary, tree = core.tree_reduce(["x" * 30] * 8, token_max=70, model="gpt-5-mini",
+                                     reduce_template="R{docs}", max_concurrency=4,
+                                     on_event=events.append, stats=stats)
+    assert [level["groups"] for level in tree] == [[2, 2, 2, 2], [3, 1]]
+    assert state["collapses"] == 6 and state["peak"] > 1
+    assert summary == "final:42"
+    assert [e["level"] for e in events if e["event"] == "collapse"] == [1, 2]
+
+    recorded = stats.to_dict()
+    assert recorded["llm_calls"]["collapse"]["count"] == 6
+    assert recorded["llm_calls"]["reduce"]["count"] == 1
+    assert recorded["tokens"] == {"reduce_input": 240, "summary": 8}
+    assert set(recorded["stages"]) == {"collapse", "reduce"}
+
+
+def test_cancel_stops_map_queue_and_tree_reduce(monkeypatch, fake_encoding):
+    import threading
+    import backend.core as core
+    from langchain.chains.llm import LLMChain
+    cancel = threading.Event()
+    started = []
+
+    def work(x):
+        started.append(x)
+        if x == 3:
+            cancel.set()
+        return x
+
+    with pytest.raises(core.SummaryCancelled):
+        core.map_concurrently(work, range(20), max_concurrency=2, cancel=cancel)
+    # Calls already submitted finish; nothing new starts
+    assert 4 <= len(started) <= 5
+
+    fake_encoding.chars_per_token = 1
+    invoked = []
+    monkeypatch.setattr(LLMChain, "invoke", lambda self, inputs, config=None: invoked.append(inputs) or {"text": "c"})
+    with pytest.raises(core.SummaryCancelled):
+        core.tree_reduce(["x" * 30] * 8, token_max=70, model="gpt-5-mini", reduce_template="R{docs}",
+                         cancel=cancel)
+    assert invoked == []
+
+
+def test_importing_api_defers_llm_stack():
+    import subprocess
+    import sys
+    code = "import sys, backend.api; print(sorted(m for m in ('langchain', 'langchain_openai', 'openai', 'httpx') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip().splitlines()[-1] == "[]"
+
+@patch('langchain.chains.base.Chain.invoke')
+def test_process_map_passes_maps_duplicate_chunks_once(mock_invoke, monkeypatch):
+    import backend.core as core
+    from backend.metrics import SummaryStats
+    from langchain_core.documents import Document
+    mock_invoke.side_effect = lambda doc: {"text": doc.page_content[:12]}
+    meeting = " ".join(f"speaker{i % 4} reported item {i} as done" for i in range(200))
+    almost = meeting.replace("item 150 ", "item 151 ")
+    passes = [[Document(page_content="short meeting"), Document(page_content=meeting)],
+              [Document(page_content="short  meeting\n"), Document(page_content=almost), Document(page_content="other")]]
+
+    # By default only exact duplicates share a call
+    core.map_cache.clear()
+    stats = SummaryStats("gpt-5-mini")
+    results = core.process_map_passes(passes, "google/gemma-3-27b-it:free", stats=stats)
+    assert mock_invoke.call_count == 4
+    assert results == [["short meetin", meeting[:12]], ["short meetin", almost[:12], "other"]]
+    assert stats.to_dict()["map_dedup"] == {"exact": 1, "similar": 0, "saved_calls": 1}
+
+    # Near-duplicates are opt-in
+    core.map_cache.clear()
+    mock_invoke.reset_mock()
+    monkeypatch.setattr(core, "MAP_DEDUP_THRESHOLD", 0.9)
+    stats = SummaryStats("gpt-5-mini")
+    seen = []
+    results = core.process_map_passes(passes, "google/gemma-3-27b-it:free",
+                                      on_result=lambda p, i, c: seen.append((p, i)), stats=stats)
+    assert mock_invoke.call_count == 3
+    assert results == [["short meetin", meeting[:12]], ["short meetin", meeting[:12], "other"]]
+    assert sorted(seen) == [(0, 0), (0, 1), (1, 0), (1, 1), (1, 2)]
+    assert stats.to_dict()["map_dedup"] == {"exact": 1, "similar": 1, "saved_calls": 2}
+    core.map_cache.clear()
+
+@patch('langchain.chains.base.Chain.invoke')
+def test_map_planning_overlaps_calls_and_skips_cached_chunks(mock_invoke, monkeypatch):
+    import backend.core as core
+    from backend import dedup
+    from langchain_core.documents import Document
+    sketched = []
+    real_sketch = dedup.sketch
+    monkeypatch.setattr(dedup, "sketch", lambda text, *args: sketched.append(text) or real_sketch(text, *args))
+    monkeypatch.setattr(core, "MAP_DEDUP_THRESHOLD", 0.9)
+    sketched_at_first_call = []
+
+    def fake_invoke(doc):
+        sketched_at_first_call.append(len(sketched))
+        return {"text": doc.page_content[:6]}
+
+    mock_invoke.side_effect = fake_invoke
+    docs = [Document(page_content=f"chunk {i} " + "x" * i * 40) for i in range(8)]
+    core.map_cache.clear()
+    core.process_map_passes([docs[:4], docs[4:]], "google/gemma-3-27b-it:free", max_concurrency=2)
+    # The first calls start while later chunks are still unplanned
+    assert sketched_at_first_call[0] <= 2 and len(sketched) == 8
+    sketched.clear()
+    results = core.process_map_passes([docs[:4], docs[4:]], "google/gemma-3-27b-it:free", max_concurrency=2)
+    # Every output is cached, so nothing is sketched or mapped again
+    assert sketched == [] and mock_invoke.call_count == 8
+    assert results[1][0] == "chunk "
+    core.map_cache.clear()
+
+def test_map_planning_fails_duplicates_of_an_already_failed_chunk():
+    from backend.core import map_planned
+
+    class Runner:
+        calls = []
+
+        def lookup(self, doc):
+            return None
+
+        def compute(self, doc):
+            self.calls.append(doc.page_content)
+            if doc.page_content == "broken":
+                raise RuntimeError("map failed")
+            return "ok"
+
+    # One call at a time, so the first "broken" has failed before its copy is planned
+    items = [((0, 0), "broken"), ((0, 1), "fine"), ((1, 0), "broken")]
+    results, errors = map_planned(iter(items), Runner(), max_concurrency=1)
+    assert Runner.calls == ["broken", "fine"]
+    assert results == {(0, 1): "ok"}
+    assert set(errors) == {(0, 0), (1, 0)}
+
+def test_generate_summary_stream_matches_generate_summary(monkeypatch, fake_encoding):
+    import backend.core as core
+    from langchain.chains.llm import LLMChain
+    fake_encoding.chars_per_token = 1
+    calls = {"map": 0, "reduce": []}
+
+    def fake_invoke(self, inputs, config=None):
+        if hasattr(inputs, "page_content"):
+            calls["map"] += 1
+            return {"text": inputs.page_content[:6]}
+        calls["reduce"].append(inputs["docs"])
+        return {"text": "summary"}
+
+    monkeypatch.setattr(LLMChain, "invoke", fake_invoke)
+    settings = dict(model="gpt-5-mini", chunk_size_1=400, chunk_overlap_1=100, chunk_size_2=200, chunk_overlap_2=0,
+                    token_max=100000, use_map=True, map_template="{docs}", reduce_template="{docs}")
+    text = " ".join(f"發言人{i % 3} item{i}" for i in range(400))
+    assert core.generate_summary(text, **settings) == "summary"
+    body = text.encode("utf-8")
+    parts = (body[i:i + 97] for i in range(0, len(body), 97))
+    assert core.generate_summary_stream(parts, **settings) == "summary"
+    assert calls["reduce"][0] == calls["reduce"][1]
+
+    # Both passes produce the same single chunk; it is mapped once
+    core.map_cache.clear()
+    calls["map"] = 0
+    core.generate_summary_stream([b"short meeting"], **settings)
+    assert calls["map"] == 1
+    assert calls["reduce"][-1] == "short \n\nshort "
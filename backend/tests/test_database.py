@@ -1,7 +1,11 @@
 import pytest
-from backend.database import Database
+from backend.database import Database, AsyncDatabase, HistoryWriter, decode_cursor
+from backend.compression import decompress_text
+from datetime import datetime
 from bson import ObjectId
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
+import asyncio
+import os
 
 @pytest.fixture
 def db(monkeypatch):
@@ -18,6 +22,7 @@ def db(monkeypatch):
         # Mock delete_one to return something with deleted_count
         mock_coll.delete_one.return_value = MagicMock(deleted_count=1)
         instance.collection = mock_coll
+        instance.transcripts = MagicMock()
         instance.client = MagicMock()
     return instance
 
@@ -48,3 +53,150 @@ def test_insert_and_delete_history(db):
     delete_result = db.delete_history(inserted_id)
     assert delete_result is not None
     assert delete_result.deleted_count == 1
+
+def test_history_cursor_round_trip(db):
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123000)
+    id = ObjectId()
+    db.collection.find.return_value.sort.return_value.limit.return_value = [{
+        "_id": id,
+        "preview": "Test",
+        "text_length": 18,
+        "summary": "s",
+        "model": "m",
+        "processing_time": 1.0,
+        "created_at": created_at,
+    }]
+    page = db.get_history(limit=1)
+    assert page[0]["original_text"] == "Test"
+    assert page[0]["text_length"] == 18
+    assert decode_cursor(page[0]["cursor"]) == (created_at, id)
+
+    db.get_history(limit=1, cursor=page[0]["cursor"])
+    query, projection = db.collection.find.call_args.args
+    assert query == {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": id}},
+    ]}
+    assert "text" not in projection
+
+def test_history_invalid_cursor(db):
+    with pytest.raises(ValueError):
+        db.get_history(cursor="not-a-cursor")
+
+def test_history_writer_batches_inserts(db, tmp_path):
+    collection = db.collection
+    writer = HistoryWriter(db, batch_size=3, flush_interval=0.05, spill_path=str(tmp_path / "spill.jsonl"))
+    ids = [writer.put({"text": f"t{i}"}) for i in range(5)]
+    writer.close()
+    written = [record for call in collection.insert_many.call_args_list for record in call.args[0]]
+    assert [record["_id"] for record in written] == ids
+    assert all("created_at" in record for record in written)
+    assert collection.insert_many.call_count == 2
+    assert writer.stats()["written"] == 5
+
+def test_history_writer_spills_and_drains(db, tmp_path):
+    spill_path = str(tmp_path / "spill.jsonl")
+    collection = db.collection
+    collection.insert_many.side_effect = Exception("mongo down")
+    writer = HistoryWriter(db, flush_interval=0.05, max_retries=1, base_delay=0, spill_path=spill_path)
+    id = writer.put({"text": "kept"})
+    writer.close()
+    assert writer.stats()["spilled"] == 1
+    assert os.path.exists(spill_path)
+
+    collection.insert_many.side_effect = None
+    writer = HistoryWriter(db, spill_path=spill_path)
+    assert writer.drain_spill() == 1
+    assert collection.insert_many.call_args.args[0][0]["_id"] == id
+    assert not os.path.exists(spill_path)
+
+def test_history_stores_transcript_once_compressed(db):
+    text = "the same long meeting transcript " * 100
+    db.insert_history_batch([{"text": text, "summary": "short"}, {"text": text, "summary": "x" * 1000}])
+    operations = db.transcripts.bulk_write.call_args.args[0]
+    assert len(operations) == 1
+    transcript = operations[0]._doc["$setOnInsert"]
+    assert isinstance(transcript["text"], bytes) and len(transcript["text"]) < len(text)
+    assert decompress_text(transcript["text"]) == text
+
+    records = db.collection.insert_many.call_args.args[0]
+    assert all("text" not in r and r["text_id"] == transcript["_id"] for r in records)
+    assert records[0]["summary"] == "short"
+    assert decompress_text(records[1]["summary"]) == "x" * 1000
+
+    db.transcripts.find_one.return_value = transcript
+    db.collection.find_one.return_value = {**records[1], "_id": ObjectId(), "created_at": datetime.now()}
+    item = db.get_history_item(str(ObjectId()))
+    assert item["original_text"] == text
+    assert item["summary"] == "x" * 1000
+
+def test_collect_transcripts_keeps_referenced_and_recent(db):
+    db.transcripts = MagicMock()
+    db.transcripts.find.return_value.sort.return_value.limit.side_effect = [
+        [{"_id": "used"}, {"_id": "orphan"}], []]
+    db.collection.distinct.return_value = ["used"]
+    db.transcripts.delete_many.return_value = MagicMock(deleted_count=1)
+    assert db.collect_transcripts(grace=60) == 1
+
+    query = db.transcripts.find.call_args_list[0].args[0]
+    cutoff = query["used_at"]["$not"]["$gte"]
+    assert 55 < (datetime.now() - cutoff).total_seconds() < 65
+    assert db.transcripts.find.call_args_list[1].args[0]["_id"] == {"$gt": "orphan"}
+    # The delete repeats the grace check, so a transcript re-stored meanwhile survives
+    db.transcripts.delete_many.assert_called_once_with({"_id": {"$in": ["orphan"]}, "used_at": query["used_at"]})
+
+def test_store_transcripts_marks_use(db):
+    db.insert_history({"text": "some transcript", "summary": "s"})
+    update = db.transcripts.bulk_write.call_args.args[0][0]._doc
+    assert "used_at" in update["$set"] and "used_at" not in update["$setOnInsert"]
+
+def test_migrate_history(db):
+    from backend.migrate import migrate_history
+    text = "a legacy transcript that was stored inline " * 20
+    legacy = [{"_id": ObjectId(), "text": text, "summary": "s", "created_at": datetime.now()} for _ in range(3)]
+    db.collection.find.return_value.sort.return_value.limit.side_effect = [legacy, []]
+    stats = migrate_history(db, batch_size=10)
+    assert stats["records"] == 3
+    assert stats["transcripts"] == 1
+    assert stats["bytes_after"] < stats["bytes_before"]
+    updates = db.collection.bulk_write.call_args.args[0]
+    assert updates[0]._doc["$unset"] == {"text": ""}
+    assert "text" not in updates[0]._doc["$set"]
+
+
+class AsyncRecords:
+    def __init__(self, records):
+        self.records = iter(records)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.records)
+        except StopIteration:
+            raise StopAsyncIteration
+
+def test_async_database_reads_and_deletes():
+    db = AsyncDatabase()
+    assert asyncio.run(db.get_history()) == []
+    db.collection = MagicMock()
+    db.transcripts = MagicMock()
+    created_at = datetime.now()
+    record = {"_id": ObjectId(), "preview": "p", "text_length": 9, "text_id": "h", "summary": "s",
+              "model": "m", "processing_time": 1.0, "created_at": created_at}
+    db.collection.find.return_value.sort.return_value.limit.return_value = AsyncRecords([record])
+    page = asyncio.run(db.get_history(limit=1))
+    assert page[0]["original_text"] == "p"
+    assert decode_cursor(page[0]["cursor"]) == (created_at, record["_id"])
+
+    db.collection.find_one = AsyncMock(return_value=dict(record))
+    db.transcripts.find_one = AsyncMock(return_value={"_id": "h", "text": "full text"})
+    assert asyncio.run(db.get_history_item(str(record["_id"])))["original_text"] == "full text"
+
+    db.collection.delete_one = AsyncMock(return_value=MagicMock(deleted_count=1))
+    db.transcripts.delete_one = AsyncMock()
+    assert asyncio.run(db.delete_history(str(record["_id"]))).deleted_count == 1
+    db.collection.delete_one.assert_awaited_once_with({"_id": record["_id"]})
+    # A concurrent insert may be reusing the transcript, so it is left to collect_transcripts
+    db.transcripts.delete_one.assert_not_awaited()
@@ -0,0 +1,30 @@
+from backend.dedup import plan_dedup, similarity, sketch
+
+
+def test_plan_dedup_exact_and_similar():
+    base = " ".join(f"word{i}" for i in range(500))
+    near = base.replace("word250 ", "word999 ")
+    owners, exact, similar = plan_dedup([base, "unrelated text", base + "\n", near, base[:len(base) // 2]],
+                                        threshold=0.9)
+    assert owners == [0, 1, 0, 0, 4]
+    assert (exact, similar) == (1, 1)
+
+
+def test_plan_dedup_default_is_exact_only():
+    base = " ".join(f"word{i}" for i in range(500))
+    owners, exact, similar = plan_dedup([base, base + " ", base.replace("word250 ", "word999 ")])
+    assert owners == [0, 0, 2] and (exact, similar) == (1, 0)
+
+
+def test_plan_dedup_threshold_above_one_is_exact_only():
+    base = " ".join(f"word{i}" for i in range(500))
+    owners, exact, similar = plan_dedup([base, base.replace("word250 ", "word999 ")], threshold=1.01)
+    assert owners == [0, 1] and (exact, similar) == (0, 0)
+
+
+def test_similarity_estimates_jaccard():
+    a = " ".join(f"w{i}" for i in range(2000))
+    b = " ".join(f"w{i}" for i in range(1000, 3000))
+    assert similarity(sketch(a), sketch(a)) == 1.0
+    assert 0.2 < similarity(sketch(a), sketch(b)) < 0.5
+    assert similarity(sketch("abc"), sketch("xyz")) == 0.0
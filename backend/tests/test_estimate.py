@@ -0,0 +1,54 @@
+import pytest
+from backend import core
+from backend.estimate import estimate_summary, project_reduce_tree
+from backend.splitter import TokenIndex
+
+
+@pytest.fixture(autouse=True)
+def offline_encodings(fake_encoding, monkeypatch):
+    # The model's encoding deliberately differs from the splitter's
+    model = type(fake_encoding)(chars_per_token=2)
+    monkeypatch.setattr(core, "model_encoding", lambda name: model)
+    return fake_encoding
+
+
+def test_estimate_matches_splitter_chunks():
+    text = " ".join(f"speaker{i % 7} said item{i}" for i in range(3000))
+    result = estimate_summary(text, "gpt-5-mini", 400, 100, 200, 0, token_max=2000, map_template="{docs}",
+                              reduce_template="{docs}")
+    index = TokenIndex(text)
+    assert result["chunks"] == [len(index.split(400, 100)), len(index.split(200, 0))]
+    assert result["llm_calls"]["map"] == sum(result["chunks"])
+    assert result["tokens"]["input"] == index.span_tokens()
+    assert result["reduce_depth"] == len(result["reduce_tree"]) > 0
+    assert result["llm_calls"]["collapse"] == sum(len(level["groups"]) for level in result["reduce_tree"])
+    assert result["fits"] is True
+    mini = result["models"]["gpt-5-mini"]
+    assert mini["cost_usd"] > 0 and mini["latency_seconds"] == pytest.approx(sum(mini["stages"].values()), abs=0.05)
+
+
+def test_estimate_without_map_reduces_chunks_directly():
+    text = " ".join(f"word{i}" for i in range(500))
+    result = estimate_summary(text, "unknown-model", 100, 0, 50, 0, token_max=100000, use_map=False,
+                              reduce_template="{docs}")
+    assert result["llm_calls"] == {"map": 0, "collapse": 0, "reduce": 1}
+    assert result["models"]["unknown-model"] is None
+
+
+def test_estimate_packs_like_tree_reduce(monkeypatch):
+    from langchain.chains.llm import LLMChain
+    monkeypatch.setattr(LLMChain, "invoke", lambda self, inputs, config=None: {"text": "c" * 40})
+    text = " ".join(f"word{i}" for i in range(400))
+    result = estimate_summary(text, "gpt-5-mini", 60, 0, 30, 0, token_max=300, use_map=False,
+                              reduce_template="Summarize:{docs}")
+    index = TokenIndex(text)
+    _, tree = core.tree_reduce(index.split(60, 0) + index.split(30, 0), token_max=300, model="gpt-5-mini",
+                               reduce_template="Summarize:{docs}")
+    assert result["reduce_tree"][0]["groups"] == tree[0]["groups"]
+    assert result["reduce_tree"][0]["tokens_in"] == tree[0]["tokens_in"]
+
+
+def test_project_reduce_tree_gives_up_when_collapses_do_not_shrink():
+    levels, fits = project_reduce_tree([50] * 10, token_max=60, overhead=0, separator_tokens=0,
+                                       collapse_output_tokens=50)
+    assert fits is False
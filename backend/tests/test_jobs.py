@@ -0,0 +1,58 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from backend.jobs import JobManager, DONE, CANCELLED, QUEUED, RUNNING
+
+
+def wait_for(manager, id, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {id} never reached {statuses}")
+
+
+def test_job_runs_and_reports_partial_results():
+    db = MagicMock()
+
+    def runner(request, on_event, cancel):
+        on_event({"event": "split", "chunks": [2, 1]})
+        on_event({"event": "map", "pass": 1, "index": 0, "content": "part"})
+        return f"summary of {request['text']}"
+
+    manager = JobManager(db, runner, max_workers=1)
+    job = manager.submit({"text": "meeting"})
+    result = wait_for(manager, job.id, [DONE])
+    assert result["summary"] == "summary of meeting"
+    assert result["chunks"] == [2, 1]
+    assert result["partial_results"] == [{"pass": 1, "index": 0, "content": "part"}]
+    db.insert_job.assert_called_once()
+    assert db.update_job.call_args[0][1]["status"] == DONE
+
+
+def test_job_cancellation_stops_runner():
+    started = threading.Event()
+
+    def runner(request, on_event, cancel):
+        started.set()
+        while True:
+            on_event({"event": "token", "text": "."})
+            time.sleep(0.01)
+
+    manager = JobManager(MagicMock(), runner, max_workers=1)
+    job = manager.submit({"text": "long meeting"})
+    started.wait(5)
+    assert manager.cancel(job.id) is True
+    assert wait_for(manager, job.id, [CANCELLED])["status"] == CANCELLED
+    assert manager.cancel(job.id) is False
+
+
+def test_resume_requeues_unfinished_jobs():
+    db = MagicMock()
+    db.find_jobs.return_value = [{"_id": "abc", "status": RUNNING, "request": {"text": "restart"}}]
+    manager = JobManager(db, lambda request, on_event, cancel: "resumed", max_workers=1)
+    assert manager.resume() == ["abc"]
+    db.find_jobs.assert_called_once_with([QUEUED, RUNNING])
+    assert wait_for(manager, "abc", [DONE])["summary"] == "resumed"
@@ -0,0 +1,45 @@
+from backend.metrics import Registry, SummaryStats, registry
+
+
+def test_registry_renders_prometheus_text():
+    reg = Registry()
+    calls = reg.counter("demo_calls", "Calls", ["stage"])
+    latency = reg.histogram("demo_seconds", "Latency", ["stage"], buckets=(0.1, 1))
+    reg.add_collector("demo_cache", lambda: {"hits": 3, "hit_rate": 0.75, "name": "x"})
+    reg.add_collector("demo_limit", lambda: {"openai": {"calls": 2}}, label="provider")
+    calls.inc(stage="map")
+    calls.inc(2, stage="map")
+    latency.observe(0.5, stage="map")
+    latency.observe(2.0, stage="map")
+
+    lines = reg.render().splitlines()
+    assert "# TYPE demo_calls counter" in lines
+    assert 'demo_calls_total{stage="map"} 3' in lines
+    assert 'demo_seconds_bucket{stage="map",le="0.1"} 0' in lines
+    assert 'demo_seconds_bucket{stage="map",le="1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="map",le="+Inf"} 2' in lines
+    assert 'demo_seconds_count{stage="map"} 2' in lines
+    assert 'demo_seconds_sum{stage="map"} 2.5' in lines
+    assert "demo_cache_hits 3" in lines and "demo_cache_hit_rate 0.75" in lines
+    assert not any(line.startswith("demo_cache_name") for line in lines)
+    assert 'demo_limit_calls{provider="openai"} 2' in lines
+
+
+def test_summary_stats_feeds_request_and_process_metrics():
+    stats = SummaryStats("test-model")
+    with stats.stage("map"):
+        pass
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        stats.llm_call("map", seconds)
+    stats.cache_lookup(True)
+    stats.cache_lookup(False)
+    stats.add_tokens("input", 100)
+    stats.add_chunks([3, 5])
+
+    recorded = stats.to_dict()
+    assert "map" in recorded["stages"]
+    assert recorded["chunks"] == [3, 5]
+    assert recorded["tokens"] == {"input": 100}
+    assert recorded["llm_calls"]["map"] == {"count": 4, "mean": 2.5, "p50": 3.0, "p95": 4.0, "max": 4.0}
+    assert recorded["map_cache"]["hit_rate"] == 0.5
+    assert 'mmsummary_llm_call_seconds_count{stage="map",model="test-model"}' in registry.render()
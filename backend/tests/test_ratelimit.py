@@ -0,0 +1,81 @@
+import time
+import pytest
+from types import SimpleNamespace
+from backend.ratelimit import TokenBucket, AIMDLimiter, ProviderScheduler, retry_after
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=429, headers=headers)
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate_per_minute=600)
+    bucket.tokens = 0
+    start = time.monotonic()
+    bucket.acquire(1)
+    assert time.monotonic() - start >= 0.09
+
+
+def test_aimd_limiter_shrinks_and_recovers():
+    limiter = AIMDLimiter(8, maximum=8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert 4 < limiter.limit <= 5
+
+
+def test_retry_after_header():
+    assert retry_after(FakeRateLimitError(retry_after=2)) == 2.0
+    assert retry_after(ValueError()) is None
+
+
+def test_scheduler_retries_throttled_calls():
+    scheduler = ProviderScheduler(max_concurrency=4, max_retries=3, base_delay=0.01)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise FakeRateLimitError(retry_after=0.05)
+        return "ok"
+
+    assert scheduler.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.05
+    stats = scheduler.stats()
+    assert stats["retries"] == 2 and stats["throttled"] == 2
+    assert stats["concurrency_limit"] < 4
+
+
+def test_scheduler_does_not_retry_client_errors():
+    scheduler = ProviderScheduler(max_retries=3, base_delay=0.01)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        scheduler.call(bad_request)
+    assert len(calls) == 1
+
+
+def test_scheduler_retryable_can_veto_retries():
+    scheduler = ProviderScheduler(max_retries=3, base_delay=0.01)
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        raise FakeRateLimitError(retry_after=0)
+
+    with pytest.raises(FakeRateLimitError):
+        scheduler.call(throttled, retryable=lambda error: len(calls) < 2)
+    assert len(calls) == 2
@@ -0,0 +1,102 @@
+import pytest
+from langchain.chains.llm import LLMChain
+import backend.core as core
+from backend.sessions import SessionManager, SummarySession
+from backend.splitter import TokenIndex
+
+
+@pytest.fixture(autouse=True)
+def fake_llm(monkeypatch, fake_encoding):
+    calls = {"map": [], "collapse": 0, "reduce": []}
+
+    def fake_invoke(self, inputs, config=None):
+        if self.prompt.template == core.COLLAPSE_TEMPLATE:
+            calls["collapse"] += 1
+            return {"text": "c" + str(len(inputs["docs"]))}
+        if hasattr(inputs, "page_content"):
+            calls["map"].append(inputs.page_content)
+            return {"text": "m" + inputs.page_content[:4]}
+        calls["reduce"].append(inputs["docs"])
+        return {"text": "summary"}
+
+    monkeypatch.setattr(LLMChain, "invoke", fake_invoke)
+    core.map_cache.clear()
+    yield calls
+    core.map_cache.clear()
+
+
+def session_request(**overrides):
+    return {"model": "gpt-5-mini", "chunk_size_1": 60, "chunk_overlap_1": 15, "chunk_size_2": 30,
+            "chunk_overlap_2": 0, "token_max": 100000, "use_map": True, "map_temple": "M{docs}",
+            "reduce_temple": "R{docs}", "reduce_temperature": 0.0, "map_concurrency": 2, **overrides}
+
+
+def segment(start, count):
+    return "".join(f"speaker{i % 3} item{i} " for i in range(start, start + count))
+
+
+def test_session_maps_only_new_chunks(fake_llm):
+    session = SummarySession("s", session_request())
+    session.append(segment(0, 100))
+    _, first = session.summarize()
+    assert first["mapped"] == sum(first["chunks"]) and first["reused"] == 0
+
+    fake_llm["map"].clear()
+    session.append(segment(100, 10))
+    _, second = session.summarize()
+    assert 0 < second["mapped"] < first["mapped"]
+    assert second["reused"] == sum(second["chunks"]) - second["mapped"]
+
+    # Same reduce input as splitting and mapping the whole transcript from scratch
+    index = TokenIndex(session.text)
+    expected = ["m" + chunk[:4] for size, overlap in ((60, 15), (30, 0)) for chunk in index.split(size, overlap)]
+    assert fake_llm["reduce"][-1] == core.DOCUMENT_SEPARATOR.join(expected)
+    assert set(fake_llm["map"]) <= set(index.split(60, 15)) | set(index.split(30, 0))
+
+
+def test_session_remaps_chunks_the_segment_continues(fake_llm):
+    session = SummarySession("s", session_request(use_map=True))
+    session.append("alpha beta gam")
+    session.summarize()
+    # "gam" + "ma" is one word, so the chunk holding it has to be mapped again
+    session.append("ma delta")
+    _, counts = session.summarize()
+    assert counts["mapped"] == 2
+    assert session.text == "alpha beta gamma delta"
+    assert fake_llm["map"][-1] == "alpha beta gamma delta"
+
+
+def test_session_reuses_collapses(fake_llm):
+    session = SummarySession("s", session_request(token_max=40))
+    session.append(segment(0, 400))
+    session.summarize()
+    first = fake_llm["collapse"]
+    assert first > 4
+    session.append(segment(400, 2))
+    session.summarize()
+    assert fake_llm["collapse"] - first < first
+
+
+def test_session_requires_text():
+    with pytest.raises(ValueError):
+        SummarySession("s", session_request()).summarize()
+
+
+def test_session_manager_expires_idle_sessions():
+    manager = SessionManager(ttl=60, max_sessions=2)
+    first = manager.create(session_request())
+    second = manager.create(session_request())
+    first.updated_at -= 120
+    assert manager.get(first.id) is None
+    assert manager.get(second.id) is second
+    manager.create(session_request())
+    manager.create(session_request())
+    assert manager.stats()["sessions"] == 2
+    assert manager.remove(second.id) is None
+
+
+def test_session_manager_with_no_capacity_keeps_nothing():
+    manager = SessionManager(ttl=60, max_sessions=0)
+    session = manager.create(session_request())
+    assert manager.get(session.id) is None
+    assert manager.stats()["sessions"] == 0
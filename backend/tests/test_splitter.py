@@ -0,0 +1,90 @@
+import pytest
+from langchain.text_splitter import CharacterTextSplitter
+from backend.splitter import TokenIndex
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(fake_encoding):
+    return fake_encoding
+
+
+def reference_split(text, chunk_size, chunk_overlap, fake):
+    text_splitter = CharacterTextSplitter(
+        separator=" ",
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=lambda t: len(fake.encode(t)),
+    )
+    docs = text_splitter.split_documents(text_splitter.create_documents([text]))
+    return [doc.page_content for doc in docs]
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(10, 0), (10, 4), (25, 10), (7, 7), (1000, 0)])
+def test_token_index_matches_character_splitter(fake_encoding, chunk_size, chunk_overlap):
+    words = ["meeting", "action", "item", "\nnext", "q3", "budget", "approved.", "", "extraordinarilylongword"]
+    text = " ".join(words[i % len(words)] for i in range(300)) + "  trailing  "
+    index = TokenIndex(text)
+    assert index.split(chunk_size, chunk_overlap) == reference_split(text, chunk_size, chunk_overlap, fake_encoding)
+
+
+def test_token_index_reused_across_chunkings(fake_encoding):
+    text = " ".join(f"word{i}" for i in range(200))
+    index = TokenIndex(text)
+    assert index.split(20, 5) == reference_split(text, 20, 5, fake_encoding)
+    assert index.split(50, 0) == reference_split(text, 50, 0, fake_encoding)
+
+
+def test_token_index_rejects_overlap_larger_than_chunk():
+    with pytest.raises(ValueError):
+        TokenIndex("a b c").windows(5, 10)
+
+
+def test_token_index_span_tokens(fake_encoding):
+    text = " ".join(f"word{i}" for i in range(50))
+    index = TokenIndex(text)
+    sep = len(fake_encoding.encode(" "))
+    for first, end in index.windows(20, 5):
+        pieces = index.chunk_text(first, end).split(" ")
+        assert index.span_tokens(first, end) == sum(len(fake_encoding.encode(p)) for p in pieces) + sep * (len(pieces) - 1)
+        assert index.span_tokens(first, end) <= 20
+    assert index.span_tokens(3, 3) == 0
+    assert index.windows(20, 5) is index.windows(20, 5)
+
+
+def test_token_index_append_matches_full_index(fake_encoding):
+    import random
+    random.seed(7)
+    words = ["meeting", "q3", "", "\nnext", "approved.", "extraordinarilylongword"]
+    index = TokenIndex("")
+    text = ""
+    for step in range(40):
+        segment = "".join(random.choice(words) + random.choice([" ", "", "  "]) for _ in range(random.randint(0, 25)))
+        changed = index.append(segment)
+        text += segment
+        fresh = TokenIndex(text)
+        assert list(index.tokens) == list(fresh.tokens) and list(index.starts) == list(fresh.starts)
+        assert changed <= len(fresh)
+        for chunk_size, chunk_overlap in ((20, 5), (9, 0)):
+            assert index.windows(chunk_size, chunk_overlap) == fresh.windows(chunk_size, chunk_overlap)
+        assert index.split(20, 5) == reference_split(text, 20, 5, fake_encoding)
+
+
+def test_streaming_splitter_matches_token_index(fake_encoding):
+    from backend.splitter import StreamingSplitter
+    import random
+    random.seed(11)
+    words = ["meeting", "q3", "", "\nnext", "approved.", "extraordinarilylongwordthatdoesnotfit"]
+    text = "".join(random.choice(words) + random.choice([" ", "", "  "]) for _ in range(3000))
+    stream = StreamingSplitter([(40, 10), (25, 0)])
+    chunks = [[], []]
+    longest = 0
+    for start in range(0, len(text), 53):
+        for p, chunk, tokens in stream.feed(text[start:start + 53]):
+            chunks[p].append(chunk)
+        longest = max(longest, len(stream.index.text))
+    for p, chunk, tokens in stream.finish():
+        chunks[p].append(chunk)
+    assert chunks == [reference_split(text, 40, 10, fake_encoding), reference_split(text, 25, 0, fake_encoding)]
+    assert stream.tokens() == TokenIndex(text).span_tokens()
+    # Only the unfinished chunks are buffered, not the whole text
+    assert longest < len(text) // 20
@@ -0,0 +1,53 @@
+"""
+Latency of the zero-LLM /estimate projection on a large transcript, cold
+(text not indexed yet) and warm (TokenIndex reused from cached_index).
+
+    python benchmarks/bench_estimate.py --tokens 200000
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_splitter import synthetic_transcript
+from backend.estimate import estimate_summary
+from backend.splitter import cached_index, count_tokens, get_encoding
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Transcript to estimate (default: synthetic)")
+    parser.add_argument("--tokens", type=int, default=200000, help="Size of the synthetic transcript")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per variant, best time is reported")
+    parser.add_argument("--model", type=str, default="gpt-5-mini")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = synthetic_transcript(args.tokens)
+    get_encoding()
+    params = dict(model=args.model, chunk_size_1=16000, chunk_overlap_1=4000, chunk_size_2=8000, chunk_overlap_2=0,
+                  token_max=16000)
+
+    cold = []
+    warm = []
+    for _ in range(args.repeat):
+        cached_index.cache_clear()
+        start = time.perf_counter()
+        result = estimate_summary(text, **params)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        estimate_summary(text, **{**params, "chunk_size_2": 6000})
+        warm.append(time.perf_counter() - start)
+
+    print(f"input: {len(text)} chars / {count_tokens(text)} tokens -> chunks {result['chunks']}, "
+          f"{result['llm_calls']}, depth {result['reduce_depth']}")
+    print(f"cold (tokenize + project): {min(cold) * 1000:8.1f} ms")
+    print(f"warm (cached index):       {min(warm) * 1000:8.1f} ms")
+    print(f"{args.model}: {result['models'][args.model]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Offline load test: starts benchmarks/fake_openai.py and the API under uvicorn
+with OPENAI_BASE_URL pointing at the fake server, then drives /split,
+/summarize and /history at a fixed concurrency. Reports p50/p95/p99 latency,
+requests/s, status codes and the API process's peak RSS per endpoint, and
+the LLM calls and 429s the fake server saw.
+
+    python benchmarks/bench_load.py --concurrency 8 --requests 64 --output load.json
+    python benchmarks/bench_load.py --latency 1 --tokens-per-second 50 --error-rate 0.05
+    python benchmarks/bench_load.py --baseline load.json --tolerance 0.25
+
+/history needs MongoDB at MONGODB_URL; without it those requests count as errors.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_splitter import synthetic_transcript
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["split", "summarize", "history"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+
+def peak_rss_mb(pid, reset=False):
+    """VmHWM of a process from /proc (Linux only, None elsewhere); reset starts a new peak."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            peak = next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmHWM:"))
+        if reset:
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        return peak
+    except (OSError, StopIteration):
+        return None
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+class Client(threading.local):
+    """One keep-alive connection per driver thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0
+
+
+def make_requests(endpoint, count, args):
+    if endpoint == "history":
+        return [("GET", "/history?limit=20", None)] * count
+    if endpoint == "split":
+        text = synthetic_transcript(args.tokens)
+        return [("POST", "/split", {"text": text, "chunk_size": args.chunk_size_1,
+                                    "chunk_overlap": args.chunk_overlap_1})] * count
+    # A different transcript per request, so the summary and map caches do not answer for the LLM
+    return [("POST", "/summarize", {"text": synthetic_transcript(args.tokens, seed=i), "model": args.model,
+                                    "chunk_size_1": args.chunk_size_1, "chunk_overlap_1": args.chunk_overlap_1,
+                                    "chunk_size_2": args.chunk_size_2, "chunk_overlap_2": args.chunk_overlap_2,
+                                    "token_max": args.token_max, "map_concurrency": args.map_concurrency})
+            for i in range(count)]
+
+
+def run_endpoint(endpoint, port, pid, args):
+    count = args.summarize_requests if endpoint == "summarize" else args.requests
+    requests = make_requests(endpoint, count, args)
+    client = Client(port)
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(request):
+        start = time.perf_counter()
+        status = client.request(*request)
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    peak_rss_mb(pid, reset=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send, requests))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": count,
+        "errors": count - len(latencies),
+        "status": statuses,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {name: round(percentile(latencies, q) * 1000, 2) for name, q in
+                       (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))} if latencies else None,
+        "peak_rss_mb": peak_rss_mb(pid),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoints", type=str, nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--summarize-requests", type=int, default=32, help="Requests to /summarize")
+    parser.add_argument("--tokens", type=int, default=20000, help="Transcript size")
+    parser.add_argument("--model", type=str, default="gpt-5-mini", help="An OpenAI model name, so calls go to OPENAI_BASE_URL")
+    parser.add_argument("--chunk-size-1", type=int, default=4000)
+    parser.add_argument("--chunk-overlap-1", type=int, default=1000)
+    parser.add_argument("--chunk-size-2", type=int, default=2000)
+    parser.add_argument("--chunk-overlap-2", type=int, default=0)
+    parser.add_argument("--token-max", type=int, default=16000)
+    parser.add_argument("--map-concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Fake LLM output rate")
+    parser.add_argument("--output-tokens", type=int, default=200, help="Fake LLM tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls answered with 429")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown / throughput drop")
+    args = parser.parse_args()
+
+    llm_port, api_port = free_port(), free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"),
+                             "--port", str(llm_port), "--latency", str(args.latency),
+                             "--tokens-per-second", str(args.tokens_per_second),
+                             "--output-tokens", str(args.output_tokens), "--error-rate", str(args.error_rate)],
+                            stdout=subprocess.DEVNULL)
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+               OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY") or "fake")
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(api_port)],
+                           cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(f"http://127.0.0.1:{llm_port}/v1/models", args.timeout)
+        wait_for(f"http://127.0.0.1:{api_port}/", args.timeout)
+        results = {endpoint: run_endpoint(endpoint, api_port, api.pid, args) for endpoint in args.endpoints}
+        with urllib.request.urlopen(f"http://127.0.0.1:{llm_port}/stats") as response:
+            llm_stats = json.load(response)
+    finally:
+        api.terminate()
+        fake.terminate()
+        api.wait()
+        fake.wait()
+
+    result = {
+        "config": {name: getattr(args, name) for name in
+                   ("concurrency", "requests", "summarize_requests", "tokens", "model", "map_concurrency",
+                    "latency", "tokens_per_second", "output_tokens", "error_rate")},
+        "endpoints": results,
+        "fake_llm": llm_stats,
+    }
+    print(f"{'endpoint':>10} {'ok':>5} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>7}")
+    for endpoint, stats in results.items():
+        latency = stats["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+        rss = stats["peak_rss_mb"]
+        print(f"{endpoint:>10} {stats['requests'] - stats['errors']:>5} {stats['errors']:>6} "
+              f"{stats['requests_per_second']:>8.2f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} "
+              f"{latency['p99']:>9.1f} {rss if rss is not None else float('nan'):>7.1f}")
+    print(f"fake LLM: {llm_stats['completions']} calls, {llm_stats['throttled']} answered 429, "
+          f"peak {llm_stats['peak_in_flight']} in flight")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = []
+        for endpoint, stats in results.items():
+            before = baseline["endpoints"].get(endpoint)
+            if not before or not before["latency_ms"] or not stats["latency_ms"]:
+                continue
+            if stats["latency_ms"]["p95"] > before["latency_ms"]["p95"] * (1 + args.tolerance):
+                regressions.append(f"{endpoint} p95: {before['latency_ms']['p95']:.1f}ms -> {stats['latency_ms']['p95']:.1f}ms")
+            if stats["requests_per_second"] < before["requests_per_second"] * (1 - args.tolerance):
+                regressions.append(f"{endpoint} req/s: {before['requests_per_second']:.2f} -> {stats['requests_per_second']:.2f}")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Per-update cost of a live session (append + re-chunk + chunks to map)
+against re-splitting the whole transcript on every update, as /summarize does.
+No LLM is called; "new chunks" is what a session update would send to the map stage.
+
+    python benchmarks/bench_sessions.py --tokens 200000 --segment 1000
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_splitter import synthetic_transcript
+from backend.splitter import TokenIndex, get_encoding
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=200000, help="Length of the whole meeting")
+    parser.add_argument("--segment", type=int, default=1000, help="Approximate tokens per appended segment")
+    parser.add_argument("--chunk-size", type=int, default=16000)
+    parser.add_argument("--chunk-overlap", type=int, default=4000)
+    parser.add_argument("--report", type=int, default=10, help="Print every n-th update")
+    args = parser.parse_args()
+
+    get_encoding()
+    lines = synthetic_transcript(args.tokens).split("\n")
+    per_segment = max(1, len(lines) * args.segment // args.tokens)
+    segments = ["\n".join(lines[i:i + per_segment]) + "\n" for i in range(0, len(lines), per_segment)]
+
+    session = TokenIndex("")
+    known = set()
+    text = ""
+    totals = {"session": 0.0, "full": 0.0}
+    print(f"{'update':>6} {'tokens':>8} {'session ms':>11} {'full ms':>9} {'new chunks':>11} {'chunks':>7}")
+    for n, segment in enumerate(segments, 1):
+        start = time.perf_counter()
+        changed = session.append(segment)
+        known = {span for span in known if span[1] <= changed}
+        spans = session.spans(args.chunk_size, args.chunk_overlap)
+        new = [session.chunk_text(*span) for span in spans if span not in known]
+        known.update(spans)
+        session_seconds = time.perf_counter() - start
+
+        text += segment
+        start = time.perf_counter()
+        full = TokenIndex(text).split(args.chunk_size, args.chunk_overlap)
+        full_seconds = time.perf_counter() - start
+        totals["session"] += session_seconds
+        totals["full"] += full_seconds
+        if n % args.report == 0 or n == len(segments):
+            print(f"{n:>6} {session.span_tokens():>8} {session_seconds * 1000:>11.2f} {full_seconds * 1000:>9.2f} "
+                  f"{len(new):>11} {len(full):>7}")
+    print(f"total over {len(segments)} updates: session {totals['session']:.2f}s, full re-split {totals['full']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: legacy CharacterTextSplitter path vs. the tokenize-once TokenIndex.
+
+    python benchmarks/bench_splitter.py --tokens 150000
+    python benchmarks/bench_splitter.py --file transcript.txt --repeat 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain.text_splitter import CharacterTextSplitter
+from backend.splitter import TokenIndex, count_tokens, get_encoding
+
+WORDS = ["the", "meeting", "agreed", "budget", "schedule", "action", "item", "review", "next", "quarter",
+         "deploy", "customer", "feedback", "我們", "今天", "討論", "預算", "進度", "下週", "確認", "OK,", "yes."]
+
+
+def synthetic_transcript(target_tokens, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    tokens = 0
+    while tokens < target_tokens:
+        line = f"Speaker {rng.randint(1, 6)}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+        tokens += count_tokens(line) + 1
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def legacy_split(text, chunk_size, chunk_overlap):
+    # The pre-TokenIndex implementation of backend.core.split_text
+    text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
+        separator=" ",
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    file_content = text_splitter.create_documents([text])
+    return [doc.page_content for doc in text_splitter.split_documents(file_content)]
+
+
+def indexed_split(text, passes):
+    index = TokenIndex(text)
+    return [index.split(chunk_size, chunk_overlap) for chunk_size, chunk_overlap in passes]
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Transcript to split (default: synthetic)")
+    parser.add_argument("--tokens", type=int, default=120000, help="Size of the synthetic transcript")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, best time is reported")
+    parser.add_argument("--passes", type=str, default="16000:4000,8000:0", help="chunk_size:overlap pairs")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = synthetic_transcript(args.tokens)
+    passes = [tuple(int(v) for v in p.split(":")) for p in args.passes.split(",")]
+    get_encoding()
+
+    legacy_time, legacy = best_of(lambda: [legacy_split(text, size, overlap) for size, overlap in passes], args.repeat)
+    indexed_time, indexed = best_of(lambda: indexed_split(text, passes), args.repeat)
+
+    result = {
+        "chars": len(text),
+        "tokens": count_tokens(text),
+        "passes": passes,
+        "chunks": [len(chunks) for chunks in indexed],
+        "legacy_seconds": legacy_time,
+        "indexed_seconds": indexed_time,
+        "speedup": legacy_time / indexed_time if indexed_time else None,
+        "identical": legacy == indexed,
+    }
+    print(f"input: {result['chars']} chars / {result['tokens']} tokens, passes {passes} -> chunks {result['chunks']}")
+    print(f"legacy  CharacterTextSplitter: {legacy_time * 1000:9.1f} ms")
+    print(f"indexed TokenIndex:            {indexed_time * 1000:9.1f} ms  ({result['speedup']:.1f}x)")
+    print(f"identical output: {result['identical']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup benchmark: import cost of backend.api (python -X importtime) and the
+time from launching uvicorn to the first successful GET /.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --output startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module, repeat):
+    """Best-of-repeat importtime report: total microseconds and per-module cumulative times."""
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=ROOT, capture_output=True, text=True, check=True)
+        modules = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            # "import time:  self [us] | cumulative | imported package", nested names are indented
+            _, cumulative_us, name = line[len("import time:"):].split("|")
+            modules[name.strip()] = int(cumulative_us)
+        total = modules.get(module, 0)
+        if best is None or total < best[0]:
+            best = (total, modules)
+    return best
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(timeout):
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(port)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"no response on / within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default="backend.api")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, best time is reported")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown vs. the baseline")
+    args = parser.parse_args()
+
+    total_us, modules = import_times(args.module, args.repeat)
+    first_response = min(time_to_first_response(args.timeout) for _ in range(args.repeat))
+    top = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    result = {
+        "module": args.module,
+        "import_seconds": total_us / 1e6,
+        "first_response_seconds": first_response,
+        "heavy_modules_loaded": sorted(name for name in ("langchain", "langchain_openai", "openai") if name in modules),
+        "slowest_imports": [{"module": name, "cumulative_seconds": us / 1e6} for name, us in top],
+    }
+
+    print(f"import {args.module}: {result['import_seconds'] * 1000:8.1f} ms")
+    print(f"first GET /:        {first_response * 1000:8.1f} ms")
+    for name, us in top:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    if result["heavy_modules_loaded"]:
+        print(f"loaded at import: {', '.join(result['heavy_modules_loaded'])}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = [key for key in ("import_seconds", "first_response_seconds")
+                       if result[key] > baseline[key] * (1 + args.tolerance)]
+        for key in regressions:
+            print(f"REGRESSION {key}: {baseline[key]:.3f}s -> {result[key]:.3f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Peak Python memory (tracemalloc) of getting a transcript into chunks for the
+map stage: the JSON /summarize path (body -> SummarizeRequest -> TokenIndex ->
+Documents for both passes) against the streaming /summarize/upload path
+(body parts -> StreamingSplitter, chunks released as they are produced).
+
+    python benchmarks/bench_upload_memory.py --tokens 200000
+    python benchmarks/bench_upload_memory.py --file transcript.txt --part-size 65536
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_splitter import synthetic_transcript
+from backend.core import iter_decoded, split_text
+from backend.schemas import SummarizeRequest
+from backend.splitter import StreamingSplitter, TokenIndex, get_encoding
+
+
+def read_parts(path, part_size):
+    with open(path, "rb") as f:
+        while True:
+            part = f.read(part_size)
+            if not part:
+                return
+            yield part
+
+
+def json_path(path, part_size, chunkings):
+    # What /summarize holds before the first map call
+    body = b"".join(read_parts(path, part_size))
+    request = SummarizeRequest(**json.loads(body))
+    index = TokenIndex(request.text)
+    passes = [split_text(request.text, size, overlap, index=index) for size, overlap in chunkings]
+    return sum(map(len, passes))
+
+
+def stream_path(path, part_size, chunkings):
+    splitter = StreamingSplitter(chunkings)
+    chunks = 0
+    for text in iter_decoded(read_parts(path, part_size)):
+        # Chunks go straight to the map stage and are not kept
+        chunks += len(splitter.feed(text))
+    return chunks + len(splitter.finish())
+
+
+def measure(fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None, help="Transcript to use (default: synthetic)")
+    parser.add_argument("--tokens", type=int, nargs="+", default=[50000, 200000], help="Synthetic transcript sizes")
+    parser.add_argument("--part-size", type=int, default=64 * 1024, help="Bytes per received body part")
+    parser.add_argument("--chunk-size-1", type=int, default=16000)
+    parser.add_argument("--chunk-overlap-1", type=int, default=4000)
+    parser.add_argument("--chunk-size-2", type=int, default=8000)
+    parser.add_argument("--chunk-overlap-2", type=int, default=0)
+    args = parser.parse_args()
+
+    get_encoding()
+    chunkings = [(args.chunk_size_1, args.chunk_overlap_1), (args.chunk_size_2, args.chunk_overlap_2)]
+    inputs = [args.file] if args.file else [synthetic_transcript(n) for n in args.tokens]
+    print(f"{'input MB':>9} {'path':>7} {'chunks':>7} {'peak MB':>9} {'seconds':>8}")
+    for item in inputs:
+        with tempfile.TemporaryDirectory() as tmp:
+            if args.file:
+                text_path = item
+                with open(item, "r", encoding="utf-8") as f:
+                    text = f.read()
+            else:
+                text = item
+                text_path = os.path.join(tmp, "transcript.txt")
+                with open(text_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+            json_file = os.path.join(tmp, "request.json")
+            with open(json_file, "w", encoding="utf-8") as f:
+                json.dump({"text": text}, f, ensure_ascii=False)
+            size_mb = os.path.getsize(text_path) / 1e6
+            del text
+            for name, fn, path in (("json", json_path, json_file), ("stream", stream_path, text_path)):
+                chunks, peak, elapsed = measure(fn, path, args.part_size, chunkings)
+                print(f"{size_mb:>9.2f} {name:>7} {chunks:>7} {peak / 1e6:>9.2f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API, for load tests
+that should not spend real quota. Point the backend at it with
+OPENAI_BASE_URL=http://127.0.0.1:8100/v1 (or OPENROUTER_BASE_URL).
+
+    python benchmarks/fake_openai.py --port 8100 --latency 0.5 --tokens-per-second 100
+    python benchmarks/fake_openai.py --error-rate 0.05 --retry-after-ms 200
+
+Every answer is "summary" words, one per output token, at --tokens-per-second
+after --latency seconds. --error-rate answers that share of requests with a
+429 and a retry-after-ms header, --fail-first the first N requests.
+GET /stats returns request, 429 and token counts.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.2, tokens_per_second=0, output_tokens=200, error_rate=0.0, fail_first=0,
+                 retry_after_ms=100, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.retry_after_ms = retry_after_ms
+        self.rng = random.Random(seed)
+        self.counts = {"requests": 0, "completions": 0, "throttled": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                       "in_flight": 0, "peak_in_flight": 0}
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Count a request; False if it should be answered with a 429."""
+        with self._lock:
+            self.counts["requests"] += 1
+            throttled = self.counts["requests"] <= self.fail_first or self.rng.random() < self.error_rate
+            if throttled:
+                self.counts["throttled"] += 1
+            else:
+                self.counts["in_flight"] += 1
+                self.counts["peak_in_flight"] = max(self.counts["peak_in_flight"], self.counts["in_flight"])
+            return not throttled
+
+    def finish(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.counts["in_flight"] -= 1
+            self.counts["completions"] += 1
+            self.counts["prompt_tokens"] += prompt_tokens
+            self.counts["completion_tokens"] += completion_tokens
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def prompt_tokens(body):
+    # Rough count (4 characters per token) so the fake server does not need tiktoken
+    text = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+    return max(1, len(text) // 4)
+
+
+def completion(body, content, prompt, output, delta=False, finish_reason="stop"):
+    choice = {"index": 0, "finish_reason": finish_reason}
+    if delta:
+        choice["delta"] = {"role": "assistant", "content": content}
+    else:
+        choice["message"] = {"role": "assistant", "content": content}
+    result = {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion.chunk" if delta else "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [choice],
+    }
+    if not delta:
+        result["usage"] = {"prompt_tokens": prompt, "completion_tokens": output, "total_tokens": prompt + output}
+    return result
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=()):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "fake"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, fake.stats())
+        else:
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        if not fake.admit():
+            self.send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "rate_limit_error",
+                                           "code": "rate_limit_exceeded"}},
+                           headers=[("retry-after-ms", str(fake.retry_after_ms))])
+            return
+        prompt = prompt_tokens(body)
+        output = min(fake.output_tokens, body.get("max_tokens") or body.get("max_completion_tokens") or fake.output_tokens)
+        words = ["summary"] * output
+        try:
+            time.sleep(fake.latency)
+            if body.get("stream"):
+                self.stream(body, words, prompt)
+            else:
+                if fake.tokens_per_second > 0:
+                    time.sleep(output / fake.tokens_per_second)
+                self.send_json(200, completion(body, " ".join(words), prompt, output))
+        finally:
+            fake.finish(prompt, output)
+
+    def stream(self, body, words, prompt):
+        fake = self.server.fake
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # No Content-Length for a stream, so the connection ends with it
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i, word in enumerate(words):
+            if fake.tokens_per_second > 0:
+                time.sleep(1 / fake.tokens_per_second)
+            chunk = completion(body, word if i == 0 else " " + word, prompt, len(words), delta=True, finish_reason=None)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(f"data: {json.dumps(completion(body, '', prompt, len(words), delta=True))}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """Start the server on a background thread; returns it, server.server_address has the port."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Output token rate (0: all at once)")
+    parser.add_argument("--output-tokens", type=int, default=200, help="Tokens per answer, capped by max_tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=100, help="retry-after-ms header of 429 answers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                      output_tokens=args.output_tokens, error_rate=args.error_rate, fail_first=args.fail_first,
+                      retry_after_ms=args.retry_after_ms, seed=args.seed)
+    server = serve(fake, args.host, args.port)
+    print(f"fake OpenAI API on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
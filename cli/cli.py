@@ -1,14 +1,20 @@
 import time
-from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
-from langchain.text_splitter import CharacterTextSplitter
+from langchain.chains import ReduceDocumentsChain
 from langchain.chains.llm import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.chat_models import ChatOpenAI
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain.document_loaders import TextLoader
 from langchain_core.documents import Document
 import os
+import sys
+import json
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.core import iter_map_concurrently, MapChunkError
+from backend.cache import content_key
+from backend.splitter import TokenIndex
 # Initialize the LLM chain
 def init_llm(args,max_tokens=1000):
     if args.model=="gpt-4-1106-preview":
@@ -29,12 +35,54 @@ def reduce_function(llm):
     reduce_prompt = PromptTemplate.from_template(reduce_template)
     return LLMChain(llm=llm, prompt=reduce_prompt)
 
-def process_map_results(split_docs,args):
-    temp=[]
+# Map both passes as one work queue. Every finished chunk is appended to the
+# checkpoint file, so a rerun after a crash only maps the chunks still missing.
+# llm_slots is shared by all files of a batch and caps the LLM calls in flight.
+def process_map_passes(passes, args, checkpoint_path, llm_slots):
+    done = load_checkpoint(checkpoint_path)
+    todo = [(p, i) for p, docs in enumerate(passes) for i in range(len(docs)) if (p, i) not in done]
+    restored = sum(len(docs) for docs in passes) - len(todo)
     map_chain = map_function(init_llm(args,1000))
-    for i, doc in enumerate(split_docs):
-        temp.append(map_chain.run(doc))
-    return temp
+
+    def run(slot):
+        p, i = slot
+        with llm_slots:
+            return map_chain.run(passes[p][i])
+
+    errors = {}
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        for n, content, error in iter_map_concurrently(run, todo, args.max_concurrency):
+            if error is not None:
+                errors[todo[n]] = error
+                continue
+            done[todo[n]] = content
+            f.write(json.dumps({"pass": todo[n][0], "index": todo[n][1], "content": content}, ensure_ascii=False) + "\n")
+            f.flush()
+    results = [[done.get((p, i)) for i in range(len(docs))] for p, docs in enumerate(passes)]
+    if errors:
+        raise MapChunkError(results, errors)
+    return results, len(todo), restored
+
+def load_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line cut short by the crash
+                continue
+            done[(record["pass"], record["index"])] = record["content"]
+    return done
+
+def checkpoint_path(args, file_name, file_content):
+    # Map outputs are only reused for the same text and map settings
+    key = content_key(file_content, args.model, args.temperature, args.chunk_size_1, args.chunk_overlap_1,
+                      args.chunk_size_2, args.chunk_overlap_2)
+    return os.path.join(args.checkpoint_dir or os.path.join(args.output_dir, ".checkpoints"), f"{file_name}.{key[:16]}.jsonl")
 
 def process_reduce_results(combined_map_results,args):
     reduce_chain = reduce_function(init_llm(args,4000))
@@ -47,52 +95,140 @@ def process_reduce_results(combined_map_results,args):
     return reduce_documents_chain.run(documents)
 
 # Split the text into chunks
-def split_text(text, chunk_size, chunk_overlap):
+def split_text(text, chunk_size, chunk_overlap, index=None):
     if chunk_size == 0:
         return []
-    text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-        separator=" ",
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-    )
-    file_content=text_splitter.create_documents([text])
-    split_docs = text_splitter.split_documents(file_content)
-    return split_docs
+    if index is None:
+        index = TokenIndex(text)
+    return [Document(page_content=chunk) for chunk in index.split(chunk_size, chunk_overlap)]
+
+# Output and checkpoint names are built from the file name without folder or extension
+def file_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
 
 # Process the file
-def process_file(args):
-    file_name = args.file.split(".")[0].split("/")[-1]
+def process_file(args, path=None, llm_slots=None):
+    path = path or args.file
+    llm_slots = llm_slots or threading.BoundedSemaphore(args.max_concurrency)
+    file_name = file_stem(path)
     #read file
-    with open(args.file, "r",encoding="utf-8") as f:
+    with open(path, "r",encoding="utf-8") as f:
         file_content = f.read()
     print(f"檔名:{file_name} 文件長度: {len(file_content)}")
 
+    index = TokenIndex(file_content)
     # First map stage
-    split_docs1 = split_text(file_content, args.chunk_size_1, args.chunk_overlap_1)
+    split_docs1 = split_text(file_content, args.chunk_size_1, args.chunk_overlap_1, index)
     # Second map stage
-    split_docs2 = split_text(file_content, args.chunk_size_2, args.chunk_overlap_2)
+    split_docs2 = split_text(file_content, args.chunk_size_2, args.chunk_overlap_2, index)
+    info = {"file": path, "tokens": index.span_tokens(), "chunks": [len(split_docs1), len(split_docs2)],
+            "mapped": 0, "restored": 0}
+    checkpoint = checkpoint_path(args, file_name, file_content)
     if args.without_map==False:
-        print(f"第一階段共{len(split_docs1)}個chunks")
-        first_map_results = process_map_results(split_docs1,args)
-        # print("Map 1:",first_map_results)
-
-        print(f"第二階段共{len(split_docs2)}個chunks")
-        second_map_results = process_map_results(split_docs2,args)
-        # print("Map 2:",second_map_results)
+        print(f"{file_name}: 第一階段共{len(split_docs1)}個chunks, 第二階段共{len(split_docs2)}個chunks")
+        (first_map_results, second_map_results), info["mapped"], info["restored"] = process_map_passes(
+            [split_docs1, split_docs2], args, checkpoint, llm_slots)
+        if info["restored"]:
+            print(f"{file_name}: 從檢查點恢復{info['restored']}個chunks")
         combined_map_results = first_map_results + second_map_results
     else:
         combined_map_results = split_docs1+split_docs2
 
     
     # Reduce stage
-    response=process_reduce_results(combined_map_results,args)
+    with llm_slots:
+        response=process_reduce_results(combined_map_results,args)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return response, file_name, info
+
+def output_path(args, file_name):
+    if not args.without_map:
+        return f"{args.output_dir}{file_name}_output_{args.chunk_size_1}_{args.chunk_overlap_1}_{args.chunk_size_2}_{args.chunk_overlap_2}_{args.temperature}.txt"
+    return f"{args.output_dir}{file_name}_output_{args.chunk_size_1}_{args.chunk_overlap_1}_{args.chunk_size_2}_{args.chunk_overlap_2}_{args.temperature}_nomap.txt"
+
+def batch_files(args):
+    if args.input_dir:
+        return sorted(os.path.join(args.input_dir, name) for name in os.listdir(args.input_dir)
+                      if os.path.isfile(os.path.join(args.input_dir, name)))
+    # Manifest: one path per line, relative to the manifest; blank lines and # comments are skipped
+    base = os.path.dirname(os.path.abspath(args.manifest))
+    with open(args.manifest, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+# Files with the same name would write the same output and one of them would be skipped as done
+def check_unique_names(files):
+    names = {}
+    for path in files:
+        names.setdefault(file_stem(path), []).append(path)
+    duplicates = [paths for paths in names.values() if len(paths) > 1]
+    if duplicates:
+        raise ValueError("檔名重複, 輸出會互相覆蓋: " + "; ".join(", ".join(paths) for paths in duplicates))
+
+def process_batch_file(args, path, llm_slots):
+    file_name = file_stem(path)
+    target = output_path(args, file_name)
+    # Finished in an earlier run
+    if os.path.exists(target):
+        return {"file": path, "status": "skipped"}
+    start = time.time()
+    response, file_name, info = process_file(args, path, llm_slots)
+    with open(target, "w",encoding="utf-8") as f:
+        f.write(response)
+    return {**info, "status": "done", "seconds": time.time() - start, "output": target}
+
+# Summarize a directory or manifest of files, args.batch_concurrency files at a time,
+# with at most args.max_concurrency LLM calls in flight across all of them
+def run_batch(args):
+    files = batch_files(args)
+    check_unique_names(files)
+    os.makedirs(args.output_dir, exist_ok=True)
+    llm_slots = threading.BoundedSemaphore(args.max_concurrency)
+    results = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.batch_concurrency)) as pool:
+        futures = {pool.submit(process_batch_file, args, path, llm_slots): path for path in files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"file": futures[future], "status": "failed", "error": str(e)}
+            results.append(result)
+            detail = f"{round(result['seconds'])}秒" if "seconds" in result else result.get("error", "")
+            print(f"[{len(results)}/{len(files)}] {result['status']} {result['file']} {detail}")
 
-    return response, file_name
+    elapsed = time.time() - start
+    done = [r for r in results if r["status"] == "done"]
+    tokens = sum(r["tokens"] for r in done)
+    report = {
+        "files": len(files),
+        "done": len(done),
+        "skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "failed": [r["file"] for r in results if r["status"] == "failed"],
+        "seconds": elapsed,
+        "files_per_minute": len(done) / elapsed * 60 if elapsed else 0.0,
+        "tokens": tokens,
+        "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+        "map_calls": sum(r["mapped"] for r in done),
+        "map_chunks_restored": sum(r["restored"] for r in done),
+        "results": sorted(results, key=lambda r: r["file"]),
+    }
+    print(f"完成 {report['done']}/{report['files']} 個檔案 (略過 {report['skipped']}, 失敗 {len(report['failed'])}), "
+          f"耗時{round(elapsed)}秒")
+    print(f"吞吐量: {report['files_per_minute']:.2f} files/min, {report['tokens_per_second']:.1f} tokens/s, "
+          f"map 呼叫 {report['map_calls']} 次, 從檢查點恢復 {report['map_chunks_restored']} 個chunks")
+    with open(os.path.join(args.output_dir, "batch_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--key", type=str, default=None, help="OpenAI API key")
     parser.add_argument("--file", type=str, default=None, help="File to summarize")
+    parser.add_argument("--input_dir", type=str, default=None, help="Summarize every file in this directory")
+    parser.add_argument("--manifest", type=str, default=None, help="Summarize the files listed in this file, one per line")
     parser.add_argument("--model", type=str, default="gpt-4-1106-preview", help="Model to use")
     parser.add_argument("--chunk_size_1", type=int, default=16000, help="Chunk size 1")
     parser.add_argument("--chunk_overlap_1", type=int, default=4000, help="Chunk overlap 1")
@@ -101,19 +237,24 @@ def main():
     parser.add_argument("--token_max", type=int, default=16000, help="Token max")
     parser.add_argument("--temperature", type=float, default=0, help="Temperature")
     parser.add_argument("--without_map", action='store_true', help="without use map method")
+    parser.add_argument("--max_concurrency", type=int, default=4, help="Max LLM calls in flight (across all files in batch mode)")
+    parser.add_argument("--batch_concurrency", type=int, default=4, help="Files processed at the same time in batch mode")
+    parser.add_argument("--checkpoint_dir", type=str, default=None, help="Map checkpoints (default: <output_dir>/.checkpoints)")
     parser.add_argument("--output_dir", type=str, default="./cli/output/", help="output path")
     args = parser.parse_args()
         
-    if args.file:
+    if args.input_dir or args.manifest:
+        try:
+            run_batch(args)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.file:
         start = time.time()
-        response, file_name= process_file(args)
+        response, file_name, _ = process_file(args)
         end=time.time()
         print(f"處理完成!耗時{round(end-start)}秒")
 
-        if not args.without_map:
-            file_name = f"{args.output_dir}{file_name}_output_{args.chunk_size_1}_{args.chunk_overlap_1}_{args.chunk_size_2}_{args.chunk_overlap_2}_{args.temperature}.txt"
-        else:
-            file_name = f"{args.output_dir}{file_name}_output_{args.chunk_size_1}_{args.chunk_overlap_1}_{args.chunk_size_2}_{args.chunk_overlap_2}_{args.temperature}_nomap.txt"
+        file_name = output_path(args, file_name)
         print(f"輸出檔案: {file_name}")
         print(response)
         #save file
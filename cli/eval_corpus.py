@@ -0,0 +1,174 @@
+import re
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# eval.py scores rouge on " ".join(text): rouge_score's tokenizer then keeps one token per
+# [a-z0-9] character (everything else, Chinese included, is dropped) and never stems tokens
+# this short, so ROUGE here runs on those characters directly.
+ROUGE_TOKEN = re.compile("[a-z0-9]")
+ROUGE_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+# sentence_bleu defaults: uniform weights over 1..4-grams, SmoothingFunction().method1 epsilon
+BLEU_ORDER = 4
+BLEU_EPSILON = 0.1
+METRICS = ["rouge1", "rougeL"]
+
+
+def rouge_tokens(text):
+    return "".join(ROUGE_TOKEN.findall(text.lower()))
+
+def ngram_counts(words, n):
+    return Counter(zip(*(words[i:] for i in range(n))))
+
+def f_score(overlap, prediction_length, target_length):
+    precision = overlap / max(prediction_length, 1)
+    recall = overlap / max(target_length, 1)
+    fmeasure = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return {"precision": precision, "recall": recall, "fmeasure": fmeasure}
+
+# One original, tokenized and counted once and scored against any number of summaries
+class Reference:
+    def __init__(self, text):
+        self.tokens = rouge_tokens(text)
+        self.unigrams = Counter(self.tokens)
+        # Bit i of masks[c] is set where tokens[i] == c, for the bit-parallel LCS
+        self.masks = {}
+        for c in self.unigrams:
+            table = str.maketrans(ROUGE_ALPHABET, "".join("1" if a == c else "0" for a in ROUGE_ALPHABET))
+            self.masks[c] = int(self.tokens.translate(table)[::-1], 2)
+        self.words = text.split()
+        self.ngrams = [ngram_counts(self.words, n) for n in range(1, BLEU_ORDER + 1)]
+
+    def lcs(self, tokens):
+        # Hyyrö's bit-vector LCS: one big-int step per summary token over all original tokens
+        m = len(self.tokens)
+        full = (1 << m) - 1
+        v = full
+        for c in tokens:
+            u = v & self.masks.get(c, 0)
+            v = ((v + u) | (v - u)) & full
+        return m - bin(v).count("1")
+
+    def bleu(self, summary):
+        words = summary.split()
+        numerators = []
+        denominators = []
+        for n, reference in enumerate(self.ngrams, 1):
+            counts = ngram_counts(words, n)
+            numerators.append(sum(min(count, reference[gram]) for gram, count in counts.items()))
+            denominators.append(max(1, sum(counts.values())))
+        if numerators[0] == 0:
+            return 0
+        r, c = len(self.words), len(words)
+        brevity = 1 if c > r else math.exp(1 - r / c)
+        precisions = [(num if num else BLEU_EPSILON) / den for num, den in zip(numerators, denominators)]
+        return brevity * math.exp(math.fsum(math.log(p) / BLEU_ORDER for p in precisions))
+
+    def score(self, summary):
+        tokens = rouge_tokens(summary)
+        overlap = sum(min(count, self.unigrams[c]) for c, count in Counter(tokens).items())
+        lcs = self.lcs(tokens) if tokens and self.tokens else 0
+        return {
+            "rouge1": f_score(overlap, len(tokens), len(self.tokens)),
+            "rougeL": f_score(lcs, len(tokens), len(self.tokens)),
+            "bleu": self.bleu(summary),
+        }
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+# Pairing as in mutifile_eval.sh, by summary names that start with the original's name, except
+# that the name must be followed by "_" or "." (cli.py's "<name>_output_...") so f1 does not take f10's summaries
+def pair_files(original_dir, summary_dir):
+    summaries = sorted(os.listdir(summary_dir))
+    pairs = []
+    for original in sorted(os.listdir(original_dir)):
+        name = original.rsplit(".", 1)[0]
+        matched = [os.path.join(summary_dir, s) for s in summaries if s.startswith((name + "_", name + "."))]
+        if matched:
+            pairs.append((os.path.join(original_dir, original), matched))
+    return pairs
+
+# Process pool task: one original and a batch of its summaries
+def score_batch(task):
+    original, summaries = task
+    reference = Reference(read(original))
+    return [{"original": original, "summary": path, **reference.score(read(path))} for path in summaries]
+
+def flatten(row):
+    scores = {f"{metric}_{name}": row[metric][name] for metric in METRICS for name in ("precision", "recall", "fmeasure")}
+    scores["bleu"] = row["bleu"]
+    return scores
+
+def aggregate(rows):
+    columns = {}
+    for row in rows:
+        for name, value in flatten(row).items():
+            columns.setdefault(name, []).append(value)
+    return {name: {"mean": statistics.fmean(values), "median": statistics.median(values), "min": min(values),
+                   "max": max(values), "stdev": statistics.pstdev(values)}
+            for name, values in columns.items()}
+
+# Re-score pairs with eval.py's rouge_score/nltk scorers and return the largest difference
+def verify(rows):
+    try:
+        from scores import calculate_rouge_scores, calculate_bleu_score
+    except ImportError as e:
+        sys.exit(f"--verify needs rouge_score and nltk installed ({e})")
+    worst = 0.0
+    for row in rows:
+        original, summary = read(row["original"]), read(row["summary"])
+        expected = {metric: score._asdict() for metric, score in calculate_rouge_scores(original, summary).items()}
+        expected["bleu"] = calculate_bleu_score(original, summary)
+        for name, value in flatten(expected).items():
+            worst = max(worst, abs(value - flatten(row)[name]))
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every summary against its original (ROUGE-1/L, BLEU)")
+    parser.add_argument("--orginal_dir", type=str, required=True, help="Folder of original files")
+    parser.add_argument("--summary_dir", type=str, required=True, help="Folder of summaries, named after their original")
+    parser.add_argument("--output", type=str, default="./cli/eval_corpus.json", help="Aggregate and per-file scores")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Scoring processes")
+    parser.add_argument("--batch_size", type=int, default=64, help="Summaries per task (each task tokenizes its original once)")
+    parser.add_argument("--verify", action="store_true", help="Check every score against eval.py's scorers")
+    args = parser.parse_args()
+
+    start = time.time()
+    tasks = [(original, summaries[i:i + args.batch_size])
+             for original, summaries in pair_files(args.orginal_dir, args.summary_dir)
+             for i in range(0, len(summaries), args.batch_size)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for future in as_completed([pool.submit(score_batch, task) for task in tasks]):
+            rows += future.result()
+    rows.sort(key=lambda row: (row["original"], row["summary"]))
+    result = {
+        "pairs": len(rows),
+        "seconds": round(time.time() - start, 3),
+        "aggregate": aggregate(rows) if rows else {},
+        "files": [{"original": row["original"], "summary": row["summary"], **flatten(row)} for row in rows],
+    }
+    if args.verify:
+        result["verify_max_difference"] = verify(rows)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"{len(rows)}組評分完成, 耗時{result['seconds']}秒, 輸出: {args.output}")
+    for name, stats in result["aggregate"].items():
+        print(f"{name}: mean {stats['mean']:.4f} median {stats['median']:.4f}")
+    if args.verify:
+        print(f"與 eval.py 最大差異: {result['verify_max_difference']:.2e}")
+        if result["verify_max_difference"] > 1e-9:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
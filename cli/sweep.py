@@ -0,0 +1,191 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from langchain_core.documents import Document
+# Imported before backend: cli.py puts the repo root on sys.path, where "cli" is the folder
+from cli import init_llm, map_function, process_reduce_results, file_stem, check_unique_names
+from eval_corpus import Reference, METRICS
+from backend.core import map_concurrently
+from backend.cache import content_key
+from backend.splitter import TokenIndex
+
+# Settings that can be swept; each takes one or more values on the command line
+GRID = ["chunk_size_1", "chunk_overlap_1", "chunk_size_2", "chunk_overlap_2", "token_max", "temperature",
+        "reduce_temperature"]
+
+
+# Every combination of the grid values; combinations with overlap > chunk size are dropped
+def grid_configs(args):
+    configs = []
+    for values in itertools.product(*(getattr(args, name) for name in GRID)):
+        config = dict(zip(GRID, values))
+        if config["reduce_temperature"] is None:
+            config["reduce_temperature"] = config["temperature"]
+        if config["chunk_overlap_1"] > config["chunk_size_1"] or config["chunk_overlap_2"] > config["chunk_size_2"]:
+            print(f"略過無效設定: {config}")
+            continue
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def config_args(args, **overrides):
+    return argparse.Namespace(**{**vars(args), **overrides})
+
+
+# Run every config on one file. Each distinct chunking is split once, each
+# distinct (chunk, temperature) is mapped once and each distinct reduce input
+# runs once, so configs that only differ in a later stage share the earlier work.
+def sweep_file(args, path, configs):
+    file_name = file_stem(path)
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    index = TokenIndex(text)
+    counts = {"configs": len(configs), "chunkings": 0, "map_calls": 0, "map_naive": 0, "reduces": 0}
+
+    chunkings = {}
+    for config in configs:
+        for size, overlap in ((config["chunk_size_1"], config["chunk_overlap_1"]),
+                              (config["chunk_size_2"], config["chunk_overlap_2"])):
+            if (size, overlap) not in chunkings:
+                chunkings[(size, overlap)] = index.split(size, overlap) if size else []
+    counts["chunkings"] = len(chunkings)
+
+    def passes(config):
+        return (chunkings[(config["chunk_size_1"], config["chunk_overlap_1"])]
+                + chunkings[(config["chunk_size_2"], config["chunk_overlap_2"])])
+
+    # Map: one call per distinct chunk text and temperature across the whole grid
+    map_outputs = {}
+    if not args.without_map:
+        jobs = list(dict.fromkeys((chunk, config["temperature"]) for config in configs for chunk in passes(config)))
+        counts["map_naive"] = sum(len(passes(config)) for config in configs)
+        counts["map_calls"] = len(jobs)
+        chains = {temperature: map_function(init_llm(config_args(args, temperature=temperature), 1000))
+                  for temperature in {temperature for _, temperature in jobs}}
+        print(f"{file_name}: {len(chunkings)}種切分, map {len(jobs)}次 (逐一執行需 {counts['map_naive']} 次)")
+        results = map_concurrently(lambda job: chains[job[1]].run(Document(page_content=job[0])), jobs,
+                                   args.max_concurrency)
+        map_outputs = dict(zip(jobs, results))
+
+    # Reduce: configs whose reduce input, token_max and reduce temperature match share one call
+    reduces = {}
+    config_keys = []
+    for config in configs:
+        if args.without_map:
+            contents = passes(config)
+        else:
+            contents = [map_outputs[(chunk, config["temperature"])] for chunk in passes(config)]
+        key = content_key(contents, config["token_max"], config["reduce_temperature"])
+        reduces.setdefault(key, (contents, config))
+        config_keys.append(key)
+    counts["reduces"] = len(reduces)
+    keys = list(reduces)
+
+    def reduce(key):
+        contents, config = reduces[key]
+        reduce_args = config_args(args, token_max=config["token_max"], temperature=config["reduce_temperature"])
+        return process_reduce_results(contents, reduce_args)
+
+    summaries = dict(zip(keys, map_concurrently(reduce, keys, args.max_concurrency)))
+
+    rows = []
+    scores = {}
+    reference = Reference(text) if args.evaluate else None
+    for config, key in zip(configs, config_keys):
+        summary = summaries[key]
+        if key not in scores:
+            scores[key] = evaluate(reference, summary) if args.evaluate else {}
+        output = os.path.join(args.output_dir, f"{file_name}_output_{config['chunk_size_1']}_{config['chunk_overlap_1']}_"
+                                               f"{config['chunk_size_2']}_{config['chunk_overlap_2']}_{config['token_max']}_"
+                                               f"{config['temperature']}_{config['reduce_temperature']}.txt")
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(summary)
+        rows.append({
+            "file": file_name,
+            **config,
+            "chunks_1": len(chunkings[(config["chunk_size_1"], config["chunk_overlap_1"])]),
+            "chunks_2": len(chunkings[(config["chunk_size_2"], config["chunk_overlap_2"])]),
+            "summary_length": len(summary),
+            **scores[key],
+            "output": output,
+        })
+    return rows, counts
+
+
+# Same ROUGE/BLEU as eval.py, with the original tokenized once for all of its summaries
+def evaluate(reference, summary):
+    scores = reference.score(summary)
+    result = {f"{metric}_{name}": value for metric in METRICS for name, value in scores[metric].items()}
+    result["bleu"] = scores["bleu"]
+    return result
+
+
+def write_table(rows, path, format):
+    if format == "json":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        return
+    fields = list(dict.fromkeys(name for row in rows for name in row))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize files with every combination of the given settings")
+    parser.add_argument("--key", type=str, default=None, help="OpenAI API key")
+    parser.add_argument("--file", type=str, nargs="+", default=[], help="Files to summarize")
+    parser.add_argument("--input_dir", type=str, default=None, help="Summarize every file in this directory")
+    parser.add_argument("--model", type=str, default="gpt-4-1106-preview", help="Model to use")
+    parser.add_argument("--chunk_size_1", type=int, nargs="+", default=[16000])
+    parser.add_argument("--chunk_overlap_1", type=int, nargs="+", default=[4000])
+    parser.add_argument("--chunk_size_2", type=int, nargs="+", default=[8000])
+    parser.add_argument("--chunk_overlap_2", type=int, nargs="+", default=[0])
+    parser.add_argument("--token_max", type=int, nargs="+", default=[16000])
+    parser.add_argument("--temperature", type=float, nargs="+", default=[0], help="Map temperatures")
+    parser.add_argument("--reduce_temperature", type=float, nargs="+", default=[None],
+                        help="Reduce temperatures (default: same as --temperature)")
+    parser.add_argument("--without_map", action="store_true", help="without use map method")
+    parser.add_argument("--max_concurrency", type=int, default=4, help="Max LLM calls in flight")
+    parser.add_argument("--no_eval", dest="evaluate", action="store_false", help="Skip ROUGE/BLEU evaluation")
+    parser.add_argument("--output_dir", type=str, default="./cli/sweep/", help="Summaries and the comparison table")
+    parser.add_argument("--format", type=str, nargs="+", choices=["csv", "json"], default=["csv", "json"])
+    args = parser.parse_args()
+
+    files = list(args.file)
+    if args.input_dir:
+        files += sorted(os.path.join(args.input_dir, name) for name in os.listdir(args.input_dir)
+                        if os.path.isfile(os.path.join(args.input_dir, name)))
+    if not files:
+        parser.error("give --file or --input_dir")
+    try:
+        check_unique_names(files)
+    except ValueError as e:
+        parser.error(str(e))
+    configs = grid_configs(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.time()
+    rows = []
+    totals = {}
+    for path in files:
+        file_rows, counts = sweep_file(args, path, configs)
+        rows += file_rows
+        for name, value in counts.items():
+            totals[name] = totals.get(name, 0) + value
+    for format in args.format:
+        path = os.path.join(args.output_dir, f"sweep.{format}")
+        write_table(rows, path, format)
+        print(f"輸出比較表: {path}")
+    print(f"{len(files)}個檔案 × {len(configs)}組設定, 耗時{round(time.time() - start)}秒: "
+          f"map {totals['map_calls']}次 (逐一執行需 {totals['map_naive']} 次), "
+          f"reduce {totals['reduces']}次 (逐一執行需 {totals['configs']} 次)")
+
+
+if __name__ == "__main__":
+    main()
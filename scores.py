@@ -0,0 +1,16 @@
+from rouge_score import rouge_scorer
+from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+
+def calculate_rouge_scores(original, summary):
+    scorer = rouge_scorer.RougeScorer(['rouge1', 'rougeL'], use_stemmer=True)
+    scores = scorer.score(" ".join(original), " ".join(summary))
+    return scores
+
+def calculate_bleu_score(original, summary):
+    # 將文本分割為單詞列表
+    reference = [original.split()]
+    candidate = summary.split()
+    # 計算 BLEU 分數
+    smoothing = SmoothingFunction().method1
+    score = sentence_bleu(reference, candidate, smoothing_function=smoothing)
+    return score
@@ -1,15 +1,25 @@
 import streamlit as st
 import time
-from langchain.chains import MapReduceDocumentsChain, ReduceDocumentsChain
+from langchain.chains import ReduceDocumentsChain
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.chains.llm import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.chat_models import ChatOpenAI
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain.document_loaders import TextLoader
 from langchain_core.documents import Document
 import os
+import hashlib
 import eval
+from backend.core import iter_map_concurrently, MapChunkError
+from backend.cache import TTLCache
+
+# Stage caches for reruns: each stage is keyed on the file hash plus only the
+# settings that change its output (st.cache_data does not hash "_" arguments),
+# so changing token_max only re-runs the reduce. Bounded and evicted by entries and age.
+# The map stage draws a progress bar, which st.cache_data would replay on every hit,
+# so its results are kept in a TTLCache shared by all sessions instead.
+STAGE_CACHE_MAX_ENTRIES = int(os.environ.get("WEB_STAGE_CACHE_MAX_ENTRIES", "32"))
+STAGE_CACHE_TTL = int(os.environ.get("WEB_STAGE_CACHE_TTL", "3600"))
 # Initialize the LLM chain
 def init_llm(temperature,model,max_tokens=1000):
     if model=="gpt-4-1106-preview":
@@ -33,18 +43,23 @@ def reduce_function(llm):
     return LLMChain(llm=llm, prompt=reduce_prompt)
 
 # Process the map
-def process_map_results(split_docs,model):
-    temp=[]
+def process_map_results(split_docs,model,max_concurrency=4):
+    temp=[None]*len(split_docs)
+    errors={}
     start = time.time()
-    # map_chain = map_function(llm)
     map_chain = map_function(init_llm(0,model,1000))
 
     st.write(f"共{len(split_docs)}個chunks")
     bar = st.progress(0, text=" ")
-    for i, doc in enumerate(split_docs):
-        temp.append(map_chain.run(doc))
-        bar.progress((i+1)/len(split_docs)*0.99, text=f"完成第{i+1}個chunks 耗時{round(time.time()-start)}秒")
+    for done, (i, result, error) in enumerate(iter_map_concurrently(map_chain.run, split_docs, max_concurrency), 1):
+        if error is not None:
+            errors[i] = error
+        else:
+            temp[i] = result
+        bar.progress(done/len(split_docs)*0.99, text=f"完成第{done}個chunks 耗時{round(time.time()-start)}秒")
     bar.empty()
+    if errors:
+        raise MapChunkError(temp, errors)
 
     return temp
 
@@ -72,30 +87,55 @@ def split_text(text, chunk_size, chunk_overlap):
     split_docs = text_splitter.split_documents(file_content)
     return split_docs
 
+@st.cache_data(max_entries=STAGE_CACHE_MAX_ENTRIES, ttl=STAGE_CACHE_TTL, show_spinner=False)
+def cached_split(file_hash, chunk_size, chunk_overlap, _text):
+    return [doc.page_content for doc in split_text(_text, chunk_size, chunk_overlap)]
+
+@st.cache_resource
+def map_stage_cache():
+    return TTLCache(ttl=STAGE_CACHE_TTL, max_entries=STAGE_CACHE_MAX_ENTRIES)
+
+# One entry per map pass, so passes with the same chunking share it
+def cached_map(file_hash, chunk_size, chunk_overlap, model, chunks, max_concurrency):
+    key = (file_hash, chunk_size, chunk_overlap, model)
+    results = map_stage_cache().get(key)
+    if results is None:
+        results = process_map_results([Document(page_content=chunk) for chunk in chunks], model, max_concurrency)
+        map_stage_cache().set(key, results)
+    return results
+
+# map_key names the reduce input: the chunkings and whether they were mapped
+@st.cache_data(max_entries=STAGE_CACHE_MAX_ENTRIES, ttl=STAGE_CACHE_TTL, show_spinner=False)
+def cached_reduce(file_hash, map_key, token_max, model, _contents):
+    return process_reduce_results(_contents, token_max, model)
+
 # Process the file
-def process_file(button,model,uploaded_file, chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, temperature, token_max):
+def process_file(button,model,uploaded_file, chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, temperature, token_max, max_concurrency=4):
     file_name = uploaded_file.name.split(".")[0]
-    file_content = uploaded_file.getvalue().decode("utf-8")
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    file_content = file_bytes.decode("utf-8")
     st.write(f"文件長度: {len(file_content)}")
     
 
     # First map stage
-    split_docs1 = split_text(file_content, chunk_size_1, chunk_overlap_1)
+    split_docs1 = cached_split(file_hash, chunk_size_1, chunk_overlap_1, file_content)
     # Second map stage
-    split_docs2 = split_text(file_content, chunk_size_2, chunk_overlap_2)
+    split_docs2 = cached_split(file_hash, chunk_size_2, chunk_overlap_2, file_content)
     if button==False:
-        first_map_results = process_map_results(split_docs1,model)
+        first_map_results = cached_map(file_hash, chunk_size_1, chunk_overlap_1, model, split_docs1, max_concurrency)
         st.text_area("Map 1:",first_map_results, height=200)
 
-        second_map_results = process_map_results(split_docs2,model)
+        second_map_results = cached_map(file_hash, chunk_size_2, chunk_overlap_2, model, split_docs2, max_concurrency)
         st.text_area("Map 2:",second_map_results, height=200)
         combined_map_results = first_map_results + second_map_results
     else:
         combined_map_results = split_docs1+split_docs2
     # st.write(len(combined_map_results))
 
-    # Reduce stage
-    response=process_reduce_results(combined_map_results,token_max,model)
+    # Reduce stage; the chains always run at temperature 0, so temperature is not part of any key
+    map_key = (chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, not button)
+    response=cached_reduce(file_hash, map_key, token_max, model, combined_map_results)
 
     return response, file_name
 
@@ -105,6 +145,7 @@ def main():
     if 'response' not in st.session_state:
         st.session_state['response'] = None
         st.session_state['file_name'] = ""
+        st.session_state['run_key'] = None
     
     tab1, tab2,tab3 = st.tabs(["Summary", "Settings","Evaluation"])
     with tab3:
@@ -121,13 +162,20 @@ def main():
         chunk_overlap_2 = st.number_input("Chunk overlap 2", value=0, min_value=0, max_value=100000, step=100)
         token_max = st.number_input("Token max", value=16000, min_value=1, max_value=100000, step=100, help="將Map生成的內容長度再次進行分割，避免超過LLM的長度限制")
         temperature = st.slider('Temperature', 0.0, 2.0, step=0.1)
+        max_concurrency = st.number_input("Max concurrency", value=4, min_value=1, max_value=32, step=1, help="Map 階段同時進行的 LLM 呼叫數")
 
     with tab1:
         uploaded_file = st.file_uploader("選擇文件", type=["txt"])
-        if uploaded_file is not None and (uploaded_file.name.split(".")[0] != st.session_state['file_name']):
+        # Re-run whenever the file or a setting changes; unchanged stages come from the stage caches
+        # Keyed on the content, so re-uploading the same file does not re-run anything
+        file_hash = None if uploaded_file is None else hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        run_key = None if file_hash is None else (file_hash, button, model, chunk_size_1, chunk_overlap_1,
+                                                  chunk_size_2, chunk_overlap_2, token_max)
+        if run_key is not None and run_key != st.session_state['run_key']:
             with st.spinner("處理中..."):
                 start = time.time()
-                st.session_state['response'], st.session_state['file_name'] = process_file(button,model,uploaded_file, chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, temperature, token_max)
+                st.session_state['response'], st.session_state['file_name'] = process_file(button,model,uploaded_file, chunk_size_1, chunk_overlap_1, chunk_size_2, chunk_overlap_2, temperature, token_max, max_concurrency)
+                st.session_state['run_key'] = run_key
                 end=time.time()
                 st.success(f"處理完成!耗時{round(end-start)}秒")
 